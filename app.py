@@ -48,6 +48,20 @@ def create_app(config_class=Config):
     app.register_blueprint(events_bp)
     app.register_blueprint(entretiens, url_prefix='/entretiens')
     
+    # Services partagés (écouteurs de session, commandes CLI)
+    from services import search, imports, recurrence, ledger, reports, cube, receivables, money, scheduler, maintenance, notifications
+    search.init_app(app)
+    imports.init_app(app)
+    recurrence.init_app(app)
+    ledger.init_app(app)
+    reports.init_app(app)
+    cube.init_app(app)
+    receivables.init_app(app)
+    money.init_app(app)
+    maintenance.init_app(app)
+    notifications.init_app(app)
+    scheduler.init_app(app)
+    
     # Création des dossiers nécessaires
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
         os.makedirs(app.config['UPLOAD_FOLDER'])
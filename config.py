@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 
 class Config:
@@ -19,3 +20,14 @@ class Config:
     
     # Configuration des fichiers autorisés
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
+    
+    # Tâches planifiées dans le processus web (un seul worker exécute chaque tâche, voir services/scheduler.py)
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', '1') == '1'
+    SCHEDULER_TICK = 30  # secondes entre deux vérifications
+    SCHEDULER_LOCK_DIR = os.environ.get('SCHEDULER_LOCK_DIR') or os.path.join(tempfile.gettempdir(), 'omh-scheduler')
+
+    # Notifications poussées en Server-Sent Events (services/notifications.py), limites par worker
+    NOTIFICATIONS_MAX_STREAMS = int(os.environ.get('NOTIFICATIONS_MAX_STREAMS', 20))
+    NOTIFICATIONS_HEARTBEAT = 15  # secondes entre deux messages de maintien de connexion
+    NOTIFICATIONS_STREAM_LIFETIME = 300  # secondes avant de rendre le worker (le navigateur se reconnecte)
+    NOTIFICATIONS_RETENTION_DAYS = 90  # notifications lues archivées au-delà
@@ -0,0 +1,40 @@
+"""Index des colonnes de date utilisées par les rapports
+
+Revision ID: 3f1c2a9d8b10
+Revises: 
+Create Date: 2026-10-18 15:20:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d8b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# (table, nom de l'index, colonnes): filtres de période `col >= debut AND col < fin`
+INDEXES = (
+    ('paiements', 'ix_paiements_date_paiement', ['date_paiement']),
+    ('depenses', 'ix_depenses_date_depense', ['date_depense']),
+    ('trips', 'ix_trips_date_depart_id_trip', ['date_depart', 'id_trip']),
+)
+
+
+def _existing(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    # Une base créée par db.create_all() possède déjà ces index
+    for table, name, columns in INDEXES:
+        if name not in _existing(table):
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for table, name, columns in INDEXES:
+        if name in _existing(table):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,56 @@
+"""Créances par voyage et par client
+
+Revision ID: 7a4e91c0d2b3
+Revises: 3f1c2a9d8b10
+Create Date: 2026-10-18 17:05:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4e91c0d2b3'
+down_revision = '3f1c2a9d8b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Une base créée par db.create_all() possède déjà ces tables
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'creances' not in tables:
+        op.create_table(
+            'creances',
+            sa.Column('id_trip', sa.Integer(), nullable=False),
+            sa.Column('client_nom', sa.String(length=100), nullable=False),
+            sa.Column('date_origine', sa.Date(), nullable=False),
+            sa.Column('montant_du', sa.Numeric(12, 2), nullable=False),
+            sa.Column('montant_paye', sa.Numeric(12, 2), nullable=False),
+            sa.Column('solde', sa.Numeric(12, 2), nullable=False),
+            sa.Column('ouverte', sa.Boolean(), nullable=False),
+            sa.PrimaryKeyConstraint('id_trip')
+        )
+        op.create_index('ix_creances_client_nom', 'creances', ['client_nom'])
+        op.create_index('ix_creances_ouverte_date_origine', 'creances', ['ouverte', 'date_origine', 'id_trip'])
+    if 'creances_clients' not in tables:
+        op.create_table(
+            'creances_clients',
+            sa.Column('client_nom', sa.String(length=100), nullable=False),
+            sa.Column('montant_du', sa.Numeric(14, 2), nullable=False),
+            sa.Column('montant_paye', sa.Numeric(14, 2), nullable=False),
+            sa.Column('solde', sa.Numeric(14, 2), nullable=False),
+            sa.Column('nb_ouvertes', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('client_nom')
+        )
+
+    # Remplissage initial depuis les voyages et les paiements existants
+    from services import receivables
+    receivables.rebuild(op.get_bind())
+
+
+def downgrade():
+    op.drop_table('creances_clients')
+    op.drop_index('ix_creances_ouverte_date_origine', table_name='creances')
+    op.drop_index('ix_creances_client_nom', table_name='creances')
+    op.drop_table('creances')
@@ -0,0 +1,38 @@
+"""Cumuls journaliers des paiements et des dépenses
+
+Revision ID: 8c2f5d1e9a47
+Revises: 7a4e91c0d2b3
+Create Date: 2026-10-18 17:40:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2f5d1e9a47'
+down_revision = '7a4e91c0d2b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Une base créée par db.create_all() possède déjà cette table
+    if 'finances_journalieres' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'finances_journalieres',
+            sa.Column('jour', sa.Date(), nullable=False),
+            sa.Column('nature', sa.String(length=10), nullable=False),
+            sa.Column('cle', sa.String(length=20), nullable=False),
+            sa.Column('montant', sa.Numeric(14, 2), nullable=False),
+            sa.Column('nombre', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('jour', 'nature', 'cle')
+        )
+
+    # Remplissage initial depuis les paiements et les dépenses existants
+    from services import ledger
+    ledger.rebuild(op.get_bind())
+
+
+def downgrade():
+    op.drop_table('finances_journalieres')
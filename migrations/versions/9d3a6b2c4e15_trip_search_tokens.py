@@ -0,0 +1,41 @@
+"""Index de trigrammes de la recherche de voyages
+
+Revision ID: 9d3a6b2c4e15
+Revises: 8c2f5d1e9a47
+Create Date: 2026-10-18 17:50:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3a6b2c4e15'
+down_revision = '8c2f5d1e9a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Une base créée par db.create_all() possède déjà cette table
+    if 'trip_search_tokens' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'trip_search_tokens',
+            sa.Column('token', sa.String(length=8), nullable=False),
+            sa.Column('id_trip', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('poids', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('token', 'id_trip')
+        )
+        op.create_index('ix_trip_search_tokens_id_trip', 'trip_search_tokens', ['id_trip'])
+
+    # Indexation des voyages existants (comme `flask reindex-trips`)
+    from services import search
+    connection = op.get_bind()
+    trip_ids = connection.execute(sa.text('SELECT id_trip FROM trips')).scalars().all()
+    connection.execute(sa.text('DELETE FROM trip_search_tokens'))
+    search.reindex_trips(connection, trip_ids)
+
+
+def downgrade():
+    op.drop_index('ix_trip_search_tokens_id_trip', table_name='trip_search_tokens')
+    op.drop_table('trip_search_tokens')
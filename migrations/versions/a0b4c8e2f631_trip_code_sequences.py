@@ -0,0 +1,32 @@
+"""Compteurs journaliers des codes voyage
+
+Revision ID: a0b4c8e2f631
+Revises: 9d3a6b2c4e15
+Create Date: 2026-10-18 17:55:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a0b4c8e2f631'
+down_revision = '9d3a6b2c4e15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Une base créée par db.create_all() possède déjà cette table. Pas de remplissage: le compteur
+    # d'un jour est initialisé au premier code réservé depuis les codes existants (services/sequences.py)
+    if 'trip_code_sequences' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'trip_code_sequences',
+            sa.Column('jour', sa.Date(), nullable=False),
+            sa.Column('dernier', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('jour')
+        )
+
+
+def downgrade():
+    op.drop_table('trip_code_sequences')
@@ -0,0 +1,33 @@
+"""Instantanés des rapports mensuels clos
+
+Revision ID: a7d2e9f15c84
+Revises: a0b4c8e2f631
+Create Date: 2026-10-18 18:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d2e9f15c84'
+down_revision = 'a0b4c8e2f631'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Une base créée par db.create_all() possède déjà cette table; les instantanés sont calculés à la demande
+    if 'rapport_snapshots' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'rapport_snapshots',
+            sa.Column('annee', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('mois', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('donnees', sa.Text(), nullable=False),
+            sa.Column('calcule_le', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('annee', 'mois')
+        )
+
+
+def downgrade():
+    op.drop_table('rapport_snapshots')
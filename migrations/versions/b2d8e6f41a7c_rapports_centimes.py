@@ -0,0 +1,25 @@
+"""Instantanés de rapports en centimes entiers
+
+Revision ID: b2d8e6f41a7c
+Revises: a7d2e9f15c84
+Create Date: 2026-10-18 18:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d8e6f41a7c'
+down_revision = 'a7d2e9f15c84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Les instantanés existants contiennent des montants en float: ils seront recalculés à la demande
+    op.execute(sa.text('DELETE FROM rapport_snapshots'))
+
+
+def downgrade():
+    op.execute(sa.text('DELETE FROM rapport_snapshots'))
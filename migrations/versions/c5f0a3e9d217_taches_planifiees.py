@@ -0,0 +1,38 @@
+"""Tâches planifiées
+
+Revision ID: c5f0a3e9d217
+Revises: b2d8e6f41a7c
+Create Date: 2026-10-18 19:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f0a3e9d217'
+down_revision = 'b2d8e6f41a7c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Une base créée par db.create_all() possède déjà cette table
+    if 'taches_planifiees' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'taches_planifiees',
+        sa.Column('nom', sa.String(length=50), nullable=False),
+        sa.Column('planification', sa.String(length=100), nullable=False),
+        sa.Column('actif', sa.Boolean(), nullable=False),
+        sa.Column('prochaine_execution', sa.DateTime(), nullable=True),
+        sa.Column('derniere_execution', sa.DateTime(), nullable=True),
+        sa.Column('dernier_statut', sa.Enum('en_cours', 'succes', 'erreur'), nullable=True),
+        sa.Column('dernier_message', sa.Text(), nullable=True),
+        sa.Column('duree_ms', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('nom')
+    )
+
+
+def downgrade():
+    op.drop_table('taches_planifiees')
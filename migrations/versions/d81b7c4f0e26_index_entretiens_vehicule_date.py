@@ -0,0 +1,33 @@
+"""Index du dernier entretien par véhicule
+
+Revision ID: d81b7c4f0e26
+Revises: c5f0a3e9d217
+Create Date: 2026-10-18 19:40:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81b7c4f0e26'
+down_revision = 'c5f0a3e9d217'
+branch_labels = None
+depends_on = None
+
+
+def _existing():
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('entretiens_vehicules')}
+
+
+def upgrade():
+    # Une base créée par db.create_all() possède déjà cet index
+    if 'ix_entretiens_vehicule_date' not in _existing():
+        op.create_index(
+            'ix_entretiens_vehicule_date', 'entretiens_vehicules', ['id_vehicule', 'date_entretien', 'id_entretien']
+        )
+
+
+def downgrade():
+    if 'ix_entretiens_vehicule_date' in _existing():
+        op.drop_index('ix_entretiens_vehicule_date', table_name='entretiens_vehicules')
@@ -0,0 +1,52 @@
+"""Archive des notifications et index des non lues
+
+Revision ID: e3a9c5d70b18
+Revises: d81b7c4f0e26
+Create Date: 2026-10-18 21:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a9c5d70b18'
+down_revision = 'd81b7c4f0e26'
+branch_labels = None
+depends_on = None
+
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+
+def upgrade():
+    # Une base créée par db.create_all() possède déjà la table et l'index
+    inspector = _inspector()
+    if 'ix_notifications_read_id' not in {index['name'] for index in inspector.get_indexes('notifications')}:
+        op.create_index('ix_notifications_read_id', 'notifications', ['read', 'id'])
+    if 'notifications_archive' in inspector.get_table_names():
+        return
+    op.create_table(
+        'notifications_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('id_vehicule', sa.Integer(), nullable=False),
+        sa.Column('id_entretien', sa.Integer(), nullable=False),
+        sa.Column('message', sa.String(length=255), nullable=False),
+        sa.Column('severity', sa.String(length=50), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_notifications_archive_id_vehicule', 'notifications_archive', ['id_vehicule'], unique=False
+    )
+
+
+def downgrade():
+    inspector = _inspector()
+    if 'notifications_archive' in inspector.get_table_names():
+        op.drop_index('ix_notifications_archive_id_vehicule', table_name='notifications_archive')
+        op.drop_table('notifications_archive')
+    if 'ix_notifications_read_id' in {index['name'] for index in inspector.get_indexes('notifications')}:
+        op.drop_index('ix_notifications_read_id', table_name='notifications')
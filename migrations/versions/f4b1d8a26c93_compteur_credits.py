@@ -0,0 +1,43 @@
+"""Distance des voyages terminés reportée aux compteurs
+
+Revision ID: f4b1d8a26c93
+Revises: e3a9c5d70b18
+Create Date: 2026-10-19 09:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b1d8a26c93'
+down_revision = 'e3a9c5d70b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Une base créée par db.create_all() possède déjà cette table
+    if 'compteur_credits' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'compteur_credits',
+            sa.Column('id_trip', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('id_vehicule', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('km', sa.Float(), nullable=False),
+            sa.PrimaryKeyConstraint('id_trip', 'id_vehicule')
+        )
+
+    # Les voyages déjà terminés sont réputés inclus dans les compteurs saisis: on note leur
+    # crédit sans toucher aux compteurs, pour qu'une correction de distance ou de véhicule parte du bon montant
+    op.execute(
+        "INSERT INTO compteur_credits (id_trip, id_vehicule, km) "
+        "SELECT DISTINCT a.id_trip, a.id_vehicule, t.distance "
+        "FROM trip_affectations a JOIN trips t ON t.id_trip = a.id_trip "
+        "WHERE t.etat_trip = 'Terminé' AND t.distance IS NOT NULL AND t.distance <> 0 "
+        "AND NOT EXISTS (SELECT 1 FROM compteur_credits c "
+        "WHERE c.id_trip = a.id_trip AND c.id_vehicule = a.id_vehicule)"
+    )
+
+
+def downgrade():
+    op.drop_table('compteur_credits')
@@ -127,6 +127,10 @@ class Chauffeur(db.Model):
 
 class Trip(db.Model):
     __tablename__ = 'trips'
+    __table_args__ = (
+        # Clé de la pagination par curseur et des filtres de période sur date_depart
+        db.Index('ix_trips_date_depart_id_trip', 'date_depart', 'id_trip'),
+    )
     
     id_trip = db.Column(db.Integer, primary_key=True, autoincrement=True)
     nom_voyage = db.Column(db.String(255), nullable=False, unique=True)
@@ -181,6 +185,13 @@ class Trip(db.Model):
     def chauffeurs(self):
         return [affectation.chauffeur for affectation in self.affectations]
 
+class TripCodeSequence(db.Model):
+    __tablename__ = 'trip_code_sequences'
+    
+    # Dernier numéro attribué par jour de départ (voir services/sequences.py)
+    jour = db.Column(db.Date, primary_key=True)
+    dernier = db.Column(db.Integer, nullable=False, default=0)
+
 class TripAffectation(db.Model):
     __tablename__ = 'trip_affectations'
     
@@ -190,6 +201,14 @@ class TripAffectation(db.Model):
     id_chauffeur = db.Column(db.Integer, db.ForeignKey('chauffeurs.id_chauffeur'), nullable=False)
     date_affectation = db.Column(db.DateTime, default=datetime.utcnow)
 
+class TripSearchToken(db.Model):
+    __tablename__ = 'trip_search_tokens'
+    
+    # Index inversé de trigrammes maintenu par services/search.py
+    token = db.Column(db.String(8), primary_key=True)
+    id_trip = db.Column(db.Integer, primary_key=True, index=True)
+    poids = db.Column(db.Integer, nullable=False, default=1)
+
 class TripDepense(db.Model):
     __tablename__ = 'trip_depenses'
     
@@ -212,12 +231,16 @@ class Paiement(db.Model):
     banque = db.Column(db.String(100))
     numero_cheque = db.Column(db.String(100))
     image_cheque = db.Column(db.String(255))
-    date_paiement = db.Column(db.DateTime, default=datetime.utcnow)
+    date_paiement = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     recu_par = db.Column(db.Integer, db.ForeignKey('users.id_user'))
     notes = db.Column(db.Text)
 
 class EntretienVehicule(db.Model):
     __tablename__ = 'entretiens_vehicules'
+    __table_args__ = (
+        # Dernier entretien de chaque véhicule (ROW_NUMBER() par véhicule, voir services/maintenance.py)
+        db.Index('ix_entretiens_vehicule_date', 'id_vehicule', 'date_entretien', 'id_entretien'),
+    )
     
     id_entretien = db.Column(db.Integer, primary_key=True, autoincrement=True)
     id_vehicule = db.Column(db.Integer, db.ForeignKey('vehicules.id_vehicule'), nullable=False)
@@ -247,18 +270,105 @@ class Notification(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     read = db.Column(db.Boolean, default=False)
 
+    # Non lues par identifiant: compteurs, curseur du flux SSE et acquittement groupé
+    __table_args__ = (
+        db.Index('ix_notifications_read_id', 'read', 'id'),
+    )
+
+class NotificationArchive(db.Model):
+    __tablename__ = 'notifications_archive'
+
+    # Notifications lues déplacées après la durée de rétention (voir services/notifications.py)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    id_vehicule = db.Column(db.Integer, nullable=False, index=True)
+    id_entretien = db.Column(db.Integer, nullable=False)
+    message = db.Column(db.String(255), nullable=False)
+    severity = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 class Depense(db.Model):
     __tablename__ = 'depenses'
     
     id_depense = db.Column(db.Integer, primary_key=True, autoincrement=True)
     categorie = db.Column(db.Enum('Carburant', 'Entretien', 'Assurance', 'Salaires', 'Taxes', 'Autre'), nullable=False)
     montant = db.Column(db.Numeric(10, 2), nullable=False)
-    date_depense = db.Column(db.Date, nullable=False)
+    date_depense = db.Column(db.Date, nullable=False, index=True)
     description = db.Column(db.Text)
     id_vehicule = db.Column(db.Integer, db.ForeignKey('vehicules.id_vehicule'))
     created_by = db.Column(db.Integer, db.ForeignKey('users.id_user'), nullable=False)
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
 
+class FinanceJournaliere(db.Model):
+    __tablename__ = 'finances_journalieres'
+
+    # Cumuls par jour des paiements (par mode) et des dépenses (par catégorie), voir services/ledger.py
+    jour = db.Column(db.Date, primary_key=True)
+    nature = db.Column(db.String(10), primary_key=True)
+    cle = db.Column(db.String(20), primary_key=True)
+    montant = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    nombre = db.Column(db.Integer, nullable=False, default=0)
+
+class RapportSnapshot(db.Model):
+    __tablename__ = 'rapport_snapshots'
+
+    # Rapport financier d'un mois clos, en JSON (voir services/reports.py)
+    annee = db.Column(db.Integer, primary_key=True)
+    mois = db.Column(db.Integer, primary_key=True)
+    donnees = db.Column(db.Text, nullable=False)
+    calcule_le = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Creance(db.Model):
+    __tablename__ = 'creances'
+    __table_args__ = (
+        # Créances ouvertes par ancienneté: parcours d'index sans lire les paiements
+        db.Index('ix_creances_ouverte_date_origine', 'ouverte', 'date_origine', 'id_trip'),
+    )
+
+    # Reste à payer d'un voyage, tenu à jour à chaque écriture (voir services/receivables.py);
+    # pas de clé étrangère: la ligne est retirée après la suppression du voyage, dans le même flush
+    id_trip = db.Column(db.Integer, primary_key=True)
+    client_nom = db.Column(db.String(100), nullable=False, default='', index=True)
+    date_origine = db.Column(db.Date, nullable=False)
+    montant_du = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    montant_paye = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    solde = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    ouverte = db.Column(db.Boolean, nullable=False, default=False)
+
+    trip = db.relationship('Trip', primaryjoin='Trip.id_trip == foreign(Creance.id_trip)', viewonly=True)
+
+class CreanceClient(db.Model):
+    __tablename__ = 'creances_clients'
+
+    # Cumuls des créances par client ('' pour les voyages sans client)
+    client_nom = db.Column(db.String(100), primary_key=True)
+    montant_du = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    montant_paye = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    solde = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    nb_ouvertes = db.Column(db.Integer, nullable=False, default=0)
+
+class CompteurCredit(db.Model):
+    __tablename__ = 'compteur_credits'
+
+    # Distance d'un voyage terminé déjà reportée au compteur d'un véhicule (voir services/maintenance.py).
+    # Sans clé étrangère: la ligne doit survivre à la suppression du voyage dans le même flush.
+    id_trip = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    id_vehicule = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    km = db.Column(db.Float, nullable=False)
+
+class TachePlanifiee(db.Model):
+    __tablename__ = 'taches_planifiees'
+
+    # État des tâches périodiques partagé entre les processus (voir services/scheduler.py)
+    nom = db.Column(db.String(50), primary_key=True)
+    planification = db.Column(db.String(100), nullable=False)
+    actif = db.Column(db.Boolean, nullable=False, default=True)
+    prochaine_execution = db.Column(db.DateTime)
+    derniere_execution = db.Column(db.DateTime)
+    dernier_statut = db.Column(db.Enum('en_cours', 'succes', 'erreur'))
+    dernier_message = db.Column(db.Text)
+    duree_ms = db.Column(db.Integer)
+
 class Evenement(db.Model):
     __tablename__ = 'evenements'
     
@@ -1,61 +1,98 @@
-from flask import Blueprint, render_template, jsonify
-from models import Trip, Vehicule, Chauffeur, db
+from flask import Blueprint, render_template, jsonify, request, abort
+from models import Trip, TripAffectation, db
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
+from datetime import date, datetime, timedelta
+from services import recurrence
 
 calendrier_bp = Blueprint('calendrier', __name__, url_prefix='/calendrier')
 
-@calendrier_bp.route('/')
-def afficher_calendrier():
-    # Récupérer tous les voyages avec les relations chauffeur et véhicule
-    trips = db.session.query(Trip)\
-        .join(Vehicule, Trip.id_vehicule == Vehicule.id_vehicule)\
-        .join(Chauffeur, Trip.id_chauffeur == Chauffeur.id_chauffeur)\
-        .all()
-    
-    # Transformer les voyages en format JSON compatible avec FullCalendar
+def _window():
+    """Fenêtre demandée par FullCalendar (?start=&end=), par défaut -6 mois / +12 mois (ValueError si illisible)"""
+    today = date.today()
+    start = request.args.get('start')
+    end = request.args.get('end')
+    window_start = datetime.fromisoformat(start[:10]) if start else datetime.combine(today - timedelta(days=183), datetime.min.time())
+    window_end = datetime.fromisoformat(end[:10]) if end else datetime.combine(today + timedelta(days=366), datetime.min.time())
+    return window_start, window_end
+
+def _description(trip):
+    chauffeurs = ', '.join(f"{a.chauffeur.nom} {a.chauffeur.prenom}" for a in trip.affectations) or 'Non affecté'
+    vehicules = ', '.join(f"{a.vehicule.matricule} - {a.vehicule.modele}" for a in trip.affectations) or 'Non affecté'
+    passagers = (trip.nombre_adultes or 0) + (trip.nombre_enfants or 0) + (trip.nombre_bebes or 0)
+    prix = trip.commission if trip.is_commission else trip.prix_vente
+    return f"""
+                <strong>Client:</strong> {trip.client_nom}<br>
+                <strong>Téléphone:</strong> {trip.client_telephone}<br>
+                <strong>Chauffeur:</strong> {chauffeurs}<br>
+                <strong>Véhicule:</strong> {vehicules}<br>
+                <strong>Passagers:</strong> {passagers}<br>
+                <strong>Prix:</strong> {prix if prix is not None else '-'}€
+            """.strip()
+
+def _color(trip):
+    return '#007bff' if trip.etat_trip == 'Planifié' else '#28a745' if trip.etat_trip == 'En cours' else '#dc3545'
+
+def calendar_events(window_start, window_end):
+    """Voyages de la fenêtre au format FullCalendar; les voyages récurrents sont développés par occurrence"""
+    options = (
+        selectinload(Trip.affectations).joinedload(TripAffectation.vehicule),
+        selectinload(Trip.affectations).joinedload(TripAffectation.chauffeur)
+    )
+    trips = Trip.query.options(*options).filter(
+        or_(Trip.is_recurring.is_(False), Trip.is_recurring.is_(None)),
+        Trip.date_depart < window_end.date(),
+        or_(Trip.date_depart >= window_start.date(), Trip.date_arrivee >= window_start.date())
+    ).all()
+
     voyages = [
         {
             'id': trip.id_trip,
             'title': f"{trip.type} - {trip.point_depart} -> {trip.point_arrivee}",
             'start': f"{trip.date_depart}T{trip.heure_depart}",
             'end': f"{trip.date_arrivee}T{trip.heure_arrivee}" if trip.date_arrivee and trip.heure_arrivee else None,
-            'description': f"""
-                <strong>Client:</strong> {trip.client_nom}<br>
-                <strong>Téléphone:</strong> {trip.client_telephone}<br>
-                <strong>Chauffeur:</strong> {trip.chauffeur.nom} {trip.chauffeur.prenom}<br>
-                <strong>Véhicule:</strong> {trip.vehicule.matricule} - {trip.vehicule.modele}<br>
-                <strong>Passagers:</strong> {trip.nombre_passagers}<br>
-                <strong>Prix:</strong> {trip.prix}€
-            """.strip(),
-            'backgroundColor': '#007bff' if trip.etat_trip == 'Planifié' else '#28a745' if trip.etat_trip == 'En cours' else '#dc3545'
+            'description': _description(trip),
+            'backgroundColor': _color(trip)
         }
         for trip in trips
     ]
-    
+
+    rules = recurrence.get_rules(window_start, window_end)
+    recurring = {}
+    if rules:
+        recurring = {
+            trip.id_trip: trip
+            for trip in Trip.query.options(*options).filter(Trip.id_trip.in_([rule.id_trip for rule in rules]))
+        }
+    for rule in rules:
+        trip = recurring[rule.id_trip]
+        for occurrence in rule.occurrences(window_start, window_end):
+            voyages.append({
+                'id': f"{trip.id_trip}-{occurrence.date.isoformat()}",
+                'groupId': trip.id_trip,
+                'title': f"{trip.type} - {trip.point_depart} -> {trip.point_arrivee}",
+                'start': occurrence.debut.isoformat(),
+                'end': occurrence.fin.isoformat(),
+                'description': _description(trip),
+                'backgroundColor': _color(trip)
+            })
+    return voyages
+
+@calendrier_bp.route('/')
+def afficher_calendrier():
+    # Récupérer les voyages de la période avec les affectations (chauffeurs et véhicules)
+    try:
+        window = _window()
+    except ValueError:
+        abort(400, 'Période invalide')
+    voyages = calendar_events(*window)
     return render_template('calendrier.html', voyages=voyages)
 
 @calendrier_bp.route('/api/voyages', methods=['GET'])
 def api_voyages():
-    trips = db.session.query(Trip)\
-        .join(Vehicule, Trip.id_vehicule == Vehicule.id_vehicule)\
-        .join(Chauffeur, Trip.id_chauffeur == Chauffeur.id_chauffeur)\
-        .all()
-        
-    voyages = [
-        {
-            'id': trip.id_trip,
-            'title': f"{trip.type} - {trip.point_depart} -> {trip.point_arrivee}",
-            'start': f"{trip.date_depart}T{trip.heure_depart}",
-            'end': f"{trip.date_arrivee}T{trip.heure_arrivee}" if trip.date_arrivee and trip.heure_arrivee else None,
-            'description': f"""
-                <strong>Client:</strong> {trip.client_nom}<br>
-                <strong>Téléphone:</strong> {trip.client_telephone}<br>
-                <strong>Chauffeur:</strong> {trip.chauffeur.nom} {trip.chauffeur.prenom}<br>
-                <strong>Véhicule:</strong> {trip.vehicule.matricule} - {trip.vehicule.modele}<br>
-                <strong>Passagers:</strong> {trip.nombre_passagers}<br>
-                <strong>Prix:</strong> {trip.prix}€
-            """.strip(),
-            'backgroundColor': '#007bff' if trip.etat_trip == 'Planifié' else '#28a745' if trip.etat_trip == 'En cours' else '#dc3545'
-        }
-        for trip in trips
-    ]
-    return jsonify(voyages)
\ No newline at end of file
+    try:
+        window = _window()
+    except ValueError:
+        return jsonify({'error': 'Période invalide'}), 400
+    voyages = calendar_events(*window)
+    return jsonify(voyages)
@@ -1,10 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, Response
 from models import db, EntretienVehicule, Vehicule, Notification
 from flask_login import login_required, current_user
 from datetime import datetime, date
 from decimal import Decimal
 import os
 from werkzeug.utils import secure_filename
+from services import forecast, notifications
 
 entretiens = Blueprint('entretiens', __name__)
 
@@ -13,51 +14,10 @@ ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def check_maintenance_notifications():
-    vehicles = Vehicule.query.all()
-    notifications = []
-    
-    for vehicle in vehicles:
-        latest_maintenance = EntretienVehicule.query.filter_by(id_vehicule=vehicle.id_vehicule).order_by(EntretienVehicule.date_entretien.desc()).first()
-        
-        if latest_maintenance:
-            km_actuel = vehicle.kilometrage_vehicule
-            km_diff = latest_maintenance.kilometrage_suivant - km_actuel
-            
-            if km_diff <= 500 and not Notification.query.filter_by(
-                id_vehicule=vehicle.id_vehicule,
-                id_entretien=latest_maintenance.id_entretien,
-                severity='red',
-                read=False
-            ).first():
-                notif = Notification(
-                    id_vehicule=vehicle.id_vehicule,
-                    id_entretien=latest_maintenance.id_entretien,
-                    message=f"URGENT: Entretien nécessaire pour {vehicle.matricule} dans moins de 500 km",
-                    severity='red'
-                )
-                db.session.add(notif)
-                
-            elif km_diff <= 1000 and not Notification.query.filter_by(
-                id_vehicule=vehicle.id_vehicule,
-                id_entretien=latest_maintenance.id_entretien,
-                severity='yellow',
-                read=False
-            ).first():
-                notif = Notification(
-                    id_vehicule=vehicle.id_vehicule,
-                    id_entretien=latest_maintenance.id_entretien,
-                    message=f"Entretien à prévoir pour {vehicle.matricule} dans moins de 1000 km",
-                    severity='yellow'
-                )
-                db.session.add(notif)
-    
-    db.session.commit()
-
 @entretiens.route('/')
 @login_required
 def index():
-    check_maintenance_notifications()
+    # Les notifications sont évaluées à chaque changement de compteur ou d'entretien (services/maintenance.py)
     entretiens = EntretienVehicule.query.order_by(EntretienVehicule.date_entretien.desc()).all()
     return render_template('entretiens/manage.html', entretiens=entretiens)
 
@@ -136,8 +96,8 @@ def edit(id):
             entretien.facture_reference = request.form['facture_reference']
             entretien.pieces = pieces
             
+            # Les notifications du véhicule sont réévaluées au flush (services.maintenance)
             db.session.commit()
-            check_maintenance_notifications()
             
             flash('Entretien mis à jour avec succès!', 'success')
             return redirect(url_for('entretiens.index'))
@@ -146,6 +106,18 @@ def edit(id):
     
     return render_template('entretiens/edit.html', entretien=entretien, vehicules=vehicules)
 
+@entretiens.route('/api/previsions')
+@login_required
+def api_previsions():
+    # Entretiens prévus dans les ?jours= prochains jours (30 par défaut), rythme estimé sur ?semaines=
+    jours = min(max(request.args.get('jours', forecast.DUE_DAYS, type=int), 0), forecast.HORIZON_DAYS)
+    semaines = min(max(request.args.get('semaines', forecast.WINDOW_WEEKS, type=int), 1), 52)
+    return jsonify({
+        'jours': jours,
+        'semaines': semaines,
+        'vehicules': forecast.services_due(jours, weeks=semaines)
+    })
+
 @entretiens.route('/details/<int:id>')
 @login_required
 def details(id):
@@ -180,18 +152,83 @@ def delete(id):
 @entretiens.route('/notifications')
 @login_required
 def get_notifications():
-    notifications = Notification.query.filter_by(read=False).order_by(Notification.created_at.desc()).all()
-    return jsonify([{
-        'id': n.id,
-        'message': n.message,
-        'severity': n.severity,
-        'created_at': n.created_at.strftime('%Y-%m-%d %H:%M')
-    } for n in notifications])
+    # ?since_id=N: seules les notifications non lues plus récentes que N (repli du flux SSE)
+    since_id = request.args.get('since_id', type=int)
+    if since_id is not None:
+        return jsonify([notifications.as_json(row) for row in notifications.since(since_id)])
+    rows = Notification.query.filter_by(read=False).order_by(Notification.created_at.desc()).all()
+    return jsonify([notifications.as_json(n) for n in rows])
+
+@entretiens.route('/notifications/stream')
+@login_required
+def notifications_stream():
+    """Flux Server-Sent Events des nouvelles notifications, repris au curseur Last-Event-ID"""
+    config = current_app.config
+    if not notifications.broker.subscribe(config['NOTIFICATIONS_MAX_STREAMS']):
+        return jsonify({'error': 'Trop de flux ouverts, utilisez /entretiens/notifications?since_id='}), 503, {
+            'Retry-After': str(config['NOTIFICATIONS_HEARTBEAT'])
+        }
+    cursor = request.headers.get('Last-Event-ID', type=int)
+    if cursor is None:
+        cursor = request.args.get('since_id', type=int)
+    stream = notifications.broker.stream(
+        db.engine, cursor, config['NOTIFICATIONS_HEARTBEAT'], config['NOTIFICATIONS_STREAM_LIFETIME']
+    )
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
-@entretiens.route('/notifications/mark-read/<int:id>')
+@entretiens.route('/notifications/mark-read/<int:id>', methods=['POST'])
 @login_required
 def mark_notification_read(id):
-    notification = Notification.query.get_or_404(id)
-    notification.read = True
+    # Même règle que /notifications/acquitter: pas de réémission pour le même entretien et la même sévérité
+    if not notifications.acknowledge(ids=[id]) and db.session.get(Notification, id) is None:
+        return jsonify({'error': 'Notification introuvable'}), 404
+    db.session.commit()
+    return jsonify({'success': True})
+
+@entretiens.route('/notifications/non-lues')
+@login_required
+def notifications_unread():
+    # Compteurs du badge, par sévérité (mis en cache, voir services/notifications.py)
+    return jsonify(notifications.unread_counts())
+
+@entretiens.route('/notifications/historique')
+@login_required
+def notifications_history():
+    # ?etat=toutes|non_lues|lues, ?severite=, ?cursor=, ?per_page=
+    try:
+        page = notifications.history(
+            etat=request.args.get('etat', 'toutes'),
+            severite=request.args.get('severite'),
+            cursor=request.args.get('cursor'),
+            per_page=min(request.args.get('per_page', 20, type=int), 200)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'items': [notifications.as_json(n) for n in page],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor
+    })
+
+@entretiens.route('/notifications/acquitter', methods=['POST'])
+@login_required
+def notifications_acknowledge():
+    # {"ids": [1, 2, 3]} ou {"jusqu_a": 42}: un seul UPDATE.
+    # Une alerte acquittée reste acquittée: elle n'est réémise qu'après un nouvel entretien
+    # ou un passage à une autre sévérité (jaune -> rouge)
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Un objet JSON est attendu'}), 400
+    if data.get('ids') is not None and not isinstance(data['ids'], list):
+        return jsonify({'error': "'ids' doit être une liste"}), 400
+    try:
+        ids = [int(value) for value in data['ids']] if data.get('ids') is not None else None
+        up_to = int(data['jusqu_a']) if data.get('jusqu_a') is not None else None
+        count = notifications.acknowledge(ids=ids, up_to=up_to)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
     db.session.commit()
-    return jsonify({'success': True})
\ No newline at end of file
+    return jsonify({'success': True, 'acquittees': count})
\ No newline at end of file
@@ -1,37 +1,28 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
-from models import Depense, Paiement, Trip, Vehicule, db
-from sqlalchemy import func, extract
+from models import Creance, Depense, Paiement, TripAffectation, Vehicule, db
+from werkzeug.datastructures import MultiDict
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
 from datetime import datetime, date, timedelta
 import calendar
+from decimal import Decimal
+from services import cube, fleet, fuel, ledger, money, periods, receivables, reports
+from services.pagination import keyset_paginate
 
 finances_bp = Blueprint('finances', __name__, url_prefix='/finances')
 
 @finances_bp.route('/')
 @login_required
 def index():
-    # Obtenir la date actuelle et le mois en cours
-    today = date.today()
-    current_month = today.month
-    current_year = today.year
+    # Mois en cours, en période semi-ouverte [1er du mois, 1er du mois suivant[
+    mois_courant = periods.make_period('mois')
     
-    # Calculer les revenus totaux
-    total_revenus = db.session.query(func.sum(Paiement.montant_paye)).scalar() or 0
-    
-    # Calculer les dépenses totales
-    total_depenses = db.session.query(func.sum(Depense.montant)).scalar() or 0
-    
-    # Calculer les revenus du mois en cours
-    revenus_mois = db.session.query(func.sum(Paiement.montant_paye)).filter(
-        extract('month', Paiement.date_paiement) == current_month,
-        extract('year', Paiement.date_paiement) == current_year
-    ).scalar() or 0
-    
-    # Calculer les dépenses du mois en cours
-    depenses_mois = db.session.query(func.sum(Depense.montant)).filter(
-        extract('month', Depense.date_depense) == current_month,
-        extract('year', Depense.date_depense) == current_year
-    ).scalar() or 0
+    # Totaux lus dans les cumuls journaliers (quelques lignes par jour, quel que soit le nombre de paiements)
+    total_revenus = ledger.total(ledger.PAIEMENT)
+    total_depenses = ledger.total(ledger.DEPENSE)
+    revenus_mois = ledger.total(ledger.PAIEMENT, mois_courant.debut, mois_courant.fin)
+    depenses_mois = ledger.total(ledger.DEPENSE, mois_courant.debut, mois_courant.fin)
     
     # Obtenir les derniers paiements
     derniers_paiements = Paiement.query.order_by(Paiement.date_paiement.desc()).limit(5).all()
@@ -47,12 +38,98 @@ def index():
                           derniers_paiements=derniers_paiements,
                           dernieres_depenses=dernieres_depenses)
 
+LEDGER_PER_PAGE = 25
+
+def _ledger_filters(args, date_column, amount_column):
+    """Filtres communs des journaux: période (debut/fin incluses) et fourchette de montant"""
+    filters = []
+    if args.get('debut'):
+        filters.append(periods.from_day(date_column, datetime.strptime(args.get('debut'), '%Y-%m-%d').date()))
+    if args.get('fin'):
+        filters.append(periods.until_day(date_column, datetime.strptime(args.get('fin'), '%Y-%m-%d').date()))
+    if args.get('montant_min'):
+        filters.append(amount_column >= Decimal(args.get('montant_min')))
+    if args.get('montant_max'):
+        filters.append(amount_column <= Decimal(args.get('montant_max')))
+    return filters
+
+def build_paiements_query(args):
+    """Journal des paiements filtré (mode, véhicule affecté au voyage, période, montant)"""
+    query = Paiement.query.options(joinedload(Paiement.trip), joinedload(Paiement.receiver))
+    query = query.filter(*_ledger_filters(args, Paiement.date_paiement, Paiement.montant_paye))
+    if args.get('mode'):
+        query = query.filter(Paiement.mode_paiement == args.get('mode'))
+    if args.get('id_vehicule'):
+        query = query.filter(Paiement.id_trip.in_(
+            select(TripAffectation.id_trip).where(TripAffectation.id_vehicule == args.get('id_vehicule', type=int))
+        ))
+    if args.get('id_trip'):
+        query = query.filter(Paiement.id_trip == args.get('id_trip', type=int))
+    return query
+
+def build_depenses_query(args):
+    """Journal des dépenses filtré (catégorie, véhicule, période, montant)"""
+    query = Depense.query.options(joinedload(Depense.vehicule), joinedload(Depense.creator))
+    query = query.filter(*_ledger_filters(args, Depense.date_depense, Depense.montant))
+    if args.get('categorie'):
+        query = query.filter(Depense.categorie == args.get('categorie'))
+    if args.get('id_vehicule'):
+        query = query.filter(Depense.id_vehicule == args.get('id_vehicule', type=int))
+    return query
+
+def ledger_page(query, sort_columns, id_column, args):
+    """Page d'un journal par curseur sur (colonne de tri, identifiant); ?sort_by=, ?order=, ?cursor="""
+    sort_by = args.get('sort_by')
+    column = sort_columns.get(sort_by) or next(iter(sort_columns.values()))
+    per_page = min(args.get('per_page', LEDGER_PER_PAGE, type=int), 200)
+    return keyset_paginate(
+        query,
+        [column, id_column],
+        cursor=args.get('cursor'),
+        per_page=per_page,
+        descending=args.get('order', 'desc') != 'asc'
+    )
+
+PAIEMENT_SORTS = {'date': Paiement.date_paiement, 'montant': Paiement.montant_paye}
+DEPENSE_SORTS = {'date': Depense.date_depense, 'montant': Depense.montant}
+
+def _filter_vehicules():
+    # Seules les colonnes utiles au filtre par véhicule
+    return db.session.query(Vehicule.id_vehicule, Vehicule.matricule, Vehicule.modele).order_by(Vehicule.matricule).all()
+
+def _invalid_filters(e):
+    return jsonify({'error': f'Filtre invalide : {str(e)}'}), 400
+
 @finances_bp.route('/depenses')
 @login_required
 def depenses():
-    depenses = Depense.query.order_by(Depense.date_depense.desc()).all()
-    vehicules = Vehicule.query.all()
-    return render_template('finances/depenses.html', depenses=depenses, vehicules=vehicules)
+    try:
+        depenses = ledger_page(build_depenses_query(request.args), DEPENSE_SORTS, Depense.id_depense, request.args)
+    except (ValueError, ArithmeticError):
+        flash('Filtre invalide.', 'danger')
+        depenses = ledger_page(build_depenses_query(MultiDict()), DEPENSE_SORTS, Depense.id_depense, MultiDict())
+    return render_template('finances/depenses.html', depenses=depenses, vehicules=_filter_vehicules())
+
+@finances_bp.route('/api/depenses')
+@login_required
+def api_depenses():
+    try:
+        page = ledger_page(build_depenses_query(request.args), DEPENSE_SORTS, Depense.id_depense, request.args)
+    except (ValueError, ArithmeticError) as e:
+        return _invalid_filters(e)
+    return jsonify({
+        'items': [{
+            'id': d.id_depense,
+            'categorie': d.categorie,
+            'montant': money.number(d.montant),
+            'date_depense': d.date_depense.isoformat(),
+            'description': d.description,
+            'vehicule': {'id': d.vehicule.id_vehicule, 'matricule': d.vehicule.matricule} if d.vehicule else None,
+            'cree_par': f"{d.creator.prenom} {d.creator.nom}" if d.creator else None
+        } for d in page],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor
+    })
 
 @finances_bp.route('/add-depense', methods=['GET', 'POST'])
 @login_required
@@ -118,75 +195,86 @@ def delete_depense(depense_id):
 @finances_bp.route('/paiements')
 @login_required
 def paiements():
-    paiements = Paiement.query.join(Trip).order_by(Paiement.date_paiement.desc()).all()
-    return render_template('finances/paiements.html', paiements=paiements)
+    try:
+        paiements = ledger_page(build_paiements_query(request.args), PAIEMENT_SORTS, Paiement.id_paiement, request.args)
+    except (ValueError, ArithmeticError):
+        flash('Filtre invalide.', 'danger')
+        paiements = ledger_page(build_paiements_query(MultiDict()), PAIEMENT_SORTS, Paiement.id_paiement, MultiDict())
+    return render_template('finances/paiements.html', paiements=paiements, vehicules=_filter_vehicules())
+
+@finances_bp.route('/api/paiements')
+@login_required
+def api_paiements():
+    try:
+        page = ledger_page(build_paiements_query(request.args), PAIEMENT_SORTS, Paiement.id_paiement, request.args)
+    except (ValueError, ArithmeticError) as e:
+        return _invalid_filters(e)
+    return jsonify({
+        'items': [{
+            'id': p.id_paiement,
+            'mode_paiement': p.mode_paiement,
+            'montant_total': money.number(p.montant_total),
+            'montant_paye': money.number(p.montant_paye),
+            'date_paiement': p.date_paiement.isoformat() if p.date_paiement else None,
+            'reference_paiement': p.reference_paiement,
+            'voyage': {'id': p.trip.id_trip, 'code_voyage': p.trip.code_voyage, 'client': p.trip.client_nom},
+            'recu_par': f"{p.receiver.prenom} {p.receiver.nom}" if p.receiver else None
+        } for p in page],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor
+    })
 
 @finances_bp.route('/rapports')
 @login_required
 def rapports():
-    # Obtenir l'année et le mois sélectionnés (par défaut : mois en cours)
-    annee = request.args.get('annee', date.today().year, type=int)
-    mois = request.args.get('mois', date.today().month, type=int)
+    # Période sélectionnée (?periode=jour|semaine|mois|trimestre|annee|personnalise, ou ?annee=&mois=)
+    try:
+        periode = periods.period_from_args(request.args)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        periode = periods.make_period('mois')
+    annee = periode.debut.year
+    mois = periode.debut.month
     
     # Préparer les données pour la sélection des mois et années
     années_disponibles = range(2020, date.today().year + 1)
     mois_disponibles = [(i, calendar.month_name[i]) for i in range(1, 13)]
     
-    # Calculer les revenus mensuels
-    revenus_mensuels = db.session.query(
-        extract('day', Paiement.date_paiement).label('jour'),
-        func.sum(Paiement.montant_paye).label('montant')
-    ).filter(
-        extract('month', Paiement.date_paiement) == mois,
-        extract('year', Paiement.date_paiement) == annee
-    ).group_by('jour').all()
-    
-    # Calculer les dépenses mensuelles
-    depenses_mensuelles = db.session.query(
-        extract('day', Depense.date_depense).label('jour'),
-        func.sum(Depense.montant).label('montant')
-    ).filter(
-        extract('month', Depense.date_depense) == mois,
-        extract('year', Depense.date_depense) == annee
-    ).group_by('jour').all()
+    # Données du rapport: instantanés mensuels en cache (mois clos persistés, mois en cours en mémoire)
+    donnees = reports.report(periode)
+    revenus_par_jour = dict(zip(donnees['jours'], donnees['revenus']))
+    depenses_par_jour = dict(zip(donnees['jours'], donnees['depenses']))
+    tranches = list(periods.buckets(periode))
     
-    # Convertir les résultats en dictionnaires pour faciliter l'accès
-    revenus_dict = {int(jour): float(montant) for jour, montant in revenus_mensuels}
-    depenses_dict = {int(jour): float(montant) for jour, montant in depenses_mensuelles}
+    def cumul(par_jour, tranche):
+        return sum(montant for jour, montant in par_jour.items()
+                   if tranche.debut.isoformat() <= jour < tranche.fin.isoformat())
     
-    # Préparer les données pour le graphique
-    jours_dans_mois = calendar.monthrange(annee, mois)[1]
-    labels = [str(i) for i in range(1, jours_dans_mois + 1)]
-    revenus_data = [revenus_dict.get(i, 0) for i in range(1, jours_dans_mois + 1)]
-    depenses_data = [depenses_dict.get(i, 0) for i in range(1, jours_dans_mois + 1)]
+    if periode.granularite == 'mois':
+        labels = [str(tranche.debut.day) for tranche in tranches]
+    elif tranches and tranches[0].granularite == 'mois':
+        labels = [tranche.debut.strftime('%m/%Y') for tranche in tranches]
+    else:
+        labels = [tranche.debut.strftime('%d/%m') for tranche in tranches]
+    # Cumuls en centimes entiers, convertis une seule fois pour les graphiques
+    if tranches and tranches[0].granularite == 'jour':
+        revenus_data = [revenus_par_jour.get(tranche.debut.isoformat(), 0) for tranche in tranches]
+        depenses_data = [depenses_par_jour.get(tranche.debut.isoformat(), 0) for tranche in tranches]
+    else:
+        revenus_data = [cumul(revenus_par_jour, tranche) for tranche in tranches]
+        depenses_data = [cumul(depenses_par_jour, tranche) for tranche in tranches]
+    revenus_data = [money.as_number(montant) for montant in revenus_data]
+    depenses_data = [money.as_number(montant) for montant in depenses_data]
     
-    # Calculer les totaux par catégorie de dépense
-    depenses_par_categorie = db.session.query(
-        Depense.categorie,
-        func.sum(Depense.montant).label('montant')
-    ).filter(
-        extract('month', Depense.date_depense) == mois,
-        extract('year', Depense.date_depense) == annee
-    ).group_by(Depense.categorie).all()
-    
-    categories = [cat for cat, _ in depenses_par_categorie]
-    montants_categorie = [float(montant) for _, montant in depenses_par_categorie]
-    
-    # Calculer les statistiques de voyage par type
-    voyages_par_type = db.session.query(
-        Trip.type,
-        func.count(Trip.id_trip).label('nombre')
-    ).filter(
-        extract('month', Trip.date_depart) == mois,
-        extract('year', Trip.date_depart) == annee
-    ).group_by(Trip.type).all()
-    
-    types_voyage = [type for type, _ in voyages_par_type]
-    nombre_par_type = [nombre for _, nombre in voyages_par_type]
+    categories = list(donnees['categories'])
+    montants_categorie = [money.as_number(montant) for montant in donnees['categories'].values()]
+    types_voyage = list(donnees['types'])
+    nombre_par_type = list(donnees['types'].values())
     
     return render_template('finances/rapports.html', 
                           annee=annee,
                           mois=mois,
+                          periode=periode,
                           années_disponibles=années_disponibles,
                           mois_disponibles=mois_disponibles,
                           labels=labels,
@@ -197,54 +285,171 @@ def rapports():
                           types_voyage=types_voyage,
                           nombre_par_type=nombre_par_type)
 
+def _fleet_args():
+    periode = periods.period_from_args(request.args)
+    allocation = request.args.get('repartition', 'places')
+    return periode, allocation
+
+@finances_bp.route('/api/flotte')
+@login_required
+def rapport_flotte():
+    # Compte de résultat de tous les véhicules en une requête groupée
+    try:
+        periode, allocation = _fleet_args()
+        vehicules = fleet.fleet_pnl(periode, allocation)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'periode': {'debut': periode.debut.isoformat(), 'fin': periode.fin.isoformat()},
+        'repartition': allocation,
+        'vehicules': [fleet.as_json(vehicule) for vehicule in vehicules],
+        'totaux': fleet.as_json(fleet.totals(vehicules))
+    })
+
 @finances_bp.route('/api/rapport-vehicule/<int:vehicule_id>')
 @login_required
 def rapport_vehicule(vehicule_id):
-    # Obtenir l'année et le mois sélectionnés (par défaut : mois en cours)
-    annee = request.args.get('annee', date.today().year, type=int)
-    mois = request.args.get('mois', date.today().month, type=int)
-    
-    # Calculer les revenus générés par le véhicule
-    revenus = db.session.query(func.sum(Trip.prix)).filter(
-        Trip.id_vehicule == vehicule_id,
-        extract('month', Trip.date_depart) == mois,
-        extract('year', Trip.date_depart) == annee,
-        Trip.etat_trip != 'Annulé'
-    ).scalar() or 0
-    
-    # Calculer les dépenses liées au véhicule
-    depenses = db.session.query(func.sum(Depense.montant)).filter(
-        Depense.id_vehicule == vehicule_id,
-        extract('month', Depense.date_depense) == mois,
-        extract('year', Depense.date_depense) == annee
-    ).scalar() or 0
-    
-    # Nombre de voyages effectués
-    nb_voyages = Trip.query.filter(
-        Trip.id_vehicule == vehicule_id,
-        extract('month', Trip.date_depart) == mois,
-        extract('year', Trip.date_depart) == annee,
-        Trip.etat_trip != 'Annulé'
-    ).count()
-    
-    # Répartition des dépenses par catégorie
+    # Même calcul que le rapport de flotte, restreint au véhicule
+    try:
+        periode, allocation = _fleet_args()
+        lignes = fleet.fleet_pnl(periode, allocation, vehicule_ids=[vehicule_id])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not lignes:
+        return jsonify({'error': 'Véhicule introuvable'}), 404
+    brute = lignes[0]
+    ligne = fleet.as_json(brute)
+    
+    # Répartition des dépenses liées au véhicule par catégorie
     depenses_par_categorie = db.session.query(
         Depense.categorie,
         func.sum(Depense.montant).label('montant')
     ).filter(
         Depense.id_vehicule == vehicule_id,
-        extract('month', Depense.date_depense) == mois,
-        extract('year', Depense.date_depense) == annee
+        periods.in_period(Depense.date_depense, periode)
     ).group_by(Depense.categorie).all()
     
     categories = [cat for cat, _ in depenses_par_categorie]
-    montants = [float(montant) for _, montant in depenses_par_categorie]
+    montants = [money.number(montant) for _, montant in depenses_par_categorie]
     
     return jsonify({
-        'revenus': float(revenus),
-        'depenses': float(depenses),
-        'benefice': float(revenus) - float(depenses),
-        'nb_voyages': nb_voyages,
+        'revenus': ligne['revenus'],
+        # 'depenses' et 'benefice' gardent leur sens d'origine (dépenses du véhicule seules);
+        # 'couts' et 'marge' comptent aussi les entretiens, comme le rapport de flotte
+        'depenses': ligne['depenses'],
+        'entretiens': ligne['entretiens'],
+        'couts': ligne['couts'],
+        'benefice': money.as_number(brute['revenus'] - brute['depenses']),
+        'marge': ligne['marge'],
+        'nb_voyages': ligne['nb_voyages'],
         'categories': categories,
-        'montants': montants
-    })
\ No newline at end of file
+        'montants': montants,
+        'repartition': allocation,
+        'periode': {'debut': periode.debut.isoformat(), 'fin': periode.fin.isoformat()}
+    })
+
+@finances_bp.route('/api/cube', methods=['POST'])
+@login_required
+def api_cube():
+    # Agrégations libres sur le cube en mémoire:
+    # {"fait": "depenses", "grouper": ["mois", "categorie"], "filtres": {"debut": "2024-01-01"}, "mesures": ["somme"]}
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Un objet JSON est attendu'}), 400
+    fait = data.get('fait', 'paiements')
+    grouper = data.get('grouper', [])
+    mesures = data.get('mesures', ['somme', 'nombre'])
+    filtres = data.get('filtres') or {}
+    if not isinstance(grouper, list) or not isinstance(mesures, list):
+        return jsonify({'error': "'grouper' et 'mesures' doivent être des listes"}), 400
+    if not isinstance(filtres, dict):
+        return jsonify({'error': "'filtres' doit être un objet"}), 400
+    try:
+        lignes = cube.cube.query(fait, grouper, filtres, mesures)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'fait': fait,
+        'colonnes': list(grouper) + [mesure for mesure in cube.MEASURES if mesure in mesures],
+        'lignes': lignes
+    })
+
+def _creance_json(creance):
+    return {
+        'id_trip': creance.id_trip,
+        'code_voyage': creance.trip.code_voyage if creance.trip else None,
+        'nom_voyage': creance.trip.nom_voyage if creance.trip else None,
+        'client_nom': creance.client_nom or None,
+        'date_origine': creance.date_origine.isoformat(),
+        'anciennete': (date.today() - creance.date_origine).days,
+        'montant_du': money.number(creance.montant_du),
+        'montant_paye': money.number(creance.montant_paye),
+        'solde': money.number(creance.solde)
+    }
+
+@finances_bp.route('/api/creances')
+@login_required
+def api_creances():
+    # Créances ouvertes, les plus anciennes d'abord (?client=, ?cursor=, ?per_page=)
+    query = receivables.outstanding_query(request.args.get('client')).options(joinedload(Creance.trip))
+    page = keyset_paginate(
+        query,
+        [Creance.date_origine, Creance.id_trip],
+        cursor=request.args.get('cursor'),
+        per_page=min(request.args.get('per_page', LEDGER_PER_PAGE, type=int), 200),
+        descending=False
+    )
+    return jsonify({
+        'items': [_creance_json(creance) for creance in page],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor
+    })
+
+@finances_bp.route('/api/creances/anciennete')
+@login_required
+def api_creances_anciennete():
+    # Balance âgée (0-30, 31-60, 61-90, 90+ jours) et principaux clients débiteurs
+    try:
+        reference = datetime.strptime(request.args['date'], '%Y-%m-%d').date() if request.args.get('date') else None
+    except ValueError as e:
+        return _invalid_filters(e)
+    tranches = receivables.aging(reference, request.args.get('client'))
+    clients = receivables.by_client(limit=request.args.get('limit', 20, type=int))
+    return jsonify({
+        'date': (reference or date.today()).isoformat(),
+        'tranches': [dict(tranche, solde=money.as_number(tranche['solde'])) for tranche in tranches],
+        'total': money.as_number(sum(tranche['solde'] for tranche in tranches)),
+        'clients': [{
+            'client_nom': client.client_nom or None,
+            'solde': money.number(client.solde),
+            'nb_ouvertes': client.nb_ouvertes
+        } for client in clients]
+    })
+
+def _fuel_analysis():
+    periode = periods.period_from_args(request.args, default='annee')
+    vehicule_ids = request.args.getlist('id_vehicule', type=int) or None
+    return periode, fuel.analyse(periode, request.args.get('decoupage', 'mois'), vehicule_ids)
+
+@finances_bp.route('/carburant')
+@login_required
+def carburant():
+    # Carburant, entretien et coût au km de la flotte (année en cours par défaut)
+    try:
+        periode, analyse = _fuel_analysis()
+    except ValueError as e:
+        flash(f'Filtre invalide : {str(e)}', 'danger')
+        return redirect(url_for('finances.carburant'))
+    return render_template('finances/carburant.html', periode=periode, fin=periode.fin - timedelta(days=1), analyse=analyse)
+
+@finances_bp.route('/api/carburant')
+@login_required
+def api_carburant():
+    try:
+        periode, analyse = _fuel_analysis()
+    except ValueError as e:
+        return _invalid_filters(e)
+    analyse['periode'] = {'debut': periode.debut.isoformat(), 'fin': periode.fin.isoformat()}
+    return jsonify(analyse)
@@ -1,88 +1,113 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort, current_app, Response, send_file, stream_with_context
 from flask_login import login_required, current_user
-from models import db, Trip, TripAffectation, Vehicule, Chauffeur
-from sqlalchemy import or_, and_
-from datetime import datetime
-from sqlalchemy.orm import joinedload
+from models import db, Trip, TripAffectation, TripDepense, Paiement, Vehicule, Chauffeur
+from werkzeug.utils import secure_filename
+from sqlalchemy import or_, and_, select
+from sqlalchemy.exc import SQLAlchemyError
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+import csv
+import os
+from sqlalchemy.orm import joinedload, selectinload
+from services.pagination import keyset_paginate, offset_paginate, approximate_count
+from services.search import ranked_trip_ids, search_trip_ids
+from services import availability, exports, forecast, imports, money
+from services import dispatch as dispatch_service
+from services.sequences import next_voyage_code
+from services.trip_details import load_trip_aggregate
+from services.changesets import sync_children
 
 trips_bp = Blueprint('trips', __name__, url_prefix='/trips')
 
 def generate_voyage_code(date_depart):
     """Génère un code unique pour le voyage"""
-    # Format de base: V + YYMMDD
-    base_code = f"V{date_depart.strftime('%y%m%d')}"
-    
-    # Trouver le dernier numéro utilisé pour ce jour
-    last_trip = Trip.query.filter(
-        Trip.code_voyage.like(f"{base_code}%")
-    ).order_by(Trip.code_voyage.desc()).first()
-    
-    if last_trip:
-        last_num = int(last_trip.code_voyage[-2:])
-        new_num = str(last_num + 1).zfill(2)
-    else:
-        new_num = "01"
-    
-    return f"{base_code}{new_num}"
+    # Format: V + YYMMDD + numéro du jour, attribué par le compteur atomique de services/sequences.py
+    return next_voyage_code(date_depart)
 
-# Dans routes/trips.py
-@trips_bp.route('/')
-@login_required
-def index():
-    page = request.args.get('page', 1, type=int)
-    per_page = 10
+# Colonnes de tri autorisées pour la liste des voyages
+SORTABLE_COLUMNS = {'date_depart', 'date_creation', 'code_voyage', 'nom_voyage', 'type', 'etat_trip', 'client_nom'}
 
-    # Filtres
-    type_voyage = request.args.get('type')
-    date_debut = request.args.get('date_debut')
-    date_fin = request.args.get('date_fin')
-    status = request.args.get('status')
-    search = request.args.get('search')
-
-    # Construction de la requête de base
-    query = Trip.query.join(
-        TripAffectation, 
-        Trip.id_trip == TripAffectation.id_trip, 
-        isouter=True  # Left outer join pour inclure les voyages sans affectation
-    ).join(
-        Vehicule,
-        TripAffectation.id_vehicule == Vehicule.id_vehicule,
-        isouter=True
-    ).join(
-        Chauffeur,
-        TripAffectation.id_chauffeur == Chauffeur.id_chauffeur,
-        isouter=True
-    )
+
+def build_trips_query(args):
+    """Construit la requête filtrée de la liste des voyages (sans jointure, donc sans doublons)"""
+    type_voyage = args.get('type')
+    date_debut = args.get('date_debut')
+    date_fin = args.get('date_fin')
+    status = args.get('status')
+    search = args.get('search')
+
+    query = Trip.query
 
     if type_voyage:
         query = query.filter(Trip.type == type_voyage)
     if date_debut:
-        query = query.filter(Trip.date_depart >= datetime.strptime(date_debut, '%Y-%m-%d'))
+        query = query.filter(Trip.date_depart >= datetime.strptime(date_debut, '%Y-%m-%d').date())
     if date_fin:
-        query = query.filter(Trip.date_depart <= datetime.strptime(date_fin, '%Y-%m-%d'))
+        query = query.filter(Trip.date_depart <= datetime.strptime(date_fin, '%Y-%m-%d').date())
     if status:
         query = query.filter(Trip.etat_trip == status)
     if search:
-        query = query.filter(or_(
-            Trip.nom.ilike(f'%{search}%'),
-            Trip.client_nom.ilike(f'%{search}%'),
-            Trip.point_depart.ilike(f'%{search}%'),
-            Trip.point_arrivee.ilike(f'%{search}%'),
-            Vehicule.modele.ilike(f'%{search}%'),
-            Vehicule.matricule.ilike(f'%{search}%')
-        ))
+        # Recherche via l'index de trigrammes (voyages + véhicules affectés), sans ILIKE '%...%'
+        ranked = ranked_trip_ids(search)
+        if ranked is not None:
+            query = query.filter(Trip.id_trip.in_(select(ranked.c.id_trip)))
+
+    return query
+
+
+@trips_bp.route('/')
+@login_required
+def index():
+    per_page = 10
+
+    query = build_trips_query(request.args)
+    filtered = any(request.args.get(k) for k in ('type', 'date_debut', 'date_fin', 'status', 'search'))
+
+    # Charger affectations, véhicules et chauffeurs en deux requêtes au lieu d'une par ligne
+    query = query.options(
+        selectinload(Trip.affectations).joinedload(TripAffectation.vehicule),
+        selectinload(Trip.affectations).joinedload(TripAffectation.chauffeur)
+    )
 
     # Tri
     sort_by = request.args.get('sort_by', 'date_depart')
+    if sort_by not in SORTABLE_COLUMNS and sort_by != 'pertinence':
+        sort_by = 'date_depart'
     order = request.args.get('order', 'desc')
-    
-    if order == 'desc':
-        query = query.order_by(getattr(Trip, sort_by).desc())
+
+    # Pagination par clé (date_depart, id_trip) par défaut; ?page=N conserve la pagination par OFFSET
+    mode = request.args.get('mode') or ('offset' if 'page' in request.args or sort_by != 'date_depart' else 'keyset')
+
+    if sort_by == 'pertinence' and request.args.get('search'):
+        # Tri par score de recherche: la sous-requête classée fournit l'ordre
+        page = request.args.get('page', 1, type=int)
+        ranked = ranked_trip_ids(request.args.get('search'))
+        if ranked is not None:
+            query = query.join(ranked, ranked.c.id_trip == Trip.id_trip).order_by(
+                ranked.c.score.desc(), Trip.id_trip.desc()
+            )
+        trips = offset_paginate(query, page=page, per_page=per_page, count=request.args.get('total') != 'none')
+    elif mode == 'keyset' and sort_by == 'date_depart':
+        trips = keyset_paginate(
+            query,
+            [Trip.date_depart, Trip.id_trip],
+            cursor=request.args.get('cursor'),
+            per_page=per_page,
+            descending=(order == 'desc')
+        )
+        if request.args.get('total') == 'approx':
+            trips.total = approximate_count(query, table_name=Trip.__tablename__, unfiltered=not filtered)
     else:
-        query = query.order_by(getattr(Trip, sort_by).asc())
+        page = request.args.get('page', 1, type=int)
+        column = getattr(Trip, sort_by)
+        if order == 'desc':
+            query = query.order_by(column.desc(), Trip.id_trip.desc())
+        else:
+            query = query.order_by(column.asc(), Trip.id_trip.asc())
+        trips = offset_paginate(query, page=page, per_page=per_page, count=request.args.get('total') != 'none')
 
-    trips = query.paginate(page=page, per_page=per_page)
     return render_template('trips/manage.html', trips=trips)
+
 @trips_bp.route('/check-nom-voyage')
 @login_required
 def check_nom_voyage():
@@ -107,20 +132,7 @@ def add():
             date_depart = datetime.strptime(date_depart_str, '%Y-%m-%dT%H:%M')
             
             # Générer le code voyage basé sur la date de départ
-            code_voyage = f"V{date_depart.strftime('%y%m%d')}"
-            
-            # Trouver le dernier numéro pour ce jour
-            last_trip = Trip.query.filter(
-                Trip.code_voyage.like(f"{code_voyage}%")
-            ).order_by(Trip.code_voyage.desc()).first()
-
-            if last_trip:
-                last_num = int(last_trip.code_voyage[-2:])
-                new_num = str(last_num + 1).zfill(2)
-            else:
-                new_num = "01"
-
-            code_voyage = f"{code_voyage}{new_num}"
+            code_voyage = generate_voyage_code(date_depart.date())
 
             # Récupérer la date d'arrivée si elle existe
             date_arrivee = None
@@ -154,11 +166,11 @@ def add():
 
             # Gestion du prix selon le type de tarification
             if request.form.get('tarification_type') == 'achat_revente':
-                new_trip.prix_achat = request.form.get('prix_achat', type=float)
-                new_trip.prix_vente = request.form.get('prix_vente', type=float)
+                new_trip.prix_achat = parse_montant(request.form, 'prix_achat')
+                new_trip.prix_vente = parse_montant(request.form, 'prix_vente')
                 new_trip.is_commission = False
             else:
-                new_trip.commission = request.form.get('commission', type=float)
+                new_trip.commission = parse_montant(request.form, 'commission')
                 new_trip.is_commission = True
 
             db.session.add(new_trip)
@@ -200,30 +212,58 @@ def add():
 @trips_bp.route('/<int:trip_id>')
 @login_required
 def details(trip_id):
-    trip = Trip.query.get_or_404(trip_id)
-    
-    # Récupérer les affectations avec les détails des véhicules et chauffeurs
-    affectations = db.session.query(
-        TripAffectation, Vehicule, Chauffeur
-    ).join(
-        Vehicule, TripAffectation.id_vehicule == Vehicule.id_vehicule
-    ).join(
-        Chauffeur, TripAffectation.id_chauffeur == Chauffeur.id_chauffeur
-    ).filter(
-        TripAffectation.id_trip == trip_id
-    ).all()
-
-    # Récupérer les dépenses
-    depenses = TripDepense.query.filter_by(id_trip=trip_id).all()
-    
-    # Récupérer les paiements
-    paiements = Paiement.query.filter_by(id_trip=trip_id).order_by(Paiement.date_paiement.desc()).all()
+    # Voyage, affectations, dépenses, paiements et totaux (marge, payé, reste) en 4 requêtes
+    aggregate = load_trip_aggregate(trip_id)
+    if aggregate is None:
+        abort(404)
 
     return render_template('trips/details.html', 
-                         trip=trip, 
-                         affectations=affectations, 
-                         depenses=depenses, 
-                         paiements=paiements)
+                         trip=aggregate.trip, 
+                         affectations=aggregate.affectations, 
+                         depenses=aggregate.depenses, 
+                         paiements=aggregate.paiements,
+                         totaux=aggregate)
+
+@trips_bp.route('/api/<int:trip_id>')
+@login_required
+def api_details(trip_id):
+    aggregate = load_trip_aggregate(trip_id)
+    if aggregate is None:
+        return jsonify({'error': 'Voyage introuvable'}), 404
+    return jsonify(aggregate.to_dict())
+
+AFFECTATION_FIELDS = ('id_vehicule', 'id_chauffeur')
+DEPENSE_FIELDS = ('nom', 'prix_unitaire', 'nombre_personnes', 'total')
+
+def parse_affectations(form):
+    """Couples (véhicule, chauffeur) soumis par le formulaire d'édition"""
+    return [
+        {'id_vehicule': int(vehicule_id), 'id_chauffeur': int(chauffeur_id)}
+        for vehicule_id, chauffeur_id in zip(form.getlist('vehicules[]'), form.getlist('chauffeurs[]'))
+        if vehicule_id and chauffeur_id
+    ]
+
+def parse_depenses(form):
+    """Dépenses annexes soumises par le formulaire d'édition, typées comme les colonnes"""
+    rows = []
+    for nom, prix, nombre in zip(form.getlist('depense_nom[]'),
+                                 form.getlist('depense_prix_unitaire[]'),
+                                 form.getlist('depense_nombre_personnes[]')):
+        if nom and prix and nombre:
+            prix_unitaire = Decimal(prix).quantize(Decimal('0.01'))
+            nombre_personnes = int(nombre)
+            rows.append({
+                'nom': nom,
+                'prix_unitaire': prix_unitaire,
+                'nombre_personnes': nombre_personnes,
+                'total': prix_unitaire * nombre_personnes
+            })
+    return rows
+
+def parse_montant(form, name):
+    """Montant saisi en Decimal à deux décimales, sans passer par un float (None si vide)"""
+    value = (form.get(name) or '').strip()
+    return money.from_cents(money.to_cents(value)) if value else None
 
 # Modifier un voyage
 @trips_bp.route('/<int:trip_id>/edit', methods=['GET', 'POST'])
@@ -255,49 +295,29 @@ def edit(trip_id):
             
             # Mise à jour des prix
             if request.form.get('tarification_type') == 'achat_revente':
-                trip.prix_achat = request.form.get('prix_achat', type=float)
-                trip.prix_vente = request.form.get('prix_vente', type=float)
+                trip.prix_achat = parse_montant(request.form, 'prix_achat')
+                trip.prix_vente = parse_montant(request.form, 'prix_vente')
                 trip.is_commission = False
                 trip.commission = None
             else:
-                trip.commission = request.form.get('commission', type=float)
+                trip.commission = parse_montant(request.form, 'commission')
                 trip.is_commission = True
                 trip.prix_achat = None
                 trip.prix_vente = None
             
-            # Mise à jour des affectations
-            TripAffectation.query.filter_by(id_trip=trip.id_trip).delete()
-            
-            vehicules = request.form.getlist('vehicules[]')
-            chauffeurs = request.form.getlist('chauffeurs[]')
-            
-            for vehicule_id, chauffeur_id in zip(vehicules, chauffeurs):
-                if vehicule_id and chauffeur_id:
-                    affectation = TripAffectation(
-                        id_trip=trip.id_trip,
-                        id_vehicule=vehicule_id,
-                        id_chauffeur=chauffeur_id
-                    )
-                    db.session.add(affectation)
+            # Mise à jour des affectations: seules les lignes ajoutées/modifiées/retirées sont écrites
+            sync_children(
+                db.session, trip.affectations, parse_affectations(request.form),
+                AFFECTATION_FIELDS, lambda values: TripAffectation(id_trip=trip.id_trip, **values),
+                match_keys=[('id_vehicule',), ('id_chauffeur',)]
+            )
             
             # Mise à jour des dépenses
-            TripDepense.query.filter_by(id_trip=trip.id_trip).delete()
-            
-            if request.form.getlist('depense_nom[]'):
-                noms = request.form.getlist('depense_nom[]')
-                prix_unitaires = request.form.getlist('depense_prix_unitaire[]')
-                nombres_personnes = request.form.getlist('depense_nombre_personnes[]')
-                
-                for nom, prix, nombre in zip(noms, prix_unitaires, nombres_personnes):
-                    if nom and prix and nombre:
-                        depense = TripDepense(
-                            id_trip=trip.id_trip,
-                            nom=nom,
-                            prix_unitaire=float(prix),
-                            nombre_personnes=int(nombre),
-                            total=float(prix) * int(nombre)
-                        )
-                        db.session.add(depense)
+            sync_children(
+                db.session, trip.depenses_supplementaires, parse_depenses(request.form),
+                DEPENSE_FIELDS, lambda values: TripDepense(id_trip=trip.id_trip, **values),
+                match_keys=[('nom',)]
+            )
             
             # Mise à jour des informations client
             trip.client_nom = request.form.get('client_nom')
@@ -353,6 +373,94 @@ def edit(trip_id):
                          affectations=affectations,
                          depenses=depenses)
 
+def _json_rows():
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError('Une liste de lignes est attendue')
+    return rows
+
+def _affectation_rows():
+    """Affectations soumises, converties et vérifiées (véhicules et chauffeurs existants)"""
+    rows = []
+    for index, row in enumerate(_json_rows(), start=1):
+        try:
+            rows.append({
+                'id': row.get('id'),
+                'id_vehicule': int(row['id_vehicule']),
+                'id_chauffeur': int(row['id_chauffeur'])
+            })
+        except KeyError as e:
+            raise ValueError(f'Ligne {index} : champ {e.args[0]} manquant')
+        except (TypeError, ValueError):
+            raise ValueError(f'Ligne {index} : identifiant de véhicule ou de chauffeur invalide')
+
+    vehicule_ids = {row['id_vehicule'] for row in rows}
+    chauffeur_ids = {row['id_chauffeur'] for row in rows}
+    inconnus = vehicule_ids - {v for v, in db.session.query(Vehicule.id_vehicule).filter(Vehicule.id_vehicule.in_(vehicule_ids))}
+    if inconnus:
+        raise ValueError(f'Véhicule(s) introuvable(s) : {", ".join(map(str, sorted(inconnus)))}')
+    inconnus = chauffeur_ids - {c for c, in db.session.query(Chauffeur.id_chauffeur).filter(Chauffeur.id_chauffeur.in_(chauffeur_ids))}
+    if inconnus:
+        raise ValueError(f'Chauffeur(s) introuvable(s) : {", ".join(map(str, sorted(inconnus)))}')
+    return rows
+
+def _depense_rows():
+    """Dépenses supplémentaires soumises, converties et vérifiées"""
+    rows = []
+    for index, row in enumerate(_json_rows(), start=1):
+        try:
+            nom = str(row['nom']).strip()
+            prix_unitaire = Decimal(str(row['prix_unitaire'])).quantize(Decimal('0.01'))
+            nombre_personnes = int(row['nombre_personnes'])
+        except KeyError as e:
+            raise ValueError(f'Ligne {index} : champ {e.args[0]} manquant')
+        except (TypeError, ValueError, InvalidOperation):
+            raise ValueError(f'Ligne {index} : prix unitaire ou nombre de personnes invalide')
+        if not nom:
+            raise ValueError(f'Ligne {index} : le nom est obligatoire')
+        if not prix_unitaire.is_finite() or prix_unitaire < 0 or nombre_personnes < 0:
+            raise ValueError(f'Ligne {index} : prix unitaire ou nombre de personnes invalide')
+        rows.append({
+            'id': row.get('id'),
+            'nom': nom,
+            'prix_unitaire': prix_unitaire,
+            'nombre_personnes': nombre_personnes,
+            'total': prix_unitaire * nombre_personnes
+        })
+    return rows
+
+@trips_bp.route('/api/<int:trip_id>/affectations', methods=['PUT'])
+@login_required
+def api_update_affectations(trip_id):
+    trip = Trip.query.get_or_404(trip_id)
+    try:
+        rows = _affectation_rows()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    changes = sync_children(
+        db.session, trip.affectations, rows, AFFECTATION_FIELDS,
+        lambda values: TripAffectation(id_trip=trip.id_trip, **values),
+        match_keys=[('id_vehicule',), ('id_chauffeur',)]
+    )
+    db.session.commit()
+    return jsonify(changes.summary())
+
+@trips_bp.route('/api/<int:trip_id>/depenses', methods=['PUT'])
+@login_required
+def api_update_depenses(trip_id):
+    trip = Trip.query.get_or_404(trip_id)
+    try:
+        rows = _depense_rows()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    changes = sync_children(
+        db.session, trip.depenses_supplementaires, rows, DEPENSE_FIELDS,
+        lambda values: TripDepense(id_trip=trip.id_trip, **values),
+        match_keys=[('nom',)]
+    )
+    db.session.commit()
+    return jsonify(changes.summary())
+
 # Supprimer un voyage
 @trips_bp.route('/<int:trip_id>/delete', methods=['POST'])
 @login_required
@@ -398,40 +506,175 @@ def manage_status(trip_id):
     return redirect(url_for('trips.details', trip_id=trip_id))
 
 # API endpoints pour les opérations AJAX
+def _parse_window(payload):
+    """Lit la fenêtre demandée: 'debut'/'fin' ISO, ou à défaut la journée 'date'"""
+    if payload.get('debut'):
+        start = datetime.fromisoformat(payload['debut'])
+        end = datetime.fromisoformat(payload['fin']) if payload.get('fin') else start + timedelta(hours=1)
+    else:
+        day = datetime.strptime(payload.get('date'), '%Y-%m-%d')
+        start, end = day, day + timedelta(days=1)
+    return start, end
+
+def _optional_id(value):
+    """Identifiant facultatif ('' ou absent: aucun), converti en entier comme les colonnes"""
+    return int(value) if value not in (None, '') else None
+
+
 @trips_bp.route('/api/check-availability', methods=['POST'])
 @login_required
 def check_availability():
-    date = request.json.get('date')
-    vehicule_id = request.json.get('vehicule_id')
-    chauffeur_id = request.json.get('chauffeur_id')
-    
-    # Vérifier la disponibilité
-    conflicts = Trip.query.join(TripAffectation).filter(
-        Trip.date_depart == datetime.strptime(date, '%Y-%m-%d').date(),
-        or_(
-            TripAffectation.id_vehicule == vehicule_id,
-            TripAffectation.id_chauffeur == chauffeur_id
-        )
-    ).all()
-    
+    payload = request.json or {}
+    try:
+        start, end = _parse_window(payload)
+        vehicule_id = payload.get('vehicule_id')
+        chauffeur_id = payload.get('chauffeur_id')
+        vehicule_ids = [int(vehicule_id)] if vehicule_id else []
+        chauffeur_ids = [int(chauffeur_id)] if chauffeur_id else []
+        exclude_trip_id = _optional_id(payload.get('exclude_trip_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Période ou identifiant invalide'}), 400
+
+    result = availability.check_availability(
+        start, end,
+        vehicule_ids=vehicule_ids,
+        chauffeur_ids=chauffeur_ids,
+        exclude_trip_id=exclude_trip_id
+    )
+    conflicts = result['voyages'].values()
+
     return jsonify({
         'available': len(conflicts) == 0,
         'conflicts': [{
-            'id': c.id_trip,
-            'type': c.type,
-            'nom': c.nom
+            'id': c['id'],
+            'type': c['type'],
+            'nom': c['nom']
         } for c in conflicts]
     })
 
+@trips_bp.route('/api/availability', methods=['POST'])
+@login_required
+def batch_availability():
+    """Quels véhicules / chauffeurs sont libres entre 'debut' et 'fin' (tous les actifs par défaut)"""
+    payload = request.json or {}
+    try:
+        start, end = _parse_window(payload)
+        vehicule_ids = payload.get('vehicules')
+        vehicule_ids = [int(v) for v in vehicule_ids] if vehicule_ids is not None else None
+        chauffeur_ids = payload.get('chauffeurs')
+        chauffeur_ids = [int(c) for c in chauffeur_ids] if chauffeur_ids is not None else None
+        exclude_trip_id = _optional_id(payload.get('exclude_trip_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Période ou identifiant invalide'}), 400
+    if end <= start:
+        return jsonify({'error': 'La fin doit être postérieure au début'}), 400
+
+    if vehicule_ids is None:
+        vehicule_ids = [v for v, in db.session.query(Vehicule.id_vehicule).filter_by(etat='En marche')]
+    if chauffeur_ids is None:
+        chauffeur_ids = [c for c, in db.session.query(Chauffeur.id_chauffeur).filter_by(statut='Actif')]
+
+    result = availability.check_availability(
+        start, end,
+        vehicule_ids=vehicule_ids,
+        chauffeur_ids=chauffeur_ids,
+        exclude_trip_id=exclude_trip_id
+    )
+    return jsonify(result)
+
+@trips_bp.route('/api/dispatch', methods=['POST'])
+@login_required
+def dispatch():
+    """
+    Propose (ou enregistre si 'appliquer' est vrai) véhicules et chauffeurs pour les voyages
+    sans affectation entre 'date_debut' et 'date_fin' (incluses, 'date' pour une seule journée).
+    Les véhicules dont l'entretien prévu tombe dans la période ne reçoivent que les voyages
+    terminés avant cette date, sauf si 'ignorer_entretiens' est vrai.
+    """
+    payload = request.json or {}
+    try:
+        first_day = datetime.strptime(payload.get('date_debut') or payload.get('date'), '%Y-%m-%d').date()
+        last_day = datetime.strptime(payload['date_fin'], '%Y-%m-%d').date() if payload.get('date_fin') else first_day
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Période invalide'}), 400
+    if last_day < first_day:
+        return jsonify({'error': 'La fin doit être postérieure au début'}), 400
+
+    a_entretenir = [] if payload.get('ignorer_entretiens') else forecast.vehicles_due_by(last_day)
+    plan = dispatch_service.plan_assignments(
+        first_day, last_day, trip_ids=payload.get('voyages'),
+        service_dates={row['id_vehicule']: date.fromisoformat(row['date_prevue']) for row in a_entretenir}
+    )
+    result = plan.to_dict()
+    result['vehicules_a_entretenir'] = [
+        {'id_vehicule': row['id_vehicule'], 'matricule': row['matricule'], 'date_prevue': row['date_prevue']}
+        for row in a_entretenir
+    ]
+    if payload.get('appliquer'):
+        try:
+            result['enregistrees'] = plan.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            current_app.logger.exception('Enregistrement du planning impossible')
+            return jsonify({'error': "Les affectations n'ont pas pu être enregistrées"}), 500
+    return jsonify(result)
+
+@trips_bp.route('/import', methods=['POST'])
+@login_required
+def import_trips():
+    file = request.files.get('fichier')
+    if not file or not file.filename:
+        return jsonify({'error': 'Aucun fichier fourni'}), 400
+
+    fmt = imports.detect_format(file.filename, request.form.get('format'))
+    dry_run = request.form.get('dry_run') in ('1', 'true', 'on')
+    try:
+        report = imports.import_file(file.stream, fmt, created_by=current_user.id_user, dry_run=dry_run)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        return jsonify({'error': f'Fichier illisible: {str(e)}'}), 400
+
+    return jsonify(report.to_dict())
+
+@trips_bp.route('/api/search')
+@login_required
+def api_search():
+    term = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    results = search_trip_ids(term, limit=limit)
+    return jsonify({
+        'ids': [id_trip for id_trip, _ in results],
+        'scores': {str(id_trip): score for id_trip, score in results}
+    })
+
 # Export des données
 @trips_bp.route('/export')
 @login_required
 def export_data():
+    """Export des voyages filtrés comme la liste (?format=csv|excel|pdf), en flux"""
     format_type = request.args.get('format', 'excel')
-    if format_type == 'excel':
-        # Logique d'export Excel
-        pass
-    elif format_type == 'pdf':
-        # Logique d'export PDF
-        pass
-    return redirect(url_for('trips.index'))
\ No newline at end of file
+    rows = exports.iter_trip_rows(build_trips_query(request.args))
+    filename = f"voyages_{datetime.now().strftime('%Y%m%d_%H%M')}"
+
+    if format_type == 'csv':
+        return Response(
+            stream_with_context(exports.stream_csv(rows)),
+            mimetype='text/csv; charset=utf-8',
+            headers={'Content-Disposition': f'attachment; filename={filename}.csv'}
+        )
+
+    try:
+        if format_type == 'excel':
+            output = exports.write_xlsx(rows)
+            return send_file(
+                output, as_attachment=True, download_name=f'{filename}.xlsx',
+                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            )
+        if format_type == 'pdf':
+            output = exports.write_pdf(rows)
+            return send_file(output, as_attachment=True, download_name=f'{filename}.pdf', mimetype='application/pdf')
+    except ImportError as e:
+        flash(f"Export indisponible : {str(e)}", 'danger')
+        return redirect(url_for('trips.index'))
+
+    abort(400)
\ No newline at end of file
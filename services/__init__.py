@@ -0,0 +1,2 @@
+# Ce fichier est nécessaire pour que le répertoire services soit considéré comme un package Python
+# Il regroupe la logique métier partagée entre les blueprints (requêtes, calculs, index)
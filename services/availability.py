@@ -0,0 +1,187 @@
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import and_, or_
+
+from models import db, Trip, TripAffectation
+from services import recurrence
+
+# Voyages sans date d'arrivée: au plus MAX_TRIP_DAYS jours, ils sont bornés en base par leur date de départ
+MAX_TRIP_DAYS = 31
+
+
+def trip_interval(date_depart, heure_depart=None, date_arrivee=None, heure_arrivee=None, nombre_jours=None):
+    """
+    Intervalle [début, fin[ occupé par un voyage.
+    Sans date d'arrivée, le voyage couvre `nombre_jours` jours (1 par défaut);
+    sans heure d'arrivée, il occupe la fin de sa dernière journée.
+    """
+    start = datetime.combine(date_depart, heure_depart or time.min)
+    if date_arrivee is None:
+        date_arrivee = date_depart + timedelta(days=max((nombre_jours or 1) - 1, 0))
+    if heure_arrivee is not None:
+        end = datetime.combine(date_arrivee, heure_arrivee)
+    else:
+        end = datetime.combine(date_arrivee + timedelta(days=1), time.min)
+    if end <= start:
+        # Heure d'arrivée antérieure au départ le même jour: trajet de nuit
+        end += timedelta(days=1)
+    return start, end
+
+
+class IntervalIndex:
+    """
+    Index statique d'intervalles: débuts triés + maximum cumulé des fins.
+    Une requête de chevauchement coûte O(log n + k) pour k résultats.
+    """
+
+    def __init__(self, intervals=()):
+        self._intervals = sorted(intervals, key=lambda item: item[0])
+        self._starts = [start for start, _, _ in self._intervals]
+        self._max_ends = []
+        running = None
+        for _, end, _ in self._intervals:
+            running = end if running is None or end > running else running
+            self._max_ends.append(running)
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def overlapping(self, start, end):
+        """Charges utiles des intervalles qui chevauchent [start, end["""
+        results = []
+        i = bisect_left(self._starts, end) - 1
+        # Les fins maximales cumulées décroissent en remontant: on s'arrête dès qu'elles sont <= start
+        while i >= 0 and self._max_ends[i] > start:
+            interval_start, interval_end, payload = self._intervals[i]
+            if interval_end > start:
+                results.append(payload)
+            i -= 1
+        results.reverse()
+        return results
+
+
+class AvailabilityIndex:
+    """Occupation des véhicules et chauffeurs sur une fenêtre, chargée en une requête"""
+
+    def __init__(self, window_start, window_end, exclude_trip_id=None):
+        self.window_start = window_start
+        self.window_end = window_end
+        self.trips = {}
+        by_vehicule = defaultdict(list)
+        by_chauffeur = defaultdict(list)
+
+        for trip_id, start, end, vehicule_id, chauffeur_id in self._load(exclude_trip_id):
+            by_vehicule[vehicule_id].append((start, end, trip_id))
+            by_chauffeur[chauffeur_id].append((start, end, trip_id))
+
+        self.vehicules = {key: IntervalIndex(items) for key, items in by_vehicule.items()}
+        self.chauffeurs = {key: IntervalIndex(items) for key, items in by_chauffeur.items()}
+
+    def _load(self, exclude_trip_id):
+        first_day = self.window_start.date()
+        last_day = self.window_end.date()
+        query = db.session.query(
+            Trip.id_trip, Trip.type, Trip.nom, Trip.code_voyage,
+            Trip.date_depart, Trip.heure_depart, Trip.date_arrivee, Trip.heure_arrivee, Trip.nombre_jours,
+            TripAffectation.id_vehicule, TripAffectation.id_chauffeur
+        ).join(
+            TripAffectation, TripAffectation.id_trip == Trip.id_trip
+        ).filter(
+            Trip.etat_trip != 'Annulé',
+            # Les voyages récurrents sont pris en compte occurrence par occurrence (voir plus bas)
+            or_(Trip.is_recurring.is_(False), Trip.is_recurring.is_(None)),
+            Trip.date_depart <= last_day,
+            or_(
+                Trip.date_depart >= first_day - timedelta(days=1),
+                Trip.date_arrivee >= first_day,
+                and_(Trip.date_arrivee.is_(None), or_(
+                    Trip.date_depart >= first_day - timedelta(days=MAX_TRIP_DAYS),
+                    # Au-delà de MAX_TRIP_DAYS jours (rare): la fin réelle est vérifiée ci-dessous
+                    Trip.nombre_jours > MAX_TRIP_DAYS
+                ))
+            )
+        )
+        if exclude_trip_id:
+            query = query.filter(Trip.id_trip != exclude_trip_id)
+
+        for row in query:
+            start, end = trip_interval(row.date_depart, row.heure_depart, row.date_arrivee,
+                                       row.heure_arrivee, row.nombre_jours)
+            if end <= self.window_start or start >= self.window_end:
+                continue
+            self.trips[row.id_trip] = {
+                'id': row.id_trip,
+                'type': row.type,
+                'nom': row.nom,
+                'code_voyage': row.code_voyage,
+                'debut': start.isoformat(),
+                'fin': end.isoformat()
+            }
+            yield row.id_trip, start, end, row.id_vehicule, row.id_chauffeur
+
+        yield from self._load_recurring(exclude_trip_id)
+
+    def _load_recurring(self, exclude_trip_id):
+        rules = {
+            rule.id_trip: rule
+            for rule in recurrence.get_rules(self.window_start, self.window_end)
+            if rule.id_trip != exclude_trip_id
+        }
+        if not rules:
+            return
+        rows = db.session.query(
+            Trip.id_trip, Trip.type, Trip.nom, Trip.code_voyage,
+            TripAffectation.id_vehicule, TripAffectation.id_chauffeur
+        ).join(
+            TripAffectation, TripAffectation.id_trip == Trip.id_trip
+        ).filter(Trip.id_trip.in_(list(rules))).all()
+
+        for row in rows:
+            for occurrence in rules[row.id_trip].occurrences(self.window_start, self.window_end):
+                self.trips.setdefault(row.id_trip, {
+                    'id': row.id_trip,
+                    'type': row.type,
+                    'nom': row.nom,
+                    'code_voyage': row.code_voyage,
+                    'debut': occurrence.debut.isoformat(),
+                    'fin': occurrence.fin.isoformat()
+                })
+                yield row.id_trip, occurrence.debut, occurrence.fin, row.id_vehicule, row.id_chauffeur
+
+    def vehicule_conflicts(self, vehicule_id, start=None, end=None):
+        index = self.vehicules.get(vehicule_id)
+        if index is None:
+            return []
+        return index.overlapping(start or self.window_start, end or self.window_end)
+
+    def chauffeur_conflicts(self, chauffeur_id, start=None, end=None):
+        index = self.chauffeurs.get(chauffeur_id)
+        if index is None:
+            return []
+        return index.overlapping(start or self.window_start, end or self.window_end)
+
+
+def check_availability(start, end, vehicule_ids=(), chauffeur_ids=(), exclude_trip_id=None):
+    """
+    Disponibilité de N véhicules et M chauffeurs entre `start` et `end` (une seule requête).
+    Retourne les identifiants libres et, pour les autres, les voyages en conflit.
+    """
+    index = AvailabilityIndex(start, end, exclude_trip_id=exclude_trip_id)
+
+    vehicules = {}
+    for vehicule_id in vehicule_ids:
+        vehicules[vehicule_id] = list(dict.fromkeys(index.vehicule_conflicts(vehicule_id)))
+    chauffeurs = {}
+    for chauffeur_id in chauffeur_ids:
+        chauffeurs[chauffeur_id] = list(dict.fromkeys(index.chauffeur_conflicts(chauffeur_id)))
+
+    referenced = {trip_id for conflicts in list(vehicules.values()) + list(chauffeurs.values()) for trip_id in conflicts}
+    return {
+        'vehicules_libres': [key for key, conflicts in vehicules.items() if not conflicts],
+        'chauffeurs_libres': [key for key, conflicts in chauffeurs.items() if not conflicts],
+        'conflits_vehicules': {str(key): conflicts for key, conflicts in vehicules.items() if conflicts},
+        'conflits_chauffeurs': {str(key): conflicts for key, conflicts in chauffeurs.items() if conflicts},
+        'voyages': {str(trip_id): index.trips[trip_id] for trip_id in sorted(referenced)}
+    }
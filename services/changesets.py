@@ -0,0 +1,99 @@
+from sqlalchemy import inspect
+
+
+class ChangeSet:
+    """Résultat d'un diff: lignes à insérer, à mettre à jour (objet, valeurs) et à supprimer"""
+
+    def __init__(self):
+        self.inserts = []
+        self.updates = []
+        self.deletes = []
+        self.unchanged = []
+
+    def __bool__(self):
+        return bool(self.inserts or self.updates or self.deletes)
+
+    def summary(self):
+        return {
+            'inserees': len(self.inserts),
+            'modifiees': len(self.updates),
+            'supprimees': len(self.deletes),
+            'inchangees': len(self.unchanged)
+        }
+
+
+def _values(obj, fields):
+    return tuple(getattr(obj, field) for field in fields)
+
+
+def diff_rows(existing, submitted, fields, match_keys=()):
+    """
+    Compare les objets existants aux lignes soumises (dictionnaires de `fields`, avec
+    éventuellement la clé primaire sous 'id'). L'appariement se fait, dans l'ordre:
+    1. par identifiant explicite (API JSON);
+    2. sur l'ensemble des champs (ligne inchangée: aucune requête);
+    3. sur chacune des clés partielles de `match_keys` (ex. même véhicule, autre chauffeur);
+    4. par position pour les restes, ce qui transforme un DELETE + INSERT en un UPDATE.
+    Les valeurs soumises doivent déjà avoir le type des colonnes (int, Decimal, ...).
+    """
+    changes = ChangeSet()
+    remaining = list(existing)
+    pending = []
+
+    def pair(obj, row):
+        remaining.remove(obj)
+        changed = {field: row[field] for field in fields if getattr(obj, field) != row[field]}
+        if changed:
+            changes.updates.append((obj, changed))
+        else:
+            changes.unchanged.append(obj)
+
+    by_pk = {}
+    if existing:
+        pk = inspect(type(existing[0])).primary_key[0].key
+        by_pk = {getattr(obj, pk): obj for obj in existing}
+    for row in submitted:
+        obj = by_pk.get(row.get('id'))
+        if obj is not None and obj in remaining:
+            pair(obj, row)
+        else:
+            pending.append(row)
+
+    for keys in [tuple(fields)] + [tuple(k) for k in match_keys]:
+        unmatched = []
+        for row in pending:
+            wanted = tuple(row[field] for field in keys)
+            obj = next((o for o in remaining if _values(o, keys) == wanted), None)
+            if obj is not None:
+                pair(obj, row)
+            else:
+                unmatched.append(row)
+        pending = unmatched
+
+    while pending and remaining:
+        pair(remaining[0], pending.pop(0))
+
+    changes.inserts.extend({field: row[field] for field in fields} for row in pending)
+    changes.deletes.extend(remaining)
+    return changes
+
+
+def apply_changes(session, changes, factory):
+    """
+    Applique un ChangeSet via la session: seules les lignes modifiées sont marquées,
+    et le flush regroupe les UPDATE/DELETE de même forme en executemany.
+    `factory(values)` construit un nouvel objet pour chaque insertion.
+    """
+    for obj in changes.deletes:
+        session.delete(obj)
+    for obj, values in changes.updates:
+        for field, value in values.items():
+            setattr(obj, field, value)
+    for values in changes.inserts:
+        session.add(factory(values))
+    return changes
+
+
+def sync_children(session, existing, submitted, fields, factory, match_keys=()):
+    """Diff + application en un appel; retourne le ChangeSet appliqué"""
+    return apply_changes(session, diff_rows(existing, submitted, fields, match_keys), factory)
@@ -0,0 +1,380 @@
+import threading
+import time as clock
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import event, func, literal, select
+from sqlalchemy.orm import aliased
+
+from models import db, Depense, Paiement, Trip, TripAffectation
+from services import money
+from services.fleet import trip_amount
+
+# Rechargement complet périodique: rattrape les modifications faites par les autres processus
+FULL_RELOAD_SECONDS = 900
+
+# Lignes relues par requête lors d'un rafraîchissement incrémental
+REFRESH_CHUNK = 500
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+TIME_DIMENSIONS = ('jour', 'semaine', 'mois', 'trimestre', 'annee')
+MEASURES = ('somme', 'nombre', 'moyenne', 'min', 'max')
+
+
+class Dictionary:
+    """Encodage par dictionnaire d'une dimension texte: valeur <-> code entier"""
+
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.encode(value)
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, code):
+        return self.values[code]
+
+
+def _enum_values(column):
+    return getattr(column.type, 'enums', ())
+
+
+def _day(value):
+    if value is None:
+        return 0
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal()
+
+
+class Fact:
+    """
+    Table de faits en colonnes NumPy. `dimensions` associe chaque dimension à sa colonne SQL;
+    les dimensions texte sont encodées par dictionnaire, les identifiants gardés tels quels
+    (-1 pour NULL). `trip_column` permet de relire les lignes d'un voyage modifié.
+    """
+
+    def __init__(self, name, model, pk, date_column, amount, dimensions, text_dimensions, trip_column=None, joins=()):
+        self.name = name
+        self.model = model
+        self.pk = pk
+        self.date_column = date_column
+        self.amount = amount
+        self.dimensions = dimensions
+        self.text_dimensions = text_dimensions
+        self.trip_column = trip_column
+        self.joins = joins
+        self.dictionaries = {
+            key: Dictionary(_enum_values(column)) for key, column in dimensions.items() if key in text_dimensions
+        }
+        self.columns = None
+        self.high_water = 0
+
+    def statement(self):
+        columns = [self.pk.label('id'), self.date_column.label('jour'), self.amount.label('montant')]
+        columns += [column.label(key) for key, column in self.dimensions.items()]
+        if self.trip_column is not None and 'id_trip' not in self.dimensions:
+            columns.append(self.trip_column.label('id_trip'))
+        statement = select(*columns).select_from(self.model)
+        for target, condition in self.joins:
+            statement = statement.join(target, condition)
+        return statement
+
+    def _to_columns(self, rows):
+        size = len(rows)
+        columns = {
+            'id': np.fromiter((row.id for row in rows), dtype=np.int64, count=size),
+            'jour': np.fromiter((_day(row.jour) for row in rows), dtype=np.int32, count=size),
+            'montant': money.cents_array([row.montant for row in rows]),
+        }
+        for key in self.dimensions:
+            if key in self.text_dimensions:
+                encode = self.dictionaries[key].encode
+                columns[key] = np.fromiter((encode(getattr(row, key)) for row in rows), dtype=np.int32, count=size)
+            else:
+                columns[key] = np.fromiter(
+                    (-1 if getattr(row, key) is None else getattr(row, key) for row in rows), dtype=np.int64, count=size
+                )
+        if self.trip_column is not None and 'id_trip' not in columns:
+            columns['id_trip'] = np.fromiter((row.id_trip for row in rows), dtype=np.int64, count=size)
+        return columns
+
+    def load(self):
+        rows = db.session.execute(self.statement()).all()
+        self.columns = self._to_columns(rows)
+        self.high_water = int(self.columns['id'].max()) if rows else 0
+
+    def refresh(self, ids, trip_ids):
+        """Relit les lignes modifiées (ou de voyages modifiés) et celles créées depuis le dernier chargement"""
+        ids = sorted(ids)
+        trip_ids = sorted(trip_ids) if self.trip_column is not None else []
+        conditions = [self.pk > self.high_water]
+        for start in range(0, len(ids), REFRESH_CHUNK):
+            conditions.append(self.pk.in_(ids[start:start + REFRESH_CHUNK]))
+        for start in range(0, len(trip_ids), REFRESH_CHUNK):
+            conditions.append(self.trip_column.in_(trip_ids[start:start + REFRESH_CHUNK]))
+        fetched = {}
+        for condition in conditions:
+            for row in db.session.execute(self.statement().where(condition)):
+                fetched[row.id] = row
+        rows = list(fetched.values())
+
+        # Retirer les anciennes versions des lignes relues et les lignes supprimées
+        stale = np.isin(self.columns['id'], np.array(ids + list(fetched), dtype=np.int64))
+        if trip_ids:
+            stale |= np.isin(self.columns['id_trip'], np.array(trip_ids, dtype=np.int64))
+        fresh = self._to_columns(rows)
+        self.columns = {key: np.concatenate([values[~stale], fresh[key]]) for key, values in self.columns.items()}
+        if rows:
+            self.high_water = max(self.high_water, max(fetched))
+        return len(rows)
+
+    # Requêtes -------------------------------------------------------------------------------
+
+    def _dimension(self, key):
+        """Valeurs (codes) d'une dimension, les dimensions de temps étant dérivées du jour"""
+        if key in self.columns:
+            return self.columns[key]
+        if key not in TIME_DIMENSIONS:
+            raise ValueError(f"Dimension inconnue pour {self.name} : {key}")
+        days = (self.columns['jour'].astype(np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
+        if key == 'jour':
+            return self.columns['jour'].astype(np.int64)
+        if key == 'semaine':
+            # Lundi de la semaine (le 1er janvier 1970 était un jeudi)
+            return self.columns['jour'].astype(np.int64) - (days.astype(np.int64) + 3) % 7
+        months = days.astype('datetime64[M]').astype(np.int64)
+        if key == 'mois':
+            return months
+        if key == 'trimestre':
+            return months // 3
+        return days.astype('datetime64[Y]').astype(np.int64)
+
+    def _label(self, key, code):
+        code = int(code)
+        if key in self.dictionaries:
+            return self.dictionaries[key].decode(code)
+        if key in ('jour', 'semaine'):
+            return date.fromordinal(code).isoformat()
+        if key == 'mois':
+            return f"{1970 + code // 12}-{code % 12 + 1:02d}"
+        if key == 'trimestre':
+            return f"{1970 + code // 4}-T{code % 4 + 1}"
+        if key == 'annee':
+            return str(1970 + code)
+        return None if code == -1 else code
+
+    def _code(self, key, label):
+        """Inverse de _label pour une dimension de temps: '2024-03' -> code du mois"""
+        label = str(label)
+        try:
+            if key in ('jour', 'semaine'):
+                day = date.fromisoformat(label)
+                # Tout jour de la semaine désigne la semaine (libellée par son lundi)
+                return day.toordinal() - (day.weekday() if key == 'semaine' else 0)
+            if key == 'mois':
+                year, month = label.split('-')
+                if not 1 <= int(month) <= 12:
+                    raise ValueError(label)
+                return (int(year) - 1970) * 12 + int(month) - 1
+            if key == 'trimestre':
+                year, quarter = label.split('-T')
+                if not 1 <= int(quarter) <= 4:
+                    raise ValueError(label)
+                return (int(year) - 1970) * 4 + int(quarter) - 1
+            return int(label) - 1970
+        except ValueError:
+            raise ValueError(f"Valeur invalide pour la dimension {key} : {label}")
+
+    def _mask(self, filters):
+        mask = np.ones(len(self.columns['id']), dtype=bool)
+        for key, wanted in (filters or {}).items():
+            if key == 'debut':
+                mask &= self.columns['jour'] >= _day(date.fromisoformat(wanted))
+            elif key == 'fin':
+                mask &= self.columns['jour'] <= _day(date.fromisoformat(wanted))
+            elif key == 'montant_min':
+                mask &= self.columns['montant'] >= money.to_cents(wanted)
+            elif key == 'montant_max':
+                mask &= self.columns['montant'] <= money.to_cents(wanted)
+            else:
+                wanted = wanted if isinstance(wanted, list) else [wanted]
+                if key in self.dictionaries:
+                    codes = self.dictionaries[key].codes
+                    wanted = [codes[value] for value in wanted if value in codes]
+                elif key in TIME_DIMENSIONS:
+                    # Les filtres reprennent les libellés retournés par query()
+                    wanted = [self._code(key, value) for value in wanted]
+                else:
+                    wanted = [-1 if value is None else value for value in wanted]
+                mask &= np.isin(self._dimension(key), np.array(wanted, dtype=np.int64))
+        return mask
+
+    def query(self, group_by=(), filters=None, measures=('somme', 'nombre')):
+        """
+        Agrège le montant (en centimes) par combinaison des dimensions `group_by`
+        sur les lignes retenues par `filters`; retourne des dictionnaires triés par clé.
+        """
+        for measure in measures:
+            if measure not in MEASURES:
+                raise ValueError(f"Mesure inconnue : {measure}")
+        mask = self._mask(filters)
+        amounts = self.columns['montant'][mask]
+        keys = [self._dimension(key)[mask] for key in group_by]
+
+        if keys:
+            stacked = np.stack(keys, axis=1)
+            groups, inverse = np.unique(stacked, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        else:
+            groups = np.zeros((1 if len(amounts) else 0, 0), dtype=np.int64)
+            inverse = np.zeros(len(amounts), dtype=np.int64)
+
+        # Tri par groupe puis réductions par tranche: sommes exactes en entiers
+        order = np.argsort(inverse, kind='stable')
+        sorted_amounts = amounts[order]
+        counts = np.bincount(inverse, minlength=len(groups))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]]) if len(groups) else np.zeros(0, dtype=np.int64)
+        results = {}
+        if len(groups):
+            if 'somme' in measures or 'moyenne' in measures:
+                results['somme'] = np.add.reduceat(sorted_amounts, starts)
+            if 'min' in measures:
+                results['min'] = np.minimum.reduceat(sorted_amounts, starts)
+            if 'max' in measures:
+                results['max'] = np.maximum.reduceat(sorted_amounts, starts)
+
+        rows = []
+        for index, group in enumerate(groups):
+            row = {key: self._label(key, code) for key, code in zip(group_by, group)}
+            if 'nombre' in measures:
+                row['nombre'] = int(counts[index])
+            for measure in ('somme', 'min', 'max'):
+                if measure in measures:
+                    row[measure] = money.as_number(results[measure][index])
+            if 'moyenne' in measures:
+                row['moyenne'] = money.as_number(round(int(results['somme'][index]) / int(counts[index])))
+            rows.append(row)
+        return rows
+
+
+def _facts():
+    # Le facteur 1.0 évite la division entière (SQLite), comme dans services.fleet
+    partage = aliased(TripAffectation)
+    affectation_amount = trip_amount() * literal(1.0) / select(func.count()).where(
+        partage.id_trip == Trip.id_trip
+    ).correlate(Trip).scalar_subquery()
+    return {
+        'paiements': Fact(
+            'paiements', Paiement, Paiement.id_paiement, Paiement.date_paiement, Paiement.montant_paye,
+            {'mode': Paiement.mode_paiement, 'utilisateur': Paiement.recu_par, 'type': Trip.type,
+             'id_trip': Paiement.id_trip},
+            text_dimensions=('mode', 'type'), trip_column=Paiement.id_trip,
+            joins=((Trip, Trip.id_trip == Paiement.id_trip),)
+        ),
+        'depenses': Fact(
+            'depenses', Depense, Depense.id_depense, Depense.date_depense, Depense.montant,
+            {'categorie': Depense.categorie, 'vehicule': Depense.id_vehicule, 'utilisateur': Depense.created_by},
+            text_dimensions=('categorie',)
+        ),
+        'voyages': Fact(
+            'voyages', Trip, Trip.id_trip, Trip.date_depart, trip_amount(),
+            {'type': Trip.type, 'etat': Trip.etat_trip, 'etat_paiement': Trip.etat_paiement,
+             'utilisateur': Trip.created_by, 'id_trip': Trip.id_trip},
+            text_dimensions=('type', 'etat', 'etat_paiement'), trip_column=Trip.id_trip
+        ),
+        # Une ligne par affectation; le montant du voyage est partagé à parts égales entre elles
+        'affectations': Fact(
+            'affectations', TripAffectation, TripAffectation.id_affectation, Trip.date_depart, affectation_amount,
+            {'vehicule': TripAffectation.id_vehicule, 'chauffeur': TripAffectation.id_chauffeur, 'type': Trip.type,
+             'etat': Trip.etat_trip, 'id_trip': TripAffectation.id_trip},
+            text_dimensions=('type', 'etat'), trip_column=TripAffectation.id_trip,
+            joins=((Trip, Trip.id_trip == TripAffectation.id_trip),)
+        ),
+    }
+
+
+class FinanceCube:
+    """Faits financiers en mémoire, chargés une fois puis rafraîchis à partir des identifiants modifiés"""
+
+    def __init__(self):
+        self.facts = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        self.changes = {name: set() for name in ('paiements', 'depenses', 'voyages', 'affectations')}
+        self.changed_trips = set()
+
+    def note_changes(self, fact, ids=(), trip_ids=()):
+        with self.lock:
+            self.changes[fact].update(ids)
+            self.changed_trips.update(trip_ids)
+
+    def ensure_fresh(self):
+        with self.lock:
+            if self.facts is None or clock.monotonic() - self.loaded_at > FULL_RELOAD_SECONDS:
+                self.facts = _facts()
+                for fact in self.facts.values():
+                    fact.load()
+                self.loaded_at = clock.monotonic()
+                changes = None
+            else:
+                changes = self.changes
+            trip_ids = self.changed_trips
+            self.changes = {name: set() for name in self.changes}
+            self.changed_trips = set()
+            if changes is not None:
+                for name, fact in self.facts.items():
+                    fact.refresh(changes[name], trip_ids if fact.trip_column is not None else ())
+        return self
+
+    def query(self, fact, group_by=(), filters=None, measures=('somme', 'nombre')):
+        self.ensure_fresh()
+        if fact not in self.facts:
+            raise ValueError(f"Table de faits inconnue : {fact}")
+        with self.lock:
+            return self.facts[fact].query(group_by, filters, measures)
+
+
+cube = FinanceCube()
+
+CHANGES = 'cube_modifications'
+
+
+def _after_flush(session, flush_context):
+    """Note les identifiants écrits; ils ne sont transmis au cube qu'après le commit"""
+    changes = session.info.setdefault(CHANGES, [])
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Paiement):
+            changes.append(('paiements', [obj.id_paiement], ()))
+        elif isinstance(obj, Depense):
+            changes.append(('depenses', [obj.id_depense], ()))
+        elif isinstance(obj, Trip):
+            changes.append(('voyages', [obj.id_trip], [obj.id_trip]))
+        elif isinstance(obj, TripAffectation):
+            # Le partage du montant entre affectations change pour tout le voyage
+            changes.append(('affectations', [obj.id_affectation], [obj.id_trip]))
+
+
+def _after_commit(session):
+    # Un rafraîchissement avant le commit relirait l'ancien état et oublierait ces lignes
+    for fact, ids, trip_ids in session.info.pop(CHANGES, ()):
+        cube.note_changes(fact, ids, trip_ids)
+
+
+def _after_rollback(session):
+    session.info.pop(CHANGES, None)
+
+
+def init_app(app):
+    for name, listener in (
+        ('after_flush', _after_flush), ('after_commit', _after_commit), ('after_rollback', _after_rollback)
+    ):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
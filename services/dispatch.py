@@ -0,0 +1,219 @@
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import or_
+
+from models import db, Trip, TripAffectation, Vehicule, Chauffeur
+from services import recurrence
+from services.availability import AvailabilityIndex, trip_interval
+
+
+class Proposal:
+    """Affectation proposée pour un voyage (non enregistrée)"""
+
+    def __init__(self, id_trip, id_vehicule, id_chauffeur, debut, fin):
+        self.id_trip = id_trip
+        self.id_vehicule = id_vehicule
+        self.id_chauffeur = id_chauffeur
+        self.debut = debut
+        self.fin = fin
+
+    def to_affectation(self):
+        return TripAffectation(id_trip=self.id_trip, id_vehicule=self.id_vehicule, id_chauffeur=self.id_chauffeur)
+
+    def to_dict(self):
+        return {
+            'id_trip': self.id_trip,
+            'id_vehicule': self.id_vehicule,
+            'id_chauffeur': self.id_chauffeur,
+            'debut': self.debut.isoformat(),
+            'fin': self.fin.isoformat()
+        }
+
+
+class DispatchPlan:
+    """Résultat du solveur: affectations proposées et voyages restés sans affectation (avec la raison)"""
+
+    def __init__(self):
+        self.proposals = []
+        self.unassigned = []
+
+    @property
+    def vehicules_utilises(self):
+        return sorted({proposal.id_vehicule for proposal in self.proposals})
+
+    def commit(self):
+        """Enregistre toutes les affectations proposées en une transaction"""
+        db.session.add_all([proposal.to_affectation() for proposal in self.proposals])
+        db.session.commit()
+        return len(self.proposals)
+
+    def to_dict(self):
+        return {
+            'affectations': [proposal.to_dict() for proposal in self.proposals],
+            'non_affectes': self.unassigned,
+            'vehicules_utilises': self.vehicules_utilises
+        }
+
+
+class _Resource:
+    """Véhicule ou chauffeur candidat: fin de sa dernière affectation proposée"""
+
+    __slots__ = ('id', 'places', 'busy_until', 'last_driver')
+
+    def __init__(self, id, places=None):
+        self.id = id
+        self.places = places
+        self.busy_until = None
+        self.last_driver = None
+
+    def free(self, start):
+        return self.busy_until is None or self.busy_until <= start
+
+
+def _unassigned_trips(first_day, last_day, trip_ids=None):
+    """Voyages ponctuels de la période, non annulés et sans aucune affectation"""
+    query = db.session.query(
+        Trip.id_trip, Trip.date_depart, Trip.heure_depart, Trip.date_arrivee, Trip.heure_arrivee,
+        Trip.nombre_jours, Trip.nombre_adultes, Trip.nombre_enfants, Trip.nombre_bebes
+    ).filter(
+        Trip.etat_trip.notin_(['Annulé', 'Terminé']),
+        or_(Trip.is_recurring.is_(False), Trip.is_recurring.is_(None)),
+        Trip.date_depart >= first_day,
+        Trip.date_depart <= last_day,
+        ~Trip.affectations.any()
+    )
+    if trip_ids is not None:
+        query = query.filter(Trip.id_trip.in_(list(trip_ids)))
+    return query.all()
+
+
+def _skipped_recurring(first_day, last_day, trip_ids=None):
+    """Voyages récurrents sans affectation ayant une occurrence dans la période: laissés au planning manuel"""
+    debut = datetime.combine(first_day, time.min)
+    fin = datetime.combine(last_day + timedelta(days=1), time.min)
+    ids = {
+        occurrence.id_trip for occurrence in recurrence.iter_occurrences(debut, fin, trip_ids)
+        if first_day <= occurrence.date <= last_day
+    }
+    if not ids:
+        return []
+    return [id_trip for id_trip, in db.session.query(Trip.id_trip).filter(
+        Trip.id_trip.in_(ids),
+        Trip.etat_trip.notin_(['Annulé', 'Terminé']),
+        ~Trip.affectations.any()
+    ).order_by(Trip.id_trip)]
+
+
+def plan_assignments(first_day, last_day, trip_ids=None, service_dates=None):
+    """
+    Propose un véhicule et un chauffeur pour chaque voyage sans affectation entre `first_day`
+    et `last_day` (inclus). Contraintes: places suffisantes, véhicule 'En marche', chauffeur
+    'Actif' dont le permis couvre le voyage, aucun chevauchement avec les affectations
+    existantes ni avec les autres propositions. Un véhicule présent dans `service_dates`
+    ({id_vehicule: date d'entretien prévue}) ne reçoit que des voyages terminés avant cette date.
+
+    Heuristique de partitionnement d'intervalles: les voyages sont traités par heure de
+    départ; on réutilise d'abord un véhicule déjà retenu et libre (le plus petit qui suffit),
+    et on n'en mobilise un nouveau qu'à défaut, ce qui limite le nombre de véhicules.
+    Le chauffeur qui vient de conduire le véhicule est gardé quand il est libre.
+    """
+    plan = DispatchPlan()
+    # Une affectation vaut pour toutes les occurrences: le solveur ne traite que les voyages ponctuels
+    for trip_id in _skipped_recurring(first_day, last_day, trip_ids):
+        plan.unassigned.append({'id_trip': trip_id, 'raison': 'Voyage récurrent: affectation manuelle'})
+    rows = _unassigned_trips(first_day, last_day, trip_ids)
+    if not rows:
+        return plan
+
+    trips = []
+    for row in rows:
+        start, end = trip_interval(row.date_depart, row.heure_depart, row.date_arrivee,
+                                   row.heure_arrivee, row.nombre_jours)
+        passagers = (row.nombre_adultes or 0) + (row.nombre_enfants or 0) + (row.nombre_bebes or 0)
+        trips.append((start, end, row.id_trip, passagers))
+    trips.sort()
+
+    window_start = min(start for start, _, _, _ in trips)
+    window_end = max(end for _, end, _, _ in trips)
+    index = AvailabilityIndex(window_start, window_end)
+
+    service_dates = service_dates or {}
+    vehicules = [
+        _Resource(vehicule_id, places)
+        for vehicule_id, places in db.session.query(Vehicule.id_vehicule, Vehicule.nombre_place).filter(
+            Vehicule.etat == 'En marche'
+        ).order_by(Vehicule.nombre_place, Vehicule.id_vehicule)
+    ]
+    chauffeurs = {
+        chauffeur_id: (_Resource(chauffeur_id), expiration)
+        for chauffeur_id, expiration in db.session.query(Chauffeur.id_chauffeur, Chauffeur.date_expiration_permis).filter(
+            Chauffeur.statut == 'Actif',
+            Chauffeur.date_expiration_permis >= first_day
+        ).order_by(Chauffeur.id_chauffeur)
+    }
+    used_vehicules = []
+    used_chauffeurs = []
+    used_ids = set()
+    seen_chauffeurs = set()
+
+    def vehicule_ok(vehicule, start, end, passagers):
+        # Pas de voyage roulant encore le jour de l'entretien prévu, ou après
+        service = service_dates.get(vehicule.id)
+        if service is not None and (end - timedelta(microseconds=1)).date() >= service:
+            return False
+        return (vehicule.places >= passagers and vehicule.free(start)
+                and not index.vehicule_conflicts(vehicule.id, start, end))
+
+    def chauffeur_ok(chauffeur_id, start, end):
+        entry = chauffeurs.get(chauffeur_id)
+        if entry is None:
+            return False
+        chauffeur, expiration = entry
+        # Le permis doit être valide jusqu'au dernier jour du voyage
+        last_day_of_trip = (end - timedelta(microseconds=1)).date()
+        return (expiration >= last_day_of_trip and chauffeur.free(start)
+                and not index.chauffeur_conflicts(chauffeur_id, start, end))
+
+    for start, end, trip_id, passagers in trips:
+        # Véhicules déjà mobilisés d'abord (plus petite capacité suffisante, libéré le plus tard)
+        candidates = sorted(
+            (v for v in used_vehicules if vehicule_ok(v, start, end, passagers)),
+            key=lambda v: (v.places, -(v.busy_until or datetime.min).timestamp())
+        )
+        if not candidates:
+            candidates = [v for v in vehicules if v.id not in used_ids and vehicule_ok(v, start, end, passagers)]
+        if not candidates:
+            fits = any(v.places >= passagers for v in vehicules)
+            plan.unassigned.append({
+                'id_trip': trip_id,
+                'raison': 'Aucun véhicule disponible' if fits else f'Aucun véhicule de {passagers} places'
+            })
+            continue
+
+        chauffeur_id = None
+        for vehicule in candidates:
+            if vehicule.last_driver is not None and chauffeur_ok(vehicule.last_driver, start, end):
+                chauffeur_id = vehicule.last_driver
+                break
+        else:
+            vehicule = candidates[0]
+            for candidate in used_chauffeurs + [c for c in chauffeurs if c not in seen_chauffeurs]:
+                if chauffeur_ok(candidate, start, end):
+                    chauffeur_id = candidate
+                    break
+        if chauffeur_id is None:
+            plan.unassigned.append({'id_trip': trip_id, 'raison': 'Aucun chauffeur disponible'})
+            continue
+
+        if vehicule.id not in used_ids:
+            used_ids.add(vehicule.id)
+            used_vehicules.append(vehicule)
+        if chauffeur_id not in seen_chauffeurs:
+            seen_chauffeurs.add(chauffeur_id)
+            used_chauffeurs.append(chauffeur_id)
+        vehicule.busy_until = end
+        vehicule.last_driver = chauffeur_id
+        chauffeurs[chauffeur_id][0].busy_until = end
+        plan.proposals.append(Proposal(trip_id, vehicule.id, chauffeur_id, start, end))
+
+    return plan
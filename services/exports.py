@@ -0,0 +1,186 @@
+import csv
+import io
+import tempfile
+from datetime import date, datetime, time
+
+from sqlalchemy import func, select
+
+from models import db, Trip, TripAffectation, Vehicule, Chauffeur
+
+# Lignes lues par aller-retour avec le curseur serveur
+YIELD_PER = 1000
+
+# Voyages regroupés par écriture dans la réponse CSV
+CSV_FLUSH_ROWS = 500
+
+
+def _affectations_label(column, join_model, join_on):
+    """Libellés des affectations d'un voyage concaténés en SQL (pas de requête par ligne)"""
+    return select(func.group_concat(column)).select_from(TripAffectation).join(
+        join_model, join_on
+    ).where(TripAffectation.id_trip == Trip.id_trip).scalar_subquery()
+
+
+def export_columns():
+    """(en-tête, colonne SQL) dans l'ordre du fichier exporté"""
+    return [
+        ('Code', Trip.code_voyage),
+        ('Nom du voyage', Trip.nom_voyage),
+        ('Type', Trip.type),
+        ('Nom', Trip.nom),
+        ('Point de départ', Trip.point_depart),
+        ("Point d'arrivée", Trip.point_arrivee),
+        ('Date de départ', Trip.date_depart),
+        ('Heure de départ', Trip.heure_depart),
+        ("Date d'arrivée", Trip.date_arrivee),
+        ("Heure d'arrivée", Trip.heure_arrivee),
+        ('Adultes', Trip.nombre_adultes),
+        ('Enfants', Trip.nombre_enfants),
+        ('Bébés', Trip.nombre_bebes),
+        ('Client', Trip.client_nom),
+        ('Téléphone', Trip.client_telephone),
+        ('Email', Trip.client_email),
+        ("Prix d'achat", Trip.prix_achat),
+        ('Prix de vente', Trip.prix_vente),
+        ('Commission', Trip.commission),
+        ('État', Trip.etat_trip),
+        ('Paiement', Trip.etat_paiement),
+        ('Véhicules', _affectations_label(
+            Vehicule.matricule, Vehicule, Vehicule.id_vehicule == TripAffectation.id_vehicule)),
+        ('Chauffeurs', _affectations_label(
+            Chauffeur.nom + ' ' + Chauffeur.prenom, Chauffeur,
+            Chauffeur.id_chauffeur == TripAffectation.id_chauffeur)),
+    ]
+
+
+# Colonnes reprises dans le PDF (paysage A4): (index dans export_columns, largeur en points)
+PDF_COLUMNS = ((0, 60), (6, 60), (7, 35), (2, 60), (4, 95), (5, 95), (13, 110), (17, 55), (19, 55), (21, 160))
+
+
+def iter_trip_rows(query):
+    """
+    Génère les lignes d'export de `query` (requête filtrée de la liste des voyages) par
+    paquets de YIELD_PER, via un curseur côté serveur: la mémoire ne dépend pas du volume.
+    """
+    statement = query.with_entities(*[column for _, column in export_columns()]).order_by(
+        None
+    ).order_by(Trip.date_depart.asc(), Trip.id_trip.asc()).statement
+    result = db.session.execute(statement.execution_options(yield_per=YIELD_PER))
+    for partition in result.partitions():
+        for row in partition:
+            yield tuple(row)
+
+
+def headers():
+    return [header for header, _ in export_columns()]
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, time):
+        return value.strftime('%H:%M')
+    return str(value)
+
+
+def stream_csv(rows):
+    """Génère le CSV (séparateur ';', BOM pour Excel) par blocs de CSV_FLUSH_ROWS lignes"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    writer.writerow(headers())
+    count = 0
+    for row in rows:
+        writer.writerow([_text(value) for value in row])
+        count += 1
+        if count % CSV_FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def write_xlsx(rows):
+    """
+    Écrit le classeur dans un fichier temporaire avec xlsxwriter en mode constant_memory
+    (chaque ligne est envoyée sur disque dès que la suivante commence).
+    Retourne le fichier, positionné au début.
+    """
+    import xlsxwriter
+
+    output = tempfile.TemporaryFile(suffix='.xlsx')
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'remove_timezone': True})
+    sheet = workbook.add_worksheet('Voyages')
+    bold = workbook.add_format({'bold': True})
+    date_format = workbook.add_format({'num_format': 'dd/mm/yyyy'})
+    time_format = workbook.add_format({'num_format': 'hh:mm'})
+    money_format = workbook.add_format({'num_format': '#,##0.00'})
+
+    sheet.write_row(0, 0, headers(), bold)
+    sheet.freeze_panes(1, 0)
+    for index, row in enumerate(rows, start=1):
+        for column, value in enumerate(row):
+            if value is None:
+                continue
+            if isinstance(value, date):
+                sheet.write_datetime(index, column, datetime.combine(value, time.min), date_format)
+            elif isinstance(value, time):
+                sheet.write_datetime(index, column, value, time_format)
+            elif isinstance(value, (int, float)):
+                sheet.write_number(index, column, value)
+            elif hasattr(value, 'is_finite'):
+                sheet.write_number(index, column, float(value), money_format)
+            else:
+                sheet.write_string(index, column, str(value))
+
+    workbook.close()
+    output.seek(0)
+    return output
+
+
+def write_pdf(rows, title='Voyages'):
+    """Écrit un tableau paginé (A4 paysage) page par page dans un fichier temporaire"""
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.pdfgen import canvas
+
+    output = tempfile.TemporaryFile(suffix='.pdf')
+    width, height = landscape(A4)
+    pdf = canvas.Canvas(output, pagesize=(width, height))
+    margin, line_height = 30, 14
+    labels = headers()
+
+    def clip(text, size):
+        # Tronque le texte à la largeur de la colonne
+        while text and pdf.stringWidth(text, 'Helvetica', 8) > size - 4:
+            text = text[:-1]
+        return text
+
+    def start_page(page):
+        pdf.setFont('Helvetica-Bold', 12)
+        pdf.drawString(margin, height - margin, f"{title} - page {page}")
+        pdf.setFont('Helvetica-Bold', 8)
+        x = margin
+        for index, size in PDF_COLUMNS:
+            pdf.drawString(x, height - margin - 2 * line_height, clip(labels[index], size))
+            x += size
+        pdf.setFont('Helvetica', 8)
+        return height - margin - 3 * line_height
+
+    page = 1
+    y = start_page(page)
+    for row in rows:
+        if y < margin:
+            pdf.showPage()
+            page += 1
+            y = start_page(page)
+        x = margin
+        for index, size in PDF_COLUMNS:
+            pdf.drawString(x, y, clip(_text(row[index]), size))
+            x += size
+        y -= line_height
+
+    pdf.save()
+    output.seek(0)
+    return output
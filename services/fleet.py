@@ -0,0 +1,130 @@
+from sqlalchemy import case, distinct, func, literal, select
+
+from models import db, Depense, EntretienVehicule, Trip, TripAffectation, Vehicule
+from services import money, periods
+
+# Répartition du montant d'un voyage entre ses véhicules
+ALLOCATIONS = ('places', 'egal')
+
+
+def trip_amount():
+    """Montant facturé d'un voyage: la commission, ou le prix de vente"""
+    return case(
+        (Trip.is_commission.is_(True), func.coalesce(Trip.commission, 0)),
+        else_=func.coalesce(Trip.prix_vente, 0)
+    )
+
+
+def pnl_statement(periode, allocation='places', vehicule_ids=None):
+    """
+    Requête unique du compte de résultat par véhicule sur la période:
+    revenus répartis sur les voyages non annulés (au prorata des places ou à parts égales
+    quand plusieurs véhicules sont affectés), dépenses et entretiens liés au véhicule.
+    """
+    if allocation not in ALLOCATIONS:
+        raise ValueError(f'Répartition inconnue : {allocation}')
+
+    # Couples (voyage, véhicule) distincts: un véhicule affecté avec deux chauffeurs compte une fois
+    couples = select(TripAffectation.id_trip, TripAffectation.id_vehicule).distinct().subquery('couples')
+
+    # Par voyage: nombre de véhicules et places cumulées
+    par_voyage = select(
+        couples.c.id_trip,
+        func.count().label('nb_vehicules'),
+        func.sum(Vehicule.nombre_place).label('places')
+    ).join(Vehicule, Vehicule.id_vehicule == couples.c.id_vehicule).group_by(couples.c.id_trip).subquery('par_voyage')
+
+    # Le facteur 1.0 évite la division entière (SQLite) sur des montants sans décimales
+    if allocation == 'places':
+        part = trip_amount() * literal(1.0) * Vehicule.nombre_place / func.nullif(par_voyage.c.places, 0)
+    else:
+        part = trip_amount() * literal(1.0) / par_voyage.c.nb_vehicules
+
+    revenus = select(
+        couples.c.id_vehicule,
+        func.sum(part).label('revenus'),
+        func.count(distinct(Trip.id_trip)).label('nb_voyages')
+    ).select_from(couples).join(
+        Trip, Trip.id_trip == couples.c.id_trip
+    ).join(
+        par_voyage, par_voyage.c.id_trip == couples.c.id_trip
+    ).join(
+        Vehicule, Vehicule.id_vehicule == couples.c.id_vehicule
+    ).where(
+        periods.in_period(Trip.date_depart, periode),
+        Trip.etat_trip != 'Annulé'
+    ).group_by(couples.c.id_vehicule).subquery('revenus')
+
+    depenses = select(
+        Depense.id_vehicule,
+        func.sum(Depense.montant).label('depenses')
+    ).where(
+        Depense.id_vehicule.isnot(None),
+        periods.in_period(Depense.date_depense, periode)
+    ).group_by(Depense.id_vehicule).subquery('depenses')
+
+    entretiens = select(
+        EntretienVehicule.id_vehicule,
+        func.sum(EntretienVehicule.prix_entretien).label('entretiens')
+    ).where(
+        periods.in_period(EntretienVehicule.date_entretien, periode)
+    ).group_by(EntretienVehicule.id_vehicule).subquery('entretiens')
+
+    revenu = func.coalesce(revenus.c.revenus, 0)
+    statement = select(
+        Vehicule.id_vehicule,
+        Vehicule.matricule,
+        Vehicule.modele,
+        revenu.label('revenus'),
+        func.coalesce(depenses.c.depenses, 0).label('depenses'),
+        func.coalesce(entretiens.c.entretiens, 0).label('entretiens'),
+        func.coalesce(revenus.c.nb_voyages, 0).label('nb_voyages')
+    ).outerjoin(
+        revenus, revenus.c.id_vehicule == Vehicule.id_vehicule
+    ).outerjoin(
+        depenses, depenses.c.id_vehicule == Vehicule.id_vehicule
+    ).outerjoin(
+        entretiens, entretiens.c.id_vehicule == Vehicule.id_vehicule
+    ).order_by(Vehicule.matricule)
+
+    if vehicule_ids is not None:
+        statement = statement.where(Vehicule.id_vehicule.in_(list(vehicule_ids)))
+    return statement
+
+
+MONEY_KEYS = ('revenus', 'depenses', 'entretiens', 'couts', 'marge')
+
+
+def fleet_pnl(periode, allocation='places', vehicule_ids=None):
+    """
+    Compte de résultat de chaque véhicule (dictionnaires), en une requête.
+    Montants en centimes entiers: la part de revenu est arrondie au centime, le reste est exact.
+    """
+    rows = db.session.execute(pnl_statement(periode, allocation, vehicule_ids)).mappings()
+    result = []
+    for row in rows:
+        revenus = money.to_cents(row['revenus'])
+        depenses = money.to_cents(row['depenses'])
+        entretiens = money.to_cents(row['entretiens'])
+        result.append({
+            'id_vehicule': row['id_vehicule'],
+            'matricule': row['matricule'],
+            'modele': row['modele'],
+            'revenus': revenus,
+            'depenses': depenses,
+            'entretiens': entretiens,
+            'couts': depenses + entretiens,
+            'marge': revenus - depenses - entretiens,
+            'nb_voyages': row['nb_voyages'],
+        })
+    return result
+
+
+def totals(rows):
+    """Totaux de la flotte (centimes) à partir des lignes de fleet_pnl"""
+    return {key: sum(row[key] for row in rows) for key in MONEY_KEYS}
+
+
+def as_json(row):
+    """Ligne (ou totaux) de fleet_pnl avec les montants en nombres JSON"""
+    return {key: money.as_number(value) if key in MONEY_KEYS else value for key, value in row.items()}
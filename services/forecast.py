@@ -0,0 +1,175 @@
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import and_, or_, select
+
+from models import db, EntretienVehicule, Trip, TripAffectation, Vehicule
+from services import maintenance
+
+# Fenêtre d'historique (semaines) pour estimer le kilométrage journalier
+WINDOW_WEEKS = 8
+
+# Horizon de projection jour par jour; au-delà, extrapolation au rythme estimé
+HORIZON_DAYS = 365
+
+# Intervalle minimal entre le relevé le plus ancien de la fenêtre et aujourd'hui pour
+# préférer le compteur aux voyages
+MIN_SPAN_DAYS = 7
+
+# Horizon par défaut du planificateur d'entretiens
+DUE_DAYS = 30
+
+
+def _ordinals(values):
+    return np.fromiter((value.toordinal() for value in values), dtype=np.int64, count=len(values))
+
+
+def _load(window_start, today, horizon_end):
+    """Les trois lectures de la prévision: véhicules (et prochain entretien), voyages, relevés"""
+    ranked = maintenance.latest_maintenance()
+    vehicules = db.session.execute(
+        select(Vehicule.id_vehicule, Vehicule.matricule, Vehicule.kilometrage_vehicule,
+               ranked.c.id_entretien, ranked.c.kilometrage_suivant)
+        .outerjoin(ranked, and_(ranked.c.id_vehicule == Vehicule.id_vehicule, ranked.c.rang == 1))
+        .order_by(Vehicule.id_vehicule)
+    ).all()
+
+    # Voyages terminés de la fenêtre et voyages prévus de l'horizon, une fois par véhicule
+    couples = select(TripAffectation.id_trip, TripAffectation.id_vehicule).distinct().subquery('couples')
+    trajets = db.session.execute(
+        select(couples.c.id_vehicule, Trip.date_depart, Trip.distance, Trip.etat_trip)
+        .join(Trip, Trip.id_trip == couples.c.id_trip)
+        .where(
+            Trip.distance.isnot(None),
+            or_(
+                and_(Trip.etat_trip == 'Terminé', Trip.date_depart >= window_start, Trip.date_depart < today),
+                and_(Trip.etat_trip.in_(('Planifié', 'En cours')),
+                     Trip.date_depart >= today, Trip.date_depart < horizon_end)
+            )
+        )
+    ).all()
+
+    releves = db.session.execute(
+        select(EntretienVehicule.id_vehicule, EntretienVehicule.date_entretien, EntretienVehicule.kilometrage)
+        .where(EntretienVehicule.date_entretien >= window_start, EntretienVehicule.date_entretien < today)
+    ).all()
+    return vehicules, trajets, releves
+
+
+def _rates(vehicle_index, compteurs, trajets, releves, window_start, today):
+    """
+    Kilométrage journalier de chaque véhicule et sa source:
+    - compteur: (compteur actuel - plus ancien relevé de la fenêtre) / jours écoulés
+    - voyages: distance des voyages terminés de la fenêtre / durée de la fenêtre
+    Le compteur est préféré quand il couvre au moins MIN_SPAN_DAYS (il voit aussi les trajets non saisis).
+    """
+    size = len(vehicle_index)
+    window_days = (today - window_start).days
+    km_voyages = np.zeros(size)
+    if len(trajets[0]):
+        rows = np.searchsorted(vehicle_index, trajets[0])
+        np.add.at(km_voyages, rows, trajets[2])
+    rate_voyages = km_voyages / window_days
+
+    rate_compteur = np.full(size, np.nan)
+    vehicles, days, km = releves
+    if len(vehicles):
+        order = np.lexsort((days, vehicles))
+        vehicles, days, km = vehicles[order], days[order], km[order]
+        # Premier relevé (le plus ancien) de chaque véhicule
+        firsts, positions = np.unique(vehicles, return_index=True)
+        rows = np.searchsorted(vehicle_index, firsts)
+        span = today.toordinal() - days[positions]
+        usable = span >= MIN_SPAN_DAYS
+        rate_compteur[rows[usable]] = (compteurs[rows[usable]] - km[positions][usable]) / span[usable]
+        rate_compteur[rate_compteur < 0] = np.nan
+
+    from_compteur = ~np.isnan(rate_compteur)
+    return np.where(from_compteur, rate_compteur, rate_voyages), from_compteur
+
+
+def forecast(today=None, weeks=WINDOW_WEEKS, horizon=HORIZON_DAYS):
+    """
+    Date à laquelle chaque véhicule atteindra le kilométrage de son prochain entretien.
+
+    Le kilométrage projeté à J+d est le compteur actuel plus le plus grand de:
+    - d jours au rythme estimé sur les `weeks` dernières semaines
+    - la distance cumulée des voyages prévus qui lui sont affectés jusqu'à J+d
+    (un planning chargé avance l'échéance, un planning vide ne la recule pas).
+    Calculé en une matrice véhicules x jours pour toute la flotte.
+    """
+    today = today or date.today()
+    window_start = today - timedelta(weeks=weeks)
+    vehicules, trajets, releves = _load(window_start, today, today + timedelta(days=horizon))
+    vehicle_index = np.array([row.id_vehicule for row in vehicules], dtype=np.int64)
+    compteurs = np.array([row.kilometrage_vehicule or 0 for row in vehicules], dtype=float)
+    suivants = np.array(
+        [np.nan if row.kilometrage_suivant is None else row.kilometrage_suivant for row in vehicules], dtype=float
+    )
+
+    passes = [row for row in trajets if row.date_depart < today]
+    prevus = [row for row in trajets if row.date_depart >= today]
+
+    def columns(rows):
+        return (
+            np.array([row.id_vehicule for row in rows], dtype=np.int64),
+            _ordinals([row.date_depart for row in rows]),
+            np.array([row.distance for row in rows], dtype=float),
+        )
+
+    releves = (
+        np.array([row.id_vehicule for row in releves], dtype=np.int64),
+        _ordinals([row.date_entretien for row in releves]),
+        np.array([row.kilometrage for row in releves], dtype=float),
+    )
+    rates, from_compteur = _rates(vehicle_index, compteurs, columns(passes), releves, window_start, today)
+
+    # Distance prévue cumulée à la fin de chaque jour de l'horizon
+    prevu = np.zeros((len(vehicle_index), horizon))
+    vehicles, days, km = columns(prevus)
+    if len(vehicles):
+        np.add.at(prevu, (np.searchsorted(vehicle_index, vehicles), days - today.toordinal()), km)
+    prevu = np.cumsum(prevu, axis=1)
+
+    restant = suivants - compteurs
+    offsets = np.arange(1, horizon + 1)
+    projete = np.maximum(rates[:, None] * offsets[None, :], prevu)
+    atteint = projete >= restant[:, None]
+    within = atteint.any(axis=1)
+    jours = np.where(within, atteint.argmax(axis=1) + 1, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Au-delà de l'horizon: extrapolation au rythme estimé (jamais si le véhicule ne roule pas)
+        beyond = np.ceil(restant / rates)
+    jours = np.where(within, jours, np.where(rates > 0, beyond, np.nan))
+    jours[restant <= 0] = 0
+    jours[np.isnan(restant)] = np.nan
+
+    resultats = []
+    for i, vehicule in enumerate(vehicules):
+        dans = None if np.isnan(jours[i]) else int(jours[i])
+        resultats.append({
+            'id_vehicule': vehicule.id_vehicule,
+            'matricule': vehicule.matricule,
+            'id_entretien': vehicule.id_entretien,
+            'kilometrage': round(float(compteurs[i]), 1),
+            'kilometrage_suivant': None if np.isnan(suivants[i]) else round(float(suivants[i]), 1),
+            'restant': None if np.isnan(restant[i]) else round(float(restant[i]), 1),
+            'km_jour': round(float(rates[i]), 1),
+            'source': 'compteur' if from_compteur[i] else 'voyages',
+            'km_prevus': round(float(prevu[i, -1]), 1) if horizon else 0.0,
+            'jours': dans,
+            'date_prevue': None if dans is None else (today + timedelta(days=dans)).isoformat(),
+        })
+    return resultats
+
+
+def services_due(days=DUE_DAYS, today=None, weeks=WINDOW_WEEKS):
+    """Entretiens prévus dans les `days` prochains jours (déjà dépassés compris), les plus proches d'abord"""
+    due = [row for row in forecast(today, weeks) if row['jours'] is not None and row['jours'] <= days]
+    return sorted(due, key=lambda row: (row['jours'], row['id_vehicule']))
+
+
+def vehicles_due_by(last_day, today=None):
+    """Entretiens prévus (ou dépassés) au plus tard le `last_day`, quelle que soit la longueur de la période"""
+    today = today or date.today()
+    return services_due(max((last_day - today).days, 0), today)
@@ -0,0 +1,250 @@
+import warnings
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, Depense, EntretienVehicule, Trip, TripAffectation, Vehicule
+from services import money, periods
+
+DECOUPAGES = ('mois', 'semaine')
+
+# Score robuste (écart à la médiane en MAD) au-delà duquel une valeur est signalée
+OUTLIER_SCORE = 3.5
+
+# Constante de normalisation du MAD (loi normale)
+MAD_SCALE = 1.4826
+
+# Dispersion minimale retenue, en fraction de la médiane
+MAD_FLOOR = 0.1
+
+# Distance minimale d'une tranche pour calculer un coût au km significatif
+MIN_KM = 50
+
+
+def edges(periode, decoupage='mois'):
+    """Bornes des tranches de la période: [debut, ..., fin], chaque tranche excluant sa borne de fin"""
+    if decoupage not in DECOUPAGES:
+        raise ValueError(f'Découpage inconnu : {decoupage}')
+    bounds = [periode.debut]
+    day = periode.debut
+    while day < periode.fin:
+        if decoupage == 'mois':
+            day = date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+        else:
+            day = day + timedelta(days=7 - day.weekday())
+        bounds.append(min(day, periode.fin))
+    return bounds
+
+
+def _ordinals(values):
+    return np.fromiter((value.toordinal() for value in values), dtype=np.int64, count=len(values))
+
+
+def _accumulate(shape, vehicles, days, amounts, vehicle_index, bounds):
+    """Somme `amounts` dans une matrice véhicules x tranches (lignes hors période ou hors flotte ignorées)"""
+    result = np.zeros(shape, dtype=amounts.dtype if len(amounts) else np.int64)
+    if not len(amounts) or not len(vehicle_index):
+        return result
+    rows = np.searchsorted(vehicle_index, vehicles)
+    rows = np.minimum(rows, len(vehicle_index) - 1)
+    columns = np.searchsorted(bounds, days, side='right') - 1
+    keep = (vehicle_index[rows] == vehicles) & (columns >= 0) & (columns < shape[1])
+    np.add.at(result, (rows[keep], columns[keep]), amounts[keep])
+    return result
+
+
+def _odometer(vehicle_index, bounds, readings):
+    """
+    Kilométrage au compteur à chaque borne, interpolé entre les relevés de chaque véhicule
+    (entretiens et compteur actuel). NaN hors de l'intervalle couvert par les relevés.
+    Tous les véhicules en une passe: les relevés sont triés sur la clé (véhicule, jour).
+    """
+    result = np.full((len(vehicle_index), len(bounds)), np.nan)
+    if not len(readings[0]):
+        return result
+    vehicles, days, km = readings
+    order = np.lexsort((days, vehicles))
+    vehicles, days, km = vehicles[order], days[order], km[order]
+    span = int(max(days.max(), bounds.max())) + 1
+    keys = vehicles * span + days
+
+    queries = (vehicle_index[:, None] * span + bounds[None, :]).ravel()
+    query_vehicles = np.repeat(vehicle_index, len(bounds))
+    after = np.searchsorted(keys, queries, side='left')
+    before = after - 1
+    after_ok = after < len(keys)
+    after = np.minimum(after, len(keys) - 1)
+    before_ok = before >= 0
+    before = np.maximum(before, 0)
+
+    exact = after_ok & (keys[after] == queries)
+    between = (
+        before_ok & after_ok & ~exact
+        & (vehicles[before] == query_vehicles) & (vehicles[after] == query_vehicles)
+    )
+    values = np.full(len(queries), np.nan)
+    values[exact] = km[after[exact]]
+    width = (days[after] - days[before]).astype(float)
+    width[width == 0] = 1
+    ratio = (queries - keys[before]) / width
+    values[between] = (km[before] + ratio * (km[after] - km[before]))[between]
+    return values.reshape(result.shape)
+
+
+def _robust_scores(matrix):
+    """Écart de chaque valeur à la médiane de sa ligne, en MAD (NaN ignorés)"""
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        # Lignes entièrement NaN (aucune tranche significative): score NaN sans avertissement
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(matrix, axis=1, keepdims=True)
+        mad = np.nanmedian(np.abs(matrix - median), axis=1, keepdims=True) * MAD_SCALE
+        # Série très régulière: un écart de moins de MAD_FLOOR de la médiane n'est jamais aberrant
+        mad = np.maximum(mad, np.abs(median) * MAD_FLOOR)
+        return (matrix - median) / mad
+
+
+def _load(periode, vehicule_ids=None):
+    """Les quatre lectures groupées de l'analyse: véhicules, trajets, dépenses, entretiens"""
+    vehicules = select(
+        Vehicule.id_vehicule, Vehicule.matricule, Vehicule.modele, Vehicule.carburant, Vehicule.kilometrage_vehicule
+    ).order_by(Vehicule.id_vehicule)
+    if vehicule_ids is not None:
+        vehicules = vehicules.where(Vehicule.id_vehicule.in_(list(vehicule_ids)))
+    vehicules = db.session.execute(vehicules).all()
+
+    # Un véhicule affecté avec deux chauffeurs ne parcourt le trajet qu'une fois
+    couples = select(TripAffectation.id_trip, TripAffectation.id_vehicule).distinct().subquery('couples')
+    trajets = db.session.execute(
+        select(couples.c.id_vehicule, Trip.date_depart, Trip.distance)
+        .join(Trip, Trip.id_trip == couples.c.id_trip)
+        .where(periods.in_period(Trip.date_depart, periode), Trip.etat_trip != 'Annulé', Trip.distance.isnot(None))
+    ).all()
+
+    depenses = db.session.execute(
+        select(Depense.id_vehicule, Depense.date_depense, Depense.categorie, Depense.montant)
+        .where(
+            Depense.id_vehicule.isnot(None), Depense.categorie.in_(('Carburant', 'Entretien')),
+            periods.in_period(Depense.date_depense, periode)
+        )
+    ).all()
+
+    # Tous les relevés de compteur: ceux hors période servent à interpoler les bornes
+    entretiens = db.session.execute(
+        select(EntretienVehicule.id_vehicule, EntretienVehicule.date_entretien,
+               EntretienVehicule.kilometrage, EntretienVehicule.prix_entretien)
+    ).all()
+    return vehicules, trajets, depenses, entretiens
+
+
+def analyse(periode, decoupage='mois', vehicule_ids=None, today=None):
+    """
+    Distance, carburant, entretien et coût au km de chaque véhicule par tranche de la période,
+    calculés en matrices véhicules x tranches, avec les valeurs aberrantes signalées:
+    - tranche dont le carburant au km s'écarte de la médiane du véhicule (saut soudain)
+    - véhicule dont le carburant au km de la période s'écarte de la médiane de la flotte
+    """
+    today = today or date.today()
+    bounds_dates = edges(periode, decoupage)
+    bounds = _ordinals(bounds_dates)
+    vehicules, trajets, depenses, entretiens = _load(periode, vehicule_ids)
+    vehicle_index = np.array([row.id_vehicule for row in vehicules], dtype=np.int64)
+    shape = (len(vehicle_index), len(bounds) - 1)
+
+    def column(rows, index, dtype=np.int64):
+        return np.array([row[index] for row in rows], dtype=dtype)
+
+    def cents(rows, index):
+        return money.cents_array([row[index] for row in rows])
+
+    # Distance déclarée sur les voyages
+    km_voyages = _accumulate(
+        shape, column(trajets, 0), _ordinals([row[1] for row in trajets]), column(trajets, 2, float),
+        vehicle_index, bounds
+    ) if trajets else np.zeros(shape)
+
+    # Dépenses liées au véhicule, en centimes
+    carburant_rows = [row for row in depenses if row.categorie == 'Carburant']
+    entretien_rows = [row for row in depenses if row.categorie == 'Entretien']
+    carburant = _accumulate(
+        shape, column(carburant_rows, 0), _ordinals([row[1] for row in carburant_rows]),
+        cents(carburant_rows, 3), vehicle_index, bounds
+    )
+    entretien = _accumulate(
+        shape, column(entretien_rows, 0), _ordinals([row[1] for row in entretien_rows]),
+        cents(entretien_rows, 3), vehicle_index, bounds
+    )
+    entretien += _accumulate(
+        shape, column(entretiens, 0), _ordinals([row[1] for row in entretiens]),
+        cents(entretiens, 3), vehicle_index, bounds
+    )
+
+    # Relevés de compteur: entretiens + compteur actuel du véhicule (aujourd'hui)
+    compteurs_actuels = np.array([row.kilometrage_vehicule or 0 for row in vehicules], dtype=float)
+    readings = (
+        np.concatenate([column(entretiens, 0), vehicle_index]),
+        np.concatenate([_ordinals([row[1] for row in entretiens]), np.full(len(vehicle_index), today.toordinal())]),
+        np.concatenate([column(entretiens, 2, float), compteurs_actuels]),
+    )
+    compteur = _odometer(vehicle_index, bounds, readings)
+    km_compteur = np.diff(compteur, axis=1)
+    km_compteur[km_compteur < 0] = np.nan
+
+    # Distance retenue: le compteur quand il couvre la tranche, sinon les voyages
+    km = np.where(np.isnan(km_compteur), km_voyages, np.maximum(km_compteur, 0))
+    couts = carburant + entretien
+    with np.errstate(invalid='ignore', divide='ignore'):
+        significatif = km >= MIN_KM
+        carburant_km = np.where(significatif, carburant / 100 / km, np.nan)
+        cout_km = np.where(significatif, couts / 100 / km, np.nan)
+        km_total = km.sum(axis=1)
+        carburant_km_total = np.where(km_total >= MIN_KM, carburant.sum(axis=1) / 100 / km_total, np.nan)
+        cout_km_total = np.where(km_total >= MIN_KM, couts.sum(axis=1) / 100 / km_total, np.nan)
+
+    # Une tranche sans plein n'a pas de consommation mesurée (le plein suivant la couvre): un 0
+    # ferait tomber la médiane à 0 et signalerait chaque plein comme aberrant
+    sauts = np.abs(_robust_scores(np.where(carburant > 0, carburant_km, np.nan))) > OUTLIER_SCORE
+    mesure = np.where(carburant.sum(axis=1) > 0, carburant_km_total, np.nan)
+    flotte = np.abs(_robust_scores(mesure[None, :]))[0] > OUTLIER_SCORE
+
+    def number(value, digits=2):
+        return None if np.isnan(value) else round(float(value), digits)
+
+    tranches = [
+        {'debut': debut.isoformat(), 'fin': (fin - timedelta(days=1)).isoformat()}
+        for debut, fin in zip(bounds_dates[:-1], bounds_dates[1:])
+    ]
+    resultats = []
+    for i, vehicule in enumerate(vehicules):
+        alertes = []
+        if flotte[i]:
+            alertes.append({'type': 'flotte', 'message': 'Consommation au km anormale par rapport à la flotte'})
+        for j in np.flatnonzero(sauts[i]):
+            alertes.append({
+                'type': 'saut', 'tranche': tranches[j]['debut'],
+                'message': f"Carburant au km inhabituel ({carburant_km[i, j]:.3f})"
+            })
+        resultats.append({
+            'id_vehicule': vehicule.id_vehicule,
+            'matricule': vehicule.matricule,
+            'modele': vehicule.modele,
+            'carburant_type': vehicule.carburant,
+            'km': round(float(km_total[i]), 1),
+            'km_voyages': round(float(km_voyages[i].sum()), 1),
+            'carburant': money.as_number(carburant[i].sum()),
+            'entretien': money.as_number(entretien[i].sum()),
+            'carburant_km': number(carburant_km_total[i], 3),
+            'cout_km': number(cout_km_total[i], 3),
+            'alertes': alertes,
+            'tranches': [{
+                'km': round(float(km[i, j]), 1),
+                'km_compteur': number(km_compteur[i, j], 1),
+                'km_voyages': round(float(km_voyages[i, j]), 1),
+                'carburant': money.as_number(carburant[i, j]),
+                'entretien': money.as_number(entretien[i, j]),
+                'carburant_km': number(carburant_km[i, j], 3),
+                'cout_km': number(cout_km[i, j], 3),
+                'aberrant': bool(sauts[i, j]),
+            } for j in range(shape[1])],
+        })
+    return {'tranches': tranches, 'vehicules': resultats}
@@ -0,0 +1,386 @@
+import codecs
+import csv
+import json
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Trip, TripAffectation, Vehicule, Chauffeur
+from services.search import reindex_trips
+from services import maintenance, receivables, reports
+from services.sequences import reserve_codes
+
+# Nombre de lignes validées par transaction
+CHUNK_SIZE = 1000
+
+TEXT_FIELDS = {
+    'nom': 255, 'point_depart': 255, 'point_arrivee': 255,
+    'client_nom': 100, 'client_telephone': 20, 'client_email': 100, 'commentaires': None,
+}
+INTEGER_FIELDS = ('nombre_jours', 'nombre_adultes', 'nombre_enfants', 'nombre_bebes')
+MONEY_FIELDS = ('prix_achat', 'prix_vente', 'commission')
+ENUM_FIELDS = ('type', 'etat_paiement', 'etat_trip')
+
+# Toutes les lignes d'un executemany doivent avoir les mêmes clés
+TRIP_COLUMNS = (
+    'nom_voyage', 'code_voyage', 'type', 'nom', 'point_depart', 'point_arrivee', 'distance',
+    'heure_depart', 'heure_arrivee', 'date_depart', 'date_arrivee', 'nombre_jours',
+    'prix_achat', 'prix_vente', 'commission', 'is_commission', 'is_recurring',
+    'nombre_adultes', 'nombre_enfants', 'nombre_bebes', 'etat_paiement', 'etat_trip',
+    'client_nom', 'client_telephone', 'client_email', 'commentaires', 'date_creation', 'created_by',
+)
+
+
+def _enum_values(column_name):
+    return set(Trip.__table__.c[column_name].type.enums)
+
+
+def iter_csv(stream):
+    """
+    Lit un CSV enregistrement par enregistrement (séparateur ',' ou ';' détecté sur l'en-tête).
+    Génère (ligne, dictionnaire): la ligne du fichier où commence l'enregistrement, un champ
+    entre guillemets pouvant s'étendre sur plusieurs lignes.
+    """
+    text_stream = codecs.getreader('utf-8-sig')(stream)
+    header = text_stream.readline()
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+    try:
+        fields = next(csv.reader([header], delimiter=delimiter))
+    except csv.Error as e:
+        raise csv.Error(f'ligne 1: {e}') from e
+    reader = csv.DictReader(text_stream, fieldnames=[f.strip() for f in fields], delimiter=delimiter)
+    # line_num compte les lignes lues après l'en-tête (ligne 1)
+    start = reader.line_num
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            raise csv.Error(f'ligne {start + 2}: {e}') from e
+        yield start + 2, row
+        start = reader.line_num
+
+
+def iter_json(stream, chunk_size=64 * 1024):
+    """
+    Lit un tableau JSON (ou du JSON Lines) objet par objet sans charger tout le fichier.
+    """
+    decoder = json.JSONDecoder()
+    reader = codecs.getreader('utf-8-sig')(stream)
+    buffer = ''
+    eof = False
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,[')
+        if buffer.startswith(']'):
+            return
+        if buffer:
+            try:
+                obj, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                buffer = buffer[end:]
+                yield obj
+                continue
+        if eof:
+            return
+        data = reader.read(chunk_size)
+        if not data:
+            eof = True
+        buffer += data
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+class RowValidator:
+    """Valide et convertit une ligne brute en valeurs prêtes pour l'insertion"""
+
+    def __init__(self):
+        self.enums = {field: _enum_values(field) for field in ENUM_FIELDS}
+        self.vehicules = {}
+        for id_vehicule, matricule in db.session.query(Vehicule.id_vehicule, Vehicule.matricule):
+            self.vehicules[str(id_vehicule)] = id_vehicule
+            self.vehicules[matricule.upper()] = id_vehicule
+        self.chauffeurs = {}
+        for id_chauffeur, numero_cin in db.session.query(Chauffeur.id_chauffeur, Chauffeur.numero_cin):
+            self.chauffeurs[str(id_chauffeur)] = id_chauffeur
+            self.chauffeurs[numero_cin.upper()] = id_chauffeur
+
+    def validate(self, raw):
+        errors = []
+        values = {}
+        raw = {(key or '').strip(): value for key, value in raw.items()}
+
+        def get(field):
+            value = raw.get(field)
+            return value.strip() if isinstance(value, str) else value
+
+        nom_voyage = get('nom_voyage')
+        if _blank(nom_voyage):
+            errors.append('nom_voyage obligatoire')
+        elif len(str(nom_voyage)) > 255:
+            errors.append('nom_voyage trop long')
+        values['nom_voyage'] = str(nom_voyage) if not _blank(nom_voyage) else None
+
+        for field in ENUM_FIELDS:
+            value = get(field)
+            if _blank(value):
+                if field == 'type':
+                    errors.append('type obligatoire')
+                values[field] = None
+            elif value not in self.enums[field]:
+                errors.append(f"{field} invalide: '{value}' (attendu: {', '.join(sorted(self.enums[field]))})")
+            else:
+                values[field] = value
+        values['etat_paiement'] = values['etat_paiement'] or 'Non payé'
+        values['etat_trip'] = values['etat_trip'] or 'Planifié'
+
+        for field, parse, required in (
+            ('date_depart', lambda v: datetime.strptime(v, '%Y-%m-%d').date(), True),
+            ('date_arrivee', lambda v: datetime.strptime(v, '%Y-%m-%d').date(), False),
+            ('heure_depart', lambda v: datetime.strptime(v[:5], '%H:%M').time(), False),
+            ('heure_arrivee', lambda v: datetime.strptime(v[:5], '%H:%M').time(), False),
+        ):
+            value = get(field)
+            if _blank(value):
+                if required:
+                    errors.append(f'{field} obligatoire')
+                values[field] = None
+                continue
+            try:
+                values[field] = parse(str(value))
+            except ValueError:
+                errors.append(f"{field} invalide: '{value}'")
+                values[field] = None
+
+        if values['date_depart'] and values['date_arrivee'] and values['date_arrivee'] < values['date_depart']:
+            errors.append("date_arrivee antérieure à date_depart")
+
+        for field in INTEGER_FIELDS:
+            value = get(field)
+            try:
+                values[field] = int(value) if not _blank(value) else (None if field == 'nombre_jours' else 0)
+                if values[field] is not None and values[field] < 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                errors.append(f"{field} invalide: '{value}'")
+                values[field] = None
+
+        for field in MONEY_FIELDS + ('distance',):
+            value = get(field)
+            try:
+                values[field] = Decimal(str(value).replace(',', '.')) if not _blank(value) else None
+            except InvalidOperation:
+                errors.append(f"{field} invalide: '{value}'")
+                values[field] = None
+        if values['distance'] is not None:
+            values['distance'] = float(values['distance'])
+        values['is_commission'] = values['commission'] is not None and values['prix_vente'] is None
+
+        for field, max_length in TEXT_FIELDS.items():
+            value = get(field)
+            value = None if _blank(value) else str(value)
+            if value and max_length and len(value) > max_length:
+                errors.append(f'{field} dépasse {max_length} caractères')
+            values[field] = value
+
+        affectations = []
+        vehicules = self._split(get('vehicules'))
+        chauffeurs = self._split(get('chauffeurs'))
+        if len(vehicules) != len(chauffeurs):
+            errors.append('vehicules et chauffeurs doivent avoir le même nombre d\'éléments')
+        for vehicule, chauffeur in zip(vehicules, chauffeurs):
+            id_vehicule = self.vehicules.get(vehicule.upper())
+            id_chauffeur = self.chauffeurs.get(chauffeur.upper())
+            if id_vehicule is None:
+                errors.append(f"véhicule inconnu: '{vehicule}'")
+            if id_chauffeur is None:
+                errors.append(f"chauffeur inconnu: '{chauffeur}'")
+            affectations.append((id_vehicule, id_chauffeur))
+
+        return values, affectations, errors
+
+    @staticmethod
+    def _split(value):
+        if _blank(value):
+            return []
+        if isinstance(value, list):
+            return [str(v).strip() for v in value if not _blank(v)]
+        return [part.strip() for part in str(value).split(';') if part.strip()]
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.imported = 0
+        self.rows = 0
+        self.errors = []
+
+    def add_error(self, line, messages):
+        self.errors.append({'ligne': line, 'erreurs': messages})
+
+    def to_dict(self):
+        return {
+            'lignes': self.rows,
+            'importes': self.imported,
+            'rejetes': len(self.errors),
+            'erreurs': self.errors
+        }
+
+
+def _insert_chunk(chunk, created_by, report, dry_run):
+    """Insère un lot de lignes valides: codes réservés par jour, puis deux executemany"""
+    existing = set(db.session.execute(
+        select(Trip.nom_voyage).where(Trip.nom_voyage.in_([values['nom_voyage'] for _, values, _ in chunk]))
+    ).scalars())
+    accepted = []
+    for line, values, affectations in chunk:
+        if values['nom_voyage'] in existing:
+            report.add_error(line, [f"nom_voyage déjà utilisé: '{values['nom_voyage']}'"])
+        else:
+            accepted.append((line, values, affectations))
+    if dry_run:
+        report.imported += len(accepted)
+        return
+    if not accepted:
+        return
+
+    try:
+        by_day = defaultdict(list)
+        for item in accepted:
+            by_day[item[1]['date_depart']].append(item)
+        now = datetime.utcnow()
+        for day, items in list(by_day.items()):
+            try:
+                codes = reserve_codes(day, len(items))
+            except ValueError as e:
+                # Plus de codes disponibles ce jour-là: seules ses lignes sont rejetées
+                for line, _, _ in items:
+                    report.add_error(line, [str(e)])
+                del by_day[day]
+                continue
+            for (_, values, _), code in zip(items, codes):
+                values['code_voyage'] = code
+                values['is_recurring'] = False
+                values['date_creation'] = now
+                values['created_by'] = created_by
+        accepted = [item for items in by_day.values() for item in items]
+        if not accepted:
+            db.session.commit()
+            return
+
+        db.session.execute(insert(Trip.__table__), [
+            {column: values.get(column) for column in TRIP_COLUMNS} for _, values, _ in accepted
+        ])
+
+        # executemany ne renvoie pas les clés générées: relecture par code (colonne unique)
+        ids = dict(db.session.execute(
+            select(Trip.code_voyage, Trip.id_trip).where(
+                Trip.code_voyage.in_([values['code_voyage'] for _, values, _ in accepted])
+            )
+        ).all())
+        affectation_rows = [
+            {'id_trip': ids[values['code_voyage']], 'id_vehicule': id_vehicule,
+             'id_chauffeur': id_chauffeur, 'date_affectation': now}
+            for _, values, affectations in accepted
+            for id_vehicule, id_chauffeur in affectations
+        ]
+        if affectation_rows:
+            db.session.execute(insert(TripAffectation.__table__), affectation_rows)
+
+        # Les insertions groupées contournent les événements de session: index de recherche à jour ici
+        reindex_trips(db.session.connection(), ids.values())
+        reports.invalidate_days(db.session.connection(), by_day)
+        receivables.refresh(db.session.connection(), ids.values())
+        # Voyages importés déjà terminés: distance reportée aux compteurs, alertes d'entretien
+        credited = maintenance.credit_trips(db.session.connection(), ids.values())
+        if credited:
+            maintenance.evaluate(credited, db.session.connection())
+        db.session.commit()
+        report.imported += len(accepted)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        message = f'lot rejeté: {e.__class__.__name__}: {str(e.orig if hasattr(e, "orig") else e)[:200]}'
+        for line, _, _ in accepted:
+            report.add_error(line, [message])
+
+
+def import_trips(rows, created_by=None, dry_run=False, chunk_size=CHUNK_SIZE, first_line=2):
+    """
+    Importe des voyages depuis un itérable de dictionnaires (une ligne CSV/JSON chacun),
+    numérotés à partir de `first_line`, ou de couples (ligne, dictionnaire) si `first_line` est None.
+    Les lignes invalides sont rejetées individuellement; les autres sont insérées par lots
+    de `chunk_size`, chaque lot dans sa propre transaction.
+    """
+    validator = RowValidator()
+    report = ImportReport()
+    seen_names = set()
+    chunk = []
+
+    # CSV: numéros fournis par iter_csv; JSON: numéro de l'objet (first_line=1)
+    numbered = rows if first_line is None else enumerate(rows, start=first_line)
+    for line, raw in numbered:
+        report.rows += 1
+        if not isinstance(raw, dict):
+            report.add_error(line, ['objet attendu'])
+            continue
+        values, affectations, errors = validator.validate(raw)
+        if values['nom_voyage'] in seen_names:
+            errors.append(f"nom_voyage en double dans le fichier: '{values['nom_voyage']}'")
+        if errors:
+            report.add_error(line, errors)
+            continue
+        seen_names.add(values['nom_voyage'])
+        chunk.append((line, values, affectations))
+        if len(chunk) >= chunk_size:
+            _insert_chunk(chunk, created_by, report, dry_run)
+            chunk = []
+
+    if chunk:
+        _insert_chunk(chunk, created_by, report, dry_run)
+    report.errors.sort(key=lambda error: error['ligne'])
+    return report
+
+
+def detect_format(filename, explicit=None):
+    if explicit:
+        return explicit.lower()
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return 'json' if extension in ('json', 'jsonl', 'ndjson') else 'csv'
+
+
+def iter_file(stream, fmt):
+    return iter_json(stream) if fmt == 'json' else iter_csv(stream)
+
+
+def import_file(stream, fmt, created_by=None, dry_run=False):
+    return import_trips(iter_file(stream, fmt), created_by=created_by, dry_run=dry_run,
+                        first_line=1 if fmt == 'json' else None)
+
+
+@click.command('import-trips')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']), default=None)
+@click.option('--user-id', type=int, default=None, help='Utilisateur enregistré comme créateur')
+@click.option('--dry-run', is_flag=True, help='Valider sans rien insérer')
+@with_appcontext
+def import_trips_command(path, fmt, user_id, dry_run):
+    """Importe des voyages depuis un fichier CSV ou JSON"""
+    with open(path, 'rb') as stream:
+        report = import_file(stream, detect_format(path, fmt), created_by=user_id, dry_run=dry_run)
+    for error in report.errors:
+        click.echo(f"ligne {error['ligne']}: {'; '.join(error['erreurs'])}", err=True)
+    click.echo(f'{report.imported} voyages importés, {len(report.errors)} lignes rejetées sur {report.rows}.')
+
+
+def init_app(app):
+    app.cli.add_command(import_trips_command)
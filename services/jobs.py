@@ -0,0 +1,49 @@
+from datetime import date
+
+from flask import current_app
+
+from models import db
+from services.scheduler import scheduler
+
+
+def _previous_month(today=None):
+    today = today or date.today()
+    return (today.year - 1, 12) if today.month == 1 else (today.year, today.month - 1)
+
+
+@scheduler.job('cumuls-nuit', '0 2 * * *')
+def rebuild_rollups():
+    """Reconstruit les cumuls journaliers et les créances (répare les écritures hors session), invalide les instantanés"""
+    from services import ledger, receivables, reports
+    connection = db.session.connection()
+    ledger.rebuild(connection)
+    receivables.rebuild(connection)
+    # Les instantanés de rapports ont pu être calculés sur les anciens cumuls
+    reports.invalidate_all(connection)
+    return 'Cumuls journaliers et créances reconstruits, instantanés de rapports invalidés'
+
+
+@scheduler.job('notifications-entretien', '15 2 * * *')
+def maintenance_notifications():
+    """Filet de sécurité: notifications d'entretien manquées (compteurs modifiés hors session)"""
+    from services import maintenance
+    created = maintenance.evaluate()
+    return f'{created} notification(s) créée(s)'
+
+
+@scheduler.job('archives-notifications', '45 2 * * *')
+def archive_notifications():
+    """Archive les notifications lues plus anciennes que NOTIFICATIONS_RETENTION_DAYS"""
+    from services import notifications
+    days = current_app.config['NOTIFICATIONS_RETENTION_DAYS']
+    archived = notifications.archive(days)
+    return f'{archived} notification(s) archivée(s) (plus de {days} jours)'
+
+
+@scheduler.job('rapport-mois-precedent', '30 2 * * *')
+def precompute_previous_month():
+    """Calcule et enregistre l'instantané du mois précédent avant la première consultation"""
+    from services import reports
+    annee, mois = _previous_month()
+    reports.month_report(annee, mois)
+    return f'Rapport {mois:02d}/{annee} prêt'
@@ -0,0 +1,188 @@
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, delete, event, func, insert, inspect, literal, select, update
+
+from models import db, Paiement, Depense, FinanceJournaliere
+
+PAIEMENT = 'paiement'
+DEPENSE = 'depense'
+
+# Pour chaque modèle: nature, colonne de date, colonne de regroupement, colonne de montant
+SOURCES = {
+    Paiement: (PAIEMENT, 'date_paiement', 'mode_paiement', 'montant_paye'),
+    Depense: (DEPENSE, 'date_depense', 'categorie', 'montant'),
+}
+
+
+def _entry(nature, jour, cle, montant):
+    if isinstance(jour, datetime):
+        jour = jour.date()
+    return (jour, nature, cle), Decimal(str(montant or 0))
+
+
+def _current(obj):
+    nature, date_attr, key_attr, amount_attr = SOURCES[type(obj)]
+    return _entry(nature, getattr(obj, date_attr), getattr(obj, key_attr), getattr(obj, amount_attr))
+
+
+def _previous(obj):
+    """Valeurs telles qu'en base avant la modification en cours (historique des attributs)"""
+    nature, date_attr, key_attr, amount_attr = SOURCES[type(obj)]
+    state = inspect(obj)
+    values = []
+    for attr in (date_attr, key_attr, amount_attr):
+        history = state.attrs[attr].history
+        if history.deleted:
+            values.append(history.deleted[0])
+        elif history.unchanged:
+            values.append(history.unchanged[0])
+        else:
+            values.append(getattr(obj, attr))
+    return _entry(nature, *values)
+
+
+def _before_flush(session, flush_context, instances):
+    """Retire les anciennes valeurs des lignes modifiées ou supprimées (avant que l'historique ne soit perdu)"""
+    deltas = []
+    for obj in session.deleted:
+        if type(obj) in SOURCES:
+            key, montant = _previous(obj)
+            deltas.append((key, -montant, -1))
+    for obj in session.dirty:
+        if type(obj) in SOURCES and session.is_modified(obj):
+            old_key, old_montant = _previous(obj)
+            new_key, new_montant = _current(obj)
+            if (old_key, old_montant) != (new_key, new_montant):
+                deltas.append((old_key, -old_montant, -1))
+                deltas.append((new_key, new_montant, 1))
+    session.info['ledger_deltas'] = deltas
+
+
+def _after_flush(session, flush_context):
+    """Ajoute les nouvelles lignes (valeurs par défaut connues après l'INSERT) puis écrit les deltas"""
+    deltas = session.info.pop('ledger_deltas', [])
+    for obj in session.new:
+        if type(obj) in SOURCES:
+            key, montant = _current(obj)
+            deltas.append((key, montant, 1))
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+def apply_deltas(connection, deltas):
+    """Cumule les deltas par (jour, nature, clé) et les applique en deux executemany"""
+    totals = defaultdict(lambda: [Decimal('0'), 0])
+    for key, montant, nombre in deltas:
+        if key[0] is None or key[2] is None:
+            continue
+        totals[key][0] += montant
+        totals[key][1] += nombre
+    rows = [
+        {'b_jour': jour, 'b_nature': nature, 'b_cle': cle, 'b_montant': montant, 'b_nombre': nombre}
+        for (jour, nature, cle), (montant, nombre) in totals.items()
+        if montant or nombre
+    ]
+    if not rows:
+        return
+
+    table = FinanceJournaliere.__table__
+    statement = insert(table).values(
+        jour=bindparam('b_jour'), nature=bindparam('b_nature'), cle=bindparam('b_cle'), montant=0, nombre=0
+    )
+    if connection.dialect.name == 'mysql':
+        statement = statement.prefix_with('IGNORE')
+    elif connection.dialect.name == 'sqlite':
+        statement = statement.prefix_with('OR IGNORE')
+    connection.execute(statement, rows)
+    connection.execute(
+        update(table).where(
+            table.c.jour == bindparam('b_jour'),
+            table.c.nature == bindparam('b_nature'),
+            table.c.cle == bindparam('b_cle')
+        ).values(
+            montant=table.c.montant + bindparam('b_montant'),
+            nombre=table.c.nombre + bindparam('b_nombre')
+        ),
+        rows
+    )
+
+
+def rebuild(connection):
+    """Recalcule entièrement la table de cumuls depuis les paiements et les dépenses"""
+    table = FinanceJournaliere.__table__
+    connection.execute(delete(table))
+    for model, (nature, date_attr, key_attr, amount_attr) in SOURCES.items():
+        jour = func.date(getattr(model, date_attr))
+        cle = getattr(model, key_attr)
+        source = select(
+            jour, literal(nature), cle,
+            func.sum(getattr(model, amount_attr)), func.count()
+        ).where(getattr(model, date_attr).isnot(None)).group_by(jour, cle)
+        connection.execute(insert(table).from_select(['jour', 'nature', 'cle', 'montant', 'nombre'], source))
+
+
+def _filtered(query, nature, debut=None, fin=None):
+    """Période semi-ouverte [debut, fin[ sur le jour"""
+    table = FinanceJournaliere
+    query = query.filter(table.nature == nature)
+    if debut is not None:
+        query = query.filter(table.jour >= debut)
+    if fin is not None:
+        query = query.filter(table.jour < fin)
+    return query
+
+
+def total(nature, debut=None, fin=None):
+    """Somme des montants d'une nature sur la période (toute l'histoire par défaut)"""
+    query = db.session.query(func.coalesce(func.sum(FinanceJournaliere.montant), 0))
+    return _filtered(query, nature, debut, fin).scalar()
+
+
+def par_jour(nature, debut, fin):
+    """{jour: montant} sur la période"""
+    query = db.session.query(FinanceJournaliere.jour, func.sum(FinanceJournaliere.montant))
+    return dict(_filtered(query, nature, debut, fin).group_by(FinanceJournaliere.jour).all())
+
+
+def par_cle(nature, debut=None, fin=None):
+    """[(clé, montant, nombre)] sur la période: mode de paiement ou catégorie de dépense"""
+    query = db.session.query(
+        FinanceJournaliere.cle,
+        func.sum(FinanceJournaliere.montant),
+        func.sum(FinanceJournaliere.nombre)
+    )
+    return _filtered(query, nature, debut, fin).group_by(FinanceJournaliere.cle).order_by(FinanceJournaliere.cle).all()
+
+
+@click.command('rebuild-finances')
+@with_appcontext
+def rebuild_finances_command():
+    """Reconstruit les cumuls journaliers des paiements et dépenses"""
+    from services import reports
+    rebuild(db.session.connection())
+    reports.invalidate_all(db.session.connection())
+    db.session.commit()
+    count = db.session.query(func.count()).select_from(FinanceJournaliere).scalar()
+    click.echo(f'{count} lignes de cumuls journaliers.')
+
+
+def _active_history(target, value, oldvalue, initiator):
+    return value
+
+
+def init_app(app):
+    # Charger l'ancienne valeur lors d'une affectation, même si l'attribut était expiré
+    for model, (_, date_attr, key_attr, amount_attr) in SOURCES.items():
+        for attr in (date_attr, key_attr, amount_attr):
+            attribute = getattr(model, attr)
+            if not event.contains(attribute, 'set', _active_history):
+                event.listen(attribute, 'set', _active_history, active_history=True, retval=True)
+    if not event.contains(db.session, 'before_flush', _before_flush):
+        event.listen(db.session, 'before_flush', _before_flush)
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+    app.cli.add_command(rebuild_finances_command)
@@ -0,0 +1,236 @@
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import bindparam, delete, event, func, insert, inspect, select, union_all, update
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.util import identity_key
+
+from models import (
+    db, CompteurCredit, EntretienVehicule, Notification, NotificationArchive, Trip, TripAffectation, Vehicule
+)
+from services import notifications
+
+# (sévérité, km restants au plus, message): la première tranche atteinte l'emporte
+THRESHOLDS = (
+    ('red', 500, "URGENT: Entretien nécessaire pour {matricule} dans moins de 500 km"),
+    ('yellow', 1000, "Entretien à prévoir pour {matricule} dans moins de 1000 km"),
+)
+
+
+def latest_maintenance(vehicule_ids=None):
+    """
+    Dernier entretien de chaque véhicule (le plus récent, puis le dernier saisi à date égale),
+    en une requête avec ROW_NUMBER() par véhicule.
+    """
+    rang = func.row_number().over(
+        partition_by=EntretienVehicule.id_vehicule,
+        order_by=(EntretienVehicule.date_entretien.desc(), EntretienVehicule.id_entretien.desc())
+    ).label('rang')
+    ranked = select(
+        EntretienVehicule.id_vehicule, EntretienVehicule.id_entretien, EntretienVehicule.kilometrage_suivant, rang
+    )
+    if vehicule_ids is not None:
+        ranked = ranked.where(EntretienVehicule.id_vehicule.in_(list(vehicule_ids)))
+    return ranked.subquery('ranked')
+
+
+def due_vehicles(vehicule_ids=None, connection=None):
+    """Véhicules dont le prochain entretien est à moins du plus grand seuil: (véhicule, entretien, km restants)"""
+    ranked = latest_maintenance(vehicule_ids)
+    restant = (ranked.c.kilometrage_suivant - Vehicule.kilometrage_vehicule).label('restant')
+    return (connection or db.session).execute(
+        select(Vehicule.id_vehicule, Vehicule.matricule, ranked.c.id_entretien, restant)
+        .join(ranked, ranked.c.id_vehicule == Vehicule.id_vehicule)
+        .where(ranked.c.rang == 1, restant <= max(limit for _, limit, _ in THRESHOLDS))
+    ).all()
+
+
+def severity_for(restant):
+    for severity, limit, message in THRESHOLDS:
+        if restant <= limit:
+            return severity, message
+    return None, None
+
+
+def evaluate(vehicule_ids=None, connection=None):
+    """
+    Crée les notifications d'entretien manquantes: une requête pour les véhicules concernés,
+    une pour les notifications déjà émises, puis une insertion groupée des seules nouvelles.
+    Contrairement à l'ancienne vérification (notifications non lues seulement), une alerte
+    acquittée ou archivée n'est pas réémise: seuls un nouvel entretien ou le passage à une
+    autre sévérité en créent une nouvelle.
+    Retourne le nombre de notifications créées (à valider par l'appelant).
+    """
+    executor = connection or db.session
+    candidates = due_vehicles(vehicule_ids, connection)
+    if not candidates:
+        return 0
+
+    # Une notification déjà émise, même acquittée ou archivée, n'est pas recréée
+    # pour le même entretien et la même sévérité
+    entretien_ids = [row.id_entretien for row in candidates]
+    existing = set(executor.execute(union_all(
+        select(Notification.id_entretien, Notification.severity).where(
+            Notification.id_entretien.in_(entretien_ids)
+        ),
+        select(NotificationArchive.id_entretien, NotificationArchive.severity).where(
+            NotificationArchive.id_vehicule.in_([row.id_vehicule for row in candidates]),
+            NotificationArchive.id_entretien.in_(entretien_ids)
+        )
+    )).all())
+
+    now = datetime.utcnow()
+    rows = []
+    for row in candidates:
+        severity, message = severity_for(row.restant)
+        if (row.id_entretien, severity) not in existing:
+            rows.append({
+                'id_vehicule': row.id_vehicule,
+                'id_entretien': row.id_entretien,
+                'message': message.format(matricule=row.matricule),
+                'severity': severity,
+                'created_at': now,
+                'read': False,
+            })
+    if rows:
+        executor.execute(insert(Notification.__table__), rows)
+        notifications.announce()
+    return len(rows)
+
+
+# Alertes déclenchées par les changements de compteur ------------------------------------------
+# Un changement de compteur (saisie, voyage terminé) ou d'entretien marque le véhicule dans la
+# session; après le flush, seuls ces véhicules sont réévalués, dans la même transaction.
+
+PENDING = 'entretien_vehicules'
+CREDIT_TRIPS = 'compteur_voyages'
+
+# Attributs d'un voyage qui changent la distance créditée aux compteurs
+TRIP_ATTRS = ('etat_trip', 'distance')
+
+# Attributs d'un entretien qui peuvent changer le seuil du véhicule
+ENTRETIEN_ATTRS = ('kilometrage_suivant', 'date_entretien', 'id_vehicule')
+
+
+def _remember(target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(PENDING, set()).add(target)
+
+
+def _attribute_changed(target, value, oldvalue, initiator):
+    # Objet en cours de construction (pas encore dans une session): pris en compte à l'insertion
+    _remember(target)
+    return value
+
+
+def _entretien_inserted(mapper, connection, target):
+    _remember(target)
+
+
+def credit_trips(connection, trip_ids):
+    """
+    Aligne les compteurs sur l'état des voyages donnés: la distance d'un voyage terminé est
+    ajoutée une seule fois à chacun de ses véhicules (compteur_credits garde ce qui a été crédité).
+    Un voyage encore terminé dont la distance ou les véhicules changent corrige son crédit.
+    Un voyage supprimé ou qui quitte 'Terminé' perd son crédit sans toucher au compteur: un
+    compteur ne recule pas, et un relevé saisi depuis inclut déjà le trajet.
+    Retourne les véhicules dont le compteur a changé.
+    """
+    trip_ids = sorted(set(trip_ids))
+    if not trip_ids:
+        return set()
+    couples = select(TripAffectation.id_trip, TripAffectation.id_vehicule).distinct().where(
+        TripAffectation.id_trip.in_(trip_ids)
+    ).subquery('couples')
+    wanted = {
+        (row.id_trip, row.id_vehicule): row.distance
+        for row in connection.execute(
+            select(couples.c.id_trip, couples.c.id_vehicule, Trip.distance)
+            .join(Trip, Trip.id_trip == couples.c.id_trip)
+            .where(Trip.etat_trip == 'Terminé', Trip.distance.isnot(None), Trip.distance != 0)
+        )
+    }
+    credited = {
+        (row.id_trip, row.id_vehicule): row.km
+        for row in connection.execute(
+            select(CompteurCredit.id_trip, CompteurCredit.id_vehicule, CompteurCredit.km)
+            .where(CompteurCredit.id_trip.in_(trip_ids))
+        )
+    }
+    if wanted == credited:
+        return set()
+
+    termines = set(connection.execute(
+        select(Trip.id_trip).where(Trip.id_trip.in_(trip_ids), Trip.etat_trip == 'Terminé')
+    ).scalars())
+    deltas = defaultdict(float)
+    for key in wanted.keys() | credited.keys():
+        if key[0] in termines:
+            deltas[key[1]] += wanted.get(key, 0) - credited.get(key, 0)
+    deltas = {vehicule_id: delta for vehicule_id, delta in deltas.items() if delta}
+
+    connection.execute(delete(CompteurCredit).where(CompteurCredit.id_trip.in_(trip_ids)))
+    if wanted:
+        connection.execute(insert(CompteurCredit), [
+            {'id_trip': id_trip, 'id_vehicule': id_vehicule, 'km': km}
+            for (id_trip, id_vehicule), km in wanted.items()
+        ])
+    if deltas:
+        connection.execute(
+            update(Vehicule.__table__)
+            .where(Vehicule.__table__.c.id_vehicule == bindparam('b_id'))
+            .values(kilometrage_vehicule=Vehicule.__table__.c.kilometrage_vehicule + bindparam('b_delta')),
+            [{'b_id': vehicule_id, 'b_delta': delta} for vehicule_id, delta in deltas.items()]
+        )
+    return set(deltas)
+
+
+def _before_flush(session, flush_context, instances):
+    """Voyages dont le crédit aux compteurs peut changer, relevés avant que l'historique ne soit perdu"""
+    trips = set()
+    for obj in session.deleted:
+        if isinstance(obj, (Trip, TripAffectation)):
+            trips.add(obj.id_trip)
+    for obj in session.dirty:
+        if isinstance(obj, TripAffectation) and session.is_modified(obj):
+            trips.add(obj.id_trip)
+        elif isinstance(obj, Trip) and any(inspect(obj).attrs[attr].history.has_changes() for attr in TRIP_ATTRS):
+            trips.add(obj.id_trip)
+    session.info[CREDIT_TRIPS] = trips
+
+
+def _after_flush(session, flush_context):
+    """Reporte les voyages terminés aux compteurs, puis réévalue les seuls véhicules touchés"""
+    trips = session.info.pop(CREDIT_TRIPS, set())
+    for obj in session.new:
+        if isinstance(obj, (Trip, TripAffectation)):
+            trips.add(obj.id_trip)
+    trips.discard(None)
+    touched = session.info.pop(PENDING, None) or ()
+    vehicule_ids = {obj.id_vehicule for obj in touched if obj.id_vehicule is not None}
+
+    connection = session.connection()
+    if trips:
+        credited = credit_trips(connection, trips)
+        # Compteur modifié en SQL: les véhicules chargés dans la session le relisent
+        for vehicule_id in credited:
+            vehicule = session.identity_map.get(identity_key(Vehicule, vehicule_id))
+            if vehicule is not None:
+                session.expire(vehicule, ['kilometrage_vehicule'])
+        vehicule_ids |= credited
+    if vehicule_ids:
+        evaluate(vehicule_ids, connection)
+
+
+def init_app(app):
+    listeners = [(Vehicule.kilometrage_vehicule, _attribute_changed)]
+    listeners += [(getattr(EntretienVehicule, attr), _attribute_changed) for attr in ENTRETIEN_ATTRS]
+    for attribute, listener in listeners:
+        if not event.contains(attribute, 'set', listener):
+            event.listen(attribute, 'set', listener, retval=True)
+    if not event.contains(EntretienVehicule, 'after_insert', _entretien_inserted):
+        event.listen(EntretienVehicule, 'after_insert', _entretien_inserted)
+    for name, listener in (('before_flush', _before_flush), ('after_flush', _after_flush)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
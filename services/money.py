@@ -0,0 +1,120 @@
+import random
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+import click
+import numpy as np
+from flask.cli import with_appcontext
+
+# Les montants circulent en centimes entiers (int / int64): sommes exactes, sans erreur d'arrondi.
+# Conversion en Decimal ou en nombre JSON uniquement à la sortie.
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal(100)
+
+
+def to_cents(value):
+    """Montant (Decimal, float, int, str ou None) en centimes entiers, arrondi au centime le plus proche"""
+    if value is None or value == '':
+        return 0
+    if not isinstance(value, Decimal):
+        # str() évite de hériter de la représentation binaire d'un float (0.1 -> 0.1000000000000000055...)
+        value = Decimal(str(value).replace(',', '.'))
+    return int(value.quantize(CENT, rounding=ROUND_HALF_UP).scaleb(2))
+
+
+def from_cents(cents):
+    """Centimes entiers en Decimal à deux décimales (écriture en base, calculs Python)"""
+    return Decimal(int(cents)).scaleb(-2).quantize(CENT)
+
+
+def as_number(cents):
+    """
+    Nombre JSON d'un montant en centimes. cents / 100 est le double le plus proche de la valeur décimale:
+    sa représentation la plus courte (celle de json.dumps) est exactement le montant à deux décimales.
+    """
+    return int(cents) / 100
+
+
+def number(value):
+    """Nombre JSON d'un montant lu en base (Decimal ou None)"""
+    return as_number(to_cents(value))
+
+
+def cents_array(values):
+    """Montants lus en base (Decimal, int, float ou None) en tableau int64 de centimes, sans passer par un double"""
+    if not isinstance(values, (list, tuple)):
+        values = list(values)
+    return np.fromiter(map(_cents, values), dtype=np.int64, count=len(values))
+
+
+def _cents(value):
+    # Chemin rapide des Decimal à deux décimales au plus (colonnes Numeric(10, 2)): produit exact
+    try:
+        scaled = value * HUNDRED
+    except TypeError:
+        # None, float, str
+        return to_cents(value)
+    whole = int(scaled)
+    return whole if whole == scaled else to_cents(value)
+
+
+def sum_cents(values):
+    """Somme exacte, en centimes, de montants lus en base"""
+    return int(cents_array(values).sum())
+
+
+def format_cents(cents, devise=None):
+    """Affichage français d'un montant en centimes: 1 234,50"""
+    cents = int(cents)
+    sign = '-' if cents < 0 else ''
+    units, rest = divmod(abs(cents), 100)
+    text = f"{sign}{units:,}".replace(',', ' ') + f",{rest:02d}"
+    return f"{text} {devise}" if devise else text
+
+
+def montant_filter(value, devise=None):
+    """Filtre Jinja `montant`: montant lu en base (Decimal, float) ou nombre JSON"""
+    if value is None:
+        return ''
+    return format_cents(to_cents(value), devise)
+
+
+def centimes_filter(value, devise=None):
+    """Filtre Jinja `centimes`: montant déjà en centimes entiers"""
+    if value is None:
+        return ''
+    return format_cents(value, devise)
+
+
+@click.command('bench-money')
+@click.option('--count', default=1_000_000, show_default=True, help='Nombre de montants à additionner')
+@click.option('--seed', default=1, show_default=True)
+@with_appcontext
+def bench_money_command(count, seed):
+    """Compare la somme de montants en float et en centimes entiers (durée et écart au total exact)"""
+    generator = random.Random(seed)
+    # Montants tels que renvoyés par le pilote MySQL pour une colonne Numeric(10, 2)
+    decimals = [Decimal(generator.randint(0, 10 ** 7)).scaleb(-2) for _ in range(count)]
+    exact = sum(decimals, Decimal(0))
+
+    def measure(label, compute):
+        started = time.perf_counter()
+        total = compute()
+        elapsed = (time.perf_counter() - started) * 1000
+        click.echo(f"{label:<32} {elapsed:9.1f} ms  total={total}  écart={Decimal(str(total)) - exact}")
+
+    # Chemin réel des rapports: conversion des Decimal lus en base, puis somme
+    measure('float (sum(float(x)))', lambda: sum(float(value) for value in decimals))
+    measure('centimes (cents_array + sum)', lambda: from_cents(sum_cents(decimals)))
+    # Somme seule, une fois les colonnes converties (cube en mémoire)
+    floats = np.array([float(value) for value in decimals])
+    cents = cents_array(decimals)
+    measure('float déjà converti (numpy)', lambda: float(np.sum(floats)))
+    measure('centimes déjà convertis (numpy)', lambda: from_cents(int(cents.sum())))
+
+
+def init_app(app):
+    app.add_template_filter(montant_filter, 'montant')
+    app.add_template_filter(centimes_filter, 'centimes')
+    app.cli.add_command(bench_money_command)
@@ -0,0 +1,263 @@
+import json
+import threading
+import time as clock
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, insert, literal, select, update
+
+from models import db, Notification, NotificationArchive
+from services.pagination import keyset_paginate
+
+# Notifications récentes gardées en mémoire pour les clients qui se reconnectent avec leur curseur
+BUFFER_SIZE = 500
+
+# Nombre maximal de notifications lues en base par rattrapage (?since_id= ou curseur trop ancien)
+DELTA_LIMIT = 200
+
+# Délai de reconnexion conseillé au navigateur (millisecondes)
+RETRY_MS = 3000
+
+# Durée de validité des compteurs de non lues (invalidés aussitôt par ce worker)
+UNREAD_CACHE_SECONDS = 30
+
+# Champs copiés dans l'archive
+ARCHIVED_COLUMNS = ('id', 'id_vehicule', 'id_entretien', 'message', 'severity', 'created_at')
+
+CHANGED_FLAG = 'notifications_modifiees'
+
+
+def as_json(notification):
+    return {
+        'id': notification.id,
+        'id_vehicule': notification.id_vehicule,
+        'message': notification.message,
+        'severity': notification.severity,
+        'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M') if notification.created_at else None,
+        'read': bool(notification.read),
+    }
+
+
+def since(cursor, connection=None, limit=DELTA_LIMIT):
+    """Notifications non lues d'identifiant > cursor, par identifiant: simple parcours de clé primaire"""
+    return (connection or db.session).execute(
+        select(Notification.id, Notification.id_vehicule, Notification.message,
+               Notification.severity, Notification.created_at, Notification.read)
+        .where(Notification.id > cursor, Notification.read.is_(False))
+        .order_by(Notification.id)
+        .limit(limit)
+    ).all()
+
+
+def latest_id(connection=None):
+    return (connection or db.session).execute(select(func.max(Notification.id))).scalar() or 0
+
+
+def announce():
+    """Signale des notifications créées dans la transaction en cours (diffusées après le commit)"""
+    db.session.info[CHANGED_FLAG] = True
+
+
+def _event(payload):
+    return f"id: {payload['id']}\nevent: notification\ndata: {json.dumps(payload)}\n\n"
+
+
+class Broker:
+    """
+    Diffusion en mémoire des nouvelles notifications aux flux SSE du worker (équivalent local
+    d'un pub/sub Redis). Une seule lecture en base par changement ou par intervalle, quel que soit
+    le nombre d'onglets ouverts; chaque abonné suit un curseur sur Notification.id.
+    Les notifications créées par un autre worker sont vues au plus tard au battement suivant.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.poll_lock = threading.Lock()
+        self.buffer = deque(maxlen=BUFFER_SIZE)
+        self.last_id = None
+        # Tous les identifiants non lus > floor sont dans le tampon
+        self.floor = None
+        self.last_poll = 0.0
+        self.subscribers = 0
+
+    def poll(self, engine):
+        """Lit les notifications créées depuis le dernier passage; sans effet si un autre fil lit déjà"""
+        if not self.poll_lock.acquire(blocking=False):
+            return
+        try:
+            with engine.connect() as connection:
+                if self.last_id is None:
+                    start = latest_id(connection)
+                    with self.condition:
+                        self.last_id = self.floor = start
+                        self.condition.notify_all()
+                    rows = []
+                else:
+                    rows = since(self.last_id, connection, limit=BUFFER_SIZE)
+            self.last_poll = clock.monotonic()
+            if rows:
+                with self.condition:
+                    for row in rows:
+                        if len(self.buffer) == self.buffer.maxlen:
+                            self.floor = self.buffer[0][0]
+                        self.buffer.append((row.id, as_json(row)))
+                    self.last_id = rows[-1].id
+                    self.condition.notify_all()
+        finally:
+            self.poll_lock.release()
+
+    def pending(self, engine, cursor):
+        """(notifications d'identifiant > cursor, nouveau curseur): depuis le tampon, sinon en base"""
+        with self.condition:
+            known = self.last_id
+            if self.floor is not None and cursor >= self.floor:
+                return [payload for id, payload in self.buffer if id > cursor], max(cursor, known)
+        with engine.connect() as connection:
+            rows = since(cursor, connection)
+        if len(rows) == DELTA_LIMIT:
+            return [as_json(row) for row in rows], rows[-1].id
+        return [as_json(row) for row in rows], max([cursor, known or 0] + [row.id for row in rows])
+
+    def subscribe(self, limit):
+        with self.condition:
+            if self.subscribers >= limit:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def stream(self, engine, cursor, heartbeat, lifetime):
+        """
+        Générateur du flux SSE d'un abonné (déjà compté par subscribe): rattrapage depuis le curseur
+        (Last-Event-ID), puis nouvelles notifications et battements de cœur jusqu'à `lifetime` secondes.
+        """
+        try:
+            yield f'retry: {RETRY_MS}\n\n'
+            if self.last_id is None:
+                self.poll(engine)
+                with self.condition:
+                    # Premier passage lancé par un autre abonné
+                    self.condition.wait_for(lambda: self.last_id is not None, timeout=heartbeat)
+                    if self.last_id is None:
+                        return
+            if cursor is None:
+                cursor = self.last_id
+            deadline = clock.monotonic() + lifetime
+            while True:
+                items, cursor = self.pending(engine, cursor)
+                for payload in items:
+                    yield _event(payload)
+                if clock.monotonic() >= deadline:
+                    return
+                with self.condition:
+                    self.condition.wait_for(lambda: self.last_id > cursor, timeout=heartbeat)
+                if clock.monotonic() - self.last_poll >= heartbeat:
+                    # Notifications d'autres workers ou écrites hors session
+                    self.poll(engine)
+                if self.last_id <= cursor:
+                    yield ': ping\n\n'
+        finally:
+            self.unsubscribe()
+
+
+broker = Broker()
+
+
+# Boîte de réception ----------------------------------------------------------------------------
+
+_unread_cache = {'counts': None, 'at': 0.0, 'last_id': None}
+
+
+def invalidate_counts():
+    _unread_cache['counts'] = None
+
+
+def unread_counts():
+    """
+    Non lues par sévérité pour le badge: {'total': n, 'par_severite': {...}}. Mis en cache
+    UNREAD_CACHE_SECONDS, et recalculé dès que ce worker voit une nouvelle notification ou un acquittement.
+    """
+    cached = _unread_cache['counts']
+    if (cached is not None and _unread_cache['last_id'] == broker.last_id
+            and clock.monotonic() - _unread_cache['at'] < UNREAD_CACHE_SECONDS):
+        return cached
+    par_severite = dict(db.session.execute(
+        select(Notification.severity, func.count()).where(Notification.read.is_(False)).group_by(Notification.severity)
+    ).all())
+    counts = {'total': sum(par_severite.values()), 'par_severite': par_severite}
+    _unread_cache.update(counts=counts, at=clock.monotonic(), last_id=broker.last_id)
+    return counts
+
+
+def history(etat='toutes', severite=None, cursor=None, per_page=20):
+    """Historique des notifications, les plus récentes d'abord, paginé par curseur sur l'identifiant"""
+    query = Notification.query
+    if etat == 'non_lues':
+        query = query.filter(Notification.read.is_(False))
+    elif etat == 'lues':
+        query = query.filter(Notification.read.is_(True))
+    elif etat != 'toutes':
+        raise ValueError(f'État inconnu : {etat}')
+    if severite:
+        query = query.filter(Notification.severity == severite)
+    return keyset_paginate(query, [Notification.id], cursor=cursor, per_page=per_page, descending=True)
+
+
+def acknowledge(ids=None, up_to=None):
+    """
+    Marque comme lues les notifications `ids`, ou toutes celles d'identifiant <= `up_to`,
+    en un seul UPDATE. Une alerte acquittée n'est plus réémise pour le même entretien et la
+    même sévérité (voir maintenance.evaluate). Retourne le nombre de notifications acquittées
+    (à valider par l'appelant).
+    """
+    if ids is None and up_to is None:
+        raise ValueError('Indiquez des identifiants ou un identifiant maximal')
+    condition = Notification.id.in_(list(ids)) if ids is not None else Notification.id <= up_to
+    result = db.session.execute(
+        update(Notification).where(Notification.read.is_(False), condition).values(read=True)
+        .execution_options(synchronize_session=False)
+    )
+    # Compteurs recalculés après le commit, pas avant (un autre fil relirait l'ancien état)
+    db.session.info[CHANGED_FLAG] = True
+    return result.rowcount
+
+
+def archive(days, now=None):
+    """
+    Déplace dans notifications_archive les notifications lues créées il y a plus de `days` jours
+    (copie puis suppression sur la même borne d'identifiant). Retourne le nombre archivé.
+    """
+    now = now or datetime.utcnow()
+    expired = (Notification.read.is_(True), Notification.created_at < now - timedelta(days=days))
+    last = db.session.execute(select(func.max(Notification.id)).where(*expired)).scalar()
+    if last is None:
+        return 0
+    columns = [getattr(Notification, name) for name in ARCHIVED_COLUMNS]
+    db.session.execute(insert(NotificationArchive).from_select(
+        list(ARCHIVED_COLUMNS) + ['archived_at'],
+        select(*columns, literal(now, NotificationArchive.archived_at.type)).where(*expired, Notification.id <= last)
+    ))
+    result = db.session.execute(
+        delete(Notification).where(*expired, Notification.id <= last).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def _after_commit(session):
+    if session.info.pop(CHANGED_FLAG, False):
+        invalidate_counts()
+        if broker.subscribers:
+            broker.poll(db.engine)
+
+
+def _after_rollback(session):
+    session.info.pop(CHANGED_FLAG, None)
+
+
+def init_app(app):
+    for name, listener in (('after_commit', _after_commit), ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
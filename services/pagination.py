@@ -0,0 +1,211 @@
+import base64
+import json
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import and_, false, func, or_, text
+
+from models import db
+
+# Durée de validité (en secondes) des totaux approximatifs mis en cache
+APPROX_COUNT_TTL = 60
+
+# Nombre maximal de totaux gardés en cache (une entrée par combinaison de filtres)
+APPROX_COUNT_SIZE = 256
+
+_count_cache = OrderedDict()
+
+
+def encode_cursor(values, direction='next'):
+    """Encode une position (valeurs de la clé de tri) en curseur opaque"""
+    payload = [direction] + [
+        v.isoformat() if isinstance(v, (date, datetime)) else str(v) if isinstance(v, Decimal) else v
+        for v in values
+    ]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Décode un curseur opaque; retourne (direction, valeurs) ou (None, None) si invalide"""
+    if not cursor:
+        return None, None
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(cursor + padding).decode('utf-8'))
+        direction, raw_values = payload[0], payload[1:]
+        if direction not in ('next', 'prev') or len(raw_values) != len(columns):
+            return None, None
+        values = []
+        for column, value in zip(columns, raw_values):
+            python_type = column.type.python_type
+            if python_type is date and value is not None:
+                value = date.fromisoformat(value)
+            elif python_type is datetime and value is not None:
+                value = datetime.fromisoformat(value)
+            elif python_type is Decimal and value is not None:
+                value = Decimal(value)
+            values.append(value)
+        return direction, values
+    except (ValueError, TypeError, IndexError, NotImplementedError, InvalidOperation):
+        return None, None
+
+
+def _seek_condition(columns, values, descending):
+    """Construit (c1 < v1) OR (c1 = v1 AND c2 < v2) ... sans expression de ligne"""
+    clauses = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        equals = [_equals(columns[j], values[j]) for j in range(i)]
+        clauses.append(and_(*equals, _beyond(column, value, descending)))
+    return or_(*clauses)
+
+
+# Colonnes pouvant être NULL: MySQL et SQLite placent NULL avant toute valeur en ordre croissant
+# (après en ordre décroissant); les comparaisons suivent cet ordre pour ne perdre ni répéter de ligne.
+
+def _equals(column, value):
+    return column.is_(None) if value is None else column == value
+
+
+def _beyond(column, value, descending):
+    nullable = getattr(column, 'nullable', False)
+    if value is None:
+        return false() if descending else column.isnot(None)
+    if descending:
+        return or_(column < value, column.is_(None)) if nullable else column < value
+    return column > value
+
+
+def approximate_count(query, table_name=None, unfiltered=False):
+    """
+    Retourne un total approximatif sans exécuter un COUNT à chaque page:
+    - statistiques InnoDB quand la liste n'est pas filtrée (MySQL)
+    - sinon un COUNT exact mis en cache APPROX_COUNT_TTL secondes par requête
+    """
+    if unfiltered and table_name and db.engine.dialect.name == 'mysql':
+        estimate = db.session.execute(text(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name"
+        ), {'name': table_name}).scalar()
+        if estimate is not None:
+            return int(estimate)
+
+    statement = query.order_by(None).statement
+    compiled = statement.compile(db.engine)
+    key = (str(compiled), repr(sorted(compiled.params.items())))
+    cached = _count_cache.get(key)
+    now = time.monotonic()
+    if cached and now - cached[1] < APPROX_COUNT_TTL:
+        return cached[0]
+
+    total = query.order_by(None).with_entities(func.count()).scalar()
+    _count_cache[key] = (total, now)
+    _count_cache.move_to_end(key)
+    # Les recherches libres créent une entrée chacune: on évince les plus anciennes
+    while len(_count_cache) > APPROX_COUNT_SIZE:
+        _count_cache.popitem(last=False)
+    return total
+
+
+class OffsetPage:
+    """Page obtenue par OFFSET sans COUNT: mêmes attributs qu'une Pagination, sans total ni nombre de pages"""
+
+    def __init__(self, items, page, per_page, has_next):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+        self.total = None
+        self.pages = None
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def offset_paginate(query, page=1, per_page=10, count=True):
+    """
+    Pagination par OFFSET. Sans total (count=False), une ligne de plus que la page est lue
+    pour savoir s'il existe une page suivante, au lieu d'un COUNT.
+    """
+    if count:
+        return query.paginate(page=page, per_page=per_page)
+    page = max(page, 1)
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return OffsetPage(rows[:per_page], page, per_page, has_next=len(rows) > per_page)
+
+
+class KeysetPage:
+    """Page obtenue par pagination par clé (seek), itérable comme une Pagination"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=10, descending=True):
+    """
+    Pagine `query` sur la clé composite `columns` (la dernière colonne doit être unique).
+    Le coût d'une page est indépendant de sa profondeur: pas d'OFFSET ni de COUNT.
+    """
+    direction, values = decode_cursor(cursor, columns)
+
+    # En remontant (page précédente) on parcourt l'index dans l'autre sens puis on inverse
+    backwards = direction == 'prev'
+    scan_descending = descending != backwards
+
+    if values is not None:
+        query = query.filter(_seek_condition(columns, values, scan_descending))
+
+    ordering = [c.desc() if scan_descending else c.asc() for c in columns]
+    rows = query.order_by(None).order_by(*ordering).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def key_of(item):
+        return [getattr(item, c.key) for c in columns]
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor(key_of(rows[-1]), 'next')
+        if values is not None and (has_more or not backwards):
+            prev_cursor = encode_cursor(key_of(rows[0]), 'prev')
+
+    return KeysetPage(rows, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
@@ -0,0 +1,133 @@
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import DateTime, and_
+
+# Période semi-ouverte [debut, fin[ en dates; `granularite` sert au découpage des graphiques
+Period = namedtuple('Period', 'debut fin granularite')
+
+GRANULARITES = ('jour', 'semaine', 'mois', 'trimestre', 'annee', 'personnalise')
+
+ALIASES = {
+    'day': 'jour', 'week': 'semaine', 'month': 'mois', 'quarter': 'trimestre',
+    'year': 'annee', 'année': 'annee', 'custom': 'personnalise',
+}
+
+
+def _add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def day_period(day):
+    return Period(day, day + timedelta(days=1), 'jour')
+
+
+def week_period(day):
+    debut = day - timedelta(days=day.weekday())
+    return Period(debut, debut + timedelta(days=7), 'semaine')
+
+
+def month_period(year, month):
+    debut = date(year, month, 1)
+    return Period(debut, _add_months(debut, 1), 'mois')
+
+
+def quarter_period(year, quarter):
+    debut = date(year, 3 * (quarter - 1) + 1, 1)
+    return Period(debut, _add_months(debut, 3), 'trimestre')
+
+
+def year_period(year):
+    return Period(date(year, 1, 1), date(year + 1, 1, 1), 'annee')
+
+
+def custom_period(debut, fin_incluse):
+    """Plage choisie par l'utilisateur, bornes incluses comme dans les formulaires"""
+    if debut is None or fin_incluse is None:
+        raise ValueError('Indiquez le début et la fin de la période')
+    if fin_incluse < debut:
+        raise ValueError('La fin doit être postérieure au début')
+    return Period(debut, fin_incluse + timedelta(days=1), 'personnalise')
+
+
+def make_period(granularite, reference=None, debut=None, fin=None):
+    """Construit la période `granularite` contenant `reference` (aujourd'hui par défaut)"""
+    granularite = ALIASES.get(granularite, granularite)
+    reference = reference or date.today()
+    if granularite == 'jour':
+        return day_period(reference)
+    if granularite == 'semaine':
+        return week_period(reference)
+    if granularite == 'mois':
+        return month_period(reference.year, reference.month)
+    if granularite == 'trimestre':
+        return quarter_period(reference.year, (reference.month - 1) // 3 + 1)
+    if granularite == 'annee':
+        return year_period(reference.year)
+    if granularite == 'personnalise':
+        return custom_period(debut, fin)
+    raise ValueError(f'Période inconnue : {granularite}')
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def period_from_args(args, default='mois'):
+    """
+    Lit la période d'une requête:
+    - ?periode=jour|semaine|mois|trimestre|annee&date=AAAA-MM-JJ
+    - ?periode=personnalise&debut=AAAA-MM-JJ&fin=AAAA-MM-JJ (fin incluse)
+    - ?annee=&mois= (ancien format des rapports), ?annee= seul pour une année
+    """
+    granularite = ALIASES.get(args.get('periode'), args.get('periode'))
+    # Une plage debut/fin complète l'emporte sur ?annee=&mois= (les filtres les conservent dans l'URL)
+    if granularite == 'personnalise' or (args.get('debut') and args.get('fin') and granularite not in GRANULARITES):
+        return custom_period(_parse_date(args.get('debut')), _parse_date(args.get('fin')))
+    if not granularite:
+        annee = args.get('annee', type=int)
+        mois = args.get('mois', type=int)
+        if annee and mois:
+            return month_period(annee, mois)
+        if annee and 'mois' not in args:
+            return year_period(annee)
+        if mois:
+            return month_period(date.today().year, mois)
+        granularite = default
+    return make_period(granularite, _parse_date(args.get('date')))
+
+
+def _bound(column, day):
+    # Les colonnes DATETIME sont comparées à minuit du jour
+    return datetime.combine(day, time.min) if isinstance(column.type, DateTime) else day
+
+
+def in_period(column, period):
+    """Prédicat indexable `column >= debut AND column < fin` (pas de fonction sur la colonne)"""
+    return and_(column >= _bound(column, period.debut), column < _bound(column, period.fin))
+
+
+def from_day(column, day):
+    """`column` à partir du jour `day` inclus"""
+    return column >= _bound(column, day)
+
+
+def until_day(column, day):
+    """`column` jusqu'au jour `day` inclus"""
+    return column < _bound(column, day + timedelta(days=1))
+
+
+def buckets(period):
+    """Découpage de la période pour un graphique: par jour jusqu'à 3 mois, par mois au-delà"""
+    if (period.fin - period.debut).days <= 92:
+        day = period.debut
+        while day < period.fin:
+            yield Period(day, day + timedelta(days=1), 'jour')
+            day += timedelta(days=1)
+    else:
+        month = date(period.debut.year, period.debut.month, 1)
+        while month < period.fin:
+            following = _add_months(month, 1)
+            yield Period(max(month, period.debut), min(following, period.fin), 'mois')
+            month = following
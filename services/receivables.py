@@ -0,0 +1,250 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, case, delete, event, func, insert, inspect, literal, select, update
+
+from models import db, Creance, CreanceClient, Paiement, Trip
+from services import money
+from services.fleet import trip_amount
+
+# Tranches d'ancienneté (jours depuis le départ du voyage); les voyages à venir comptent dans la première
+AGING_BUCKETS = (('0-30', 30), ('31-60', 60), ('61-90', 90), ('90+', None))
+
+# Attributs d'un voyage qui changent sa créance
+TRIP_ATTRS = ('prix_vente', 'commission', 'is_commission', 'etat_trip', 'etat_paiement', 'client_nom', 'date_depart')
+
+REFRESH_CHUNK = 500
+
+
+def amount_due():
+    """Montant dû d'un voyage: rien pour un voyage annulé ou gratuit"""
+    return case(
+        (Trip.etat_trip == 'Annulé', 0),
+        (Trip.etat_paiement == 'Gratuit', 0),
+        else_=trip_amount()
+    )
+
+
+def _decimal(value):
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def _old_value(obj, attr):
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attr)
+
+
+def _before_flush(session, flush_context, instances):
+    """Voyages dont la créance change, relevés avant que l'historique ne soit perdu"""
+    trips = set()
+    for obj in session.deleted:
+        if isinstance(obj, Paiement):
+            trips.add(_old_value(obj, 'id_trip'))
+        elif isinstance(obj, Trip):
+            trips.add(obj.id_trip)
+    for obj in session.dirty:
+        if not session.is_modified(obj):
+            continue
+        if isinstance(obj, Paiement):
+            # Un paiement rattaché à un autre voyage modifie les deux créances
+            trips.update((_old_value(obj, 'id_trip'), obj.id_trip))
+        elif isinstance(obj, Trip) and any(inspect(obj).attrs[attr].history.has_changes() for attr in TRIP_ATTRS):
+            trips.add(obj.id_trip)
+    session.info['creances_voyages'] = trips
+
+
+def _after_flush(session, flush_context):
+    trips = session.info.pop('creances_voyages', set())
+    for obj in session.new:
+        if isinstance(obj, (Paiement, Trip)):
+            trips.add(obj.id_trip)
+    trips.discard(None)
+    if trips:
+        refresh(session.connection(), trips)
+
+
+def refresh(connection, trip_ids):
+    """
+    Recalcule les créances des voyages donnés (leurs seuls paiements sont relus)
+    et reporte l'écart sur les cumuls des clients, dans la transaction en cours.
+    """
+    trip_ids = sorted(set(trip_ids))
+    for start in range(0, len(trip_ids), REFRESH_CHUNK):
+        _refresh_chunk(connection, trip_ids[start:start + REFRESH_CHUNK])
+
+
+def _refresh_chunk(connection, trip_ids):
+    table = Creance.__table__
+    old = connection.execute(
+        select(table.c.client_nom, table.c.montant_du, table.c.montant_paye, table.c.ouverte)
+        .where(table.c.id_trip.in_(trip_ids))
+    ).all()
+
+    paye = select(func.coalesce(func.sum(Paiement.montant_paye), 0)).where(
+        Paiement.id_trip == Trip.id_trip
+    ).scalar_subquery()
+    current = connection.execute(
+        select(
+            Trip.id_trip, func.coalesce(Trip.client_nom, '').label('client_nom'), Trip.date_depart,
+            amount_due().label('montant_du'), paye.label('montant_paye')
+        ).where(Trip.id_trip.in_(trip_ids))
+    ).all()
+
+    rows = []
+    for row in current:
+        montant_du, montant_paye = _decimal(row.montant_du), _decimal(row.montant_paye)
+        rows.append({
+            'id_trip': row.id_trip, 'client_nom': row.client_nom, 'date_origine': row.date_depart,
+            'montant_du': montant_du, 'montant_paye': montant_paye,
+            'solde': montant_du - montant_paye, 'ouverte': montant_du > montant_paye,
+        })
+
+    # Remplacement des lignes (les voyages supprimés disparaissent)
+    connection.execute(delete(table).where(table.c.id_trip.in_(trip_ids)))
+    if rows:
+        connection.execute(insert(table), rows)
+
+    deltas = defaultdict(lambda: [Decimal('0'), Decimal('0'), 0])
+    for row in old:
+        delta = deltas[row.client_nom]
+        delta[0] -= _decimal(row.montant_du)
+        delta[1] -= _decimal(row.montant_paye)
+        delta[2] -= 1 if row.ouverte else 0
+    for row in rows:
+        delta = deltas[row['client_nom']]
+        delta[0] += row['montant_du']
+        delta[1] += row['montant_paye']
+        delta[2] += 1 if row['ouverte'] else 0
+    apply_client_deltas(connection, deltas)
+
+
+def apply_client_deltas(connection, deltas):
+    """Applique {client: [dû, payé, ouvertes]} aux cumuls clients en deux executemany"""
+    rows = [
+        {'b_client': client, 'b_du': du, 'b_paye': paye, 'b_ouvertes': ouvertes}
+        for client, (du, paye, ouvertes) in deltas.items()
+        if du or paye or ouvertes
+    ]
+    if not rows:
+        return
+
+    table = CreanceClient.__table__
+    statement = insert(table).values(
+        client_nom=bindparam('b_client'), montant_du=0, montant_paye=0, solde=0, nb_ouvertes=0
+    )
+    if connection.dialect.name == 'mysql':
+        statement = statement.prefix_with('IGNORE')
+    elif connection.dialect.name == 'sqlite':
+        statement = statement.prefix_with('OR IGNORE')
+    connection.execute(statement, rows)
+    connection.execute(
+        update(table).where(table.c.client_nom == bindparam('b_client')).values(
+            montant_du=table.c.montant_du + bindparam('b_du'),
+            montant_paye=table.c.montant_paye + bindparam('b_paye'),
+            solde=table.c.solde + bindparam('b_du') - bindparam('b_paye'),
+            nb_ouvertes=table.c.nb_ouvertes + bindparam('b_ouvertes')
+        ),
+        rows
+    )
+
+
+def rebuild(connection):
+    """Recalcule toutes les créances et les cumuls clients depuis les voyages et les paiements"""
+    creances = Creance.__table__
+    clients = CreanceClient.__table__
+    connection.execute(delete(creances))
+    connection.execute(delete(clients))
+
+    payes = select(
+        Paiement.id_trip, func.sum(Paiement.montant_paye).label('montant')
+    ).group_by(Paiement.id_trip).subquery('payes')
+    montant_du = amount_due()
+    montant_paye = func.coalesce(payes.c.montant, 0)
+    connection.execute(insert(creances).from_select(
+        ['id_trip', 'client_nom', 'date_origine', 'montant_du', 'montant_paye', 'solde', 'ouverte'],
+        select(
+            Trip.id_trip, func.coalesce(Trip.client_nom, ''), Trip.date_depart,
+            montant_du, montant_paye, montant_du - montant_paye, montant_du > montant_paye
+        ).outerjoin(payes, payes.c.id_trip == Trip.id_trip)
+    ))
+    connection.execute(insert(clients).from_select(
+        ['client_nom', 'montant_du', 'montant_paye', 'solde', 'nb_ouvertes'],
+        select(
+            creances.c.client_nom,
+            func.sum(creances.c.montant_du), func.sum(creances.c.montant_paye), func.sum(creances.c.solde),
+            func.sum(case((creances.c.ouverte.is_(True), 1), else_=0))
+        ).group_by(creances.c.client_nom)
+    ))
+
+
+# Lecture ------------------------------------------------------------------------------------
+
+def outstanding_query(client_nom=None):
+    """Créances ouvertes (solde > 0), à paginer sur (date_origine, id_trip): les plus anciennes d'abord"""
+    query = Creance.query.filter(Creance.ouverte.is_(True))
+    if client_nom is not None:
+        query = query.filter(Creance.client_nom == client_nom)
+    return query
+
+
+def aging(reference=None, client_nom=None):
+    """
+    Balance âgée: solde (centimes) et nombre de créances ouvertes par tranche d'ancienneté.
+    Une requête groupée sur les seules créances ouvertes (index ouverte, date_origine).
+    """
+    reference = reference or date.today()
+    tranches = []
+    for label, days in AGING_BUCKETS:
+        if days is not None:
+            tranches.append((Creance.date_origine >= reference - timedelta(days=days), label))
+    tranche = case(*tranches, else_=literal(AGING_BUCKETS[-1][0])).label('tranche')
+
+    query = db.session.query(tranche, func.sum(Creance.solde), func.count()).filter(Creance.ouverte.is_(True))
+    if client_nom is not None:
+        query = query.filter(Creance.client_nom == client_nom)
+    totals = {label: (solde, nombre) for label, solde, nombre in query.group_by(tranche)}
+    return [{
+        'tranche': label,
+        'solde': money.to_cents(totals.get(label, (0, 0))[0]),
+        'nombre': totals.get(label, (0, 0))[1],
+    } for label, _ in AGING_BUCKETS]
+
+
+def by_client(limit=None):
+    """Clients ayant un solde ouvert, du plus gros solde au plus petit"""
+    query = CreanceClient.query.filter(CreanceClient.nb_ouvertes > 0).order_by(
+        CreanceClient.solde.desc(), CreanceClient.client_nom
+    )
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+@click.command('rebuild-creances')
+@with_appcontext
+def rebuild_creances_command():
+    """Reconstruit les créances par voyage et par client"""
+    rebuild(db.session.connection())
+    db.session.commit()
+    ouvertes = db.session.query(func.count()).select_from(Creance).filter(Creance.ouverte.is_(True)).scalar()
+    click.echo(f'{ouvertes} créances ouvertes.')
+
+
+def _active_history(target, value, oldvalue, initiator):
+    return value
+
+
+def init_app(app):
+    # Ancien voyage d'un paiement déplacé, même si l'attribut était expiré
+    if not event.contains(Paiement.id_trip, 'set', _active_history):
+        event.listen(Paiement.id_trip, 'set', _active_history, active_history=True, retval=True)
+    if not event.contains(db.session, 'before_flush', _before_flush):
+        event.listen(db.session, 'before_flush', _before_flush)
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+    app.cli.add_command(rebuild_creances_command)
@@ -0,0 +1,182 @@
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import event, or_
+
+from models import db, Trip
+
+# Noms acceptés dans Trip.recurring_days (formulaire en français, imports éventuellement en anglais)
+WEEKDAYS = {
+    'lundi': 0, 'mardi': 1, 'mercredi': 2, 'jeudi': 3, 'vendredi': 4, 'samedi': 5, 'dimanche': 6,
+    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3, 'friday': 4, 'saturday': 5, 'sunday': 6,
+}
+
+# Nombre de voyages récurrents dont on garde les occurrences en mémoire, et de mois par voyage
+CACHE_TRIPS = 512
+CACHE_MONTHS_PER_TRIP = 24
+
+Occurrence = namedtuple('Occurrence', 'id_trip date debut fin')
+
+RULE_COLUMNS = (
+    Trip.id_trip, Trip.is_recurring, Trip.recurring_days, Trip.etat_trip,
+    Trip.date_depart, Trip.date_arrivee, Trip.heure_depart, Trip.heure_arrivee, Trip.nombre_jours,
+)
+
+
+def parse_recurring_days(value):
+    """'Lundi,Jeudi' (ou ['Lundi', 'Jeudi']) -> frozenset({0, 3})"""
+    if not value:
+        return frozenset()
+    if isinstance(value, str):
+        value = value.split(',')
+    days = set()
+    for name in value:
+        weekday = WEEKDAYS.get(str(name).strip().lower())
+        if weekday is not None:
+            days.add(weekday)
+    return frozenset(days)
+
+
+class RecurrenceRule:
+    """
+    Règle d'un voyage récurrent: de date_depart (incluse) à date_arrivee (incluse, ou sans fin),
+    chaque jour de la semaine coché, entre heure_depart et heure_arrivee.
+    """
+
+    def __init__(self, id_trip, weekdays, first_day, last_day, heure_depart, heure_arrivee):
+        self.id_trip = id_trip
+        self.weekdays = weekdays
+        self.first_day = first_day
+        self.last_day = last_day
+        self.heure_depart = heure_depart or time.min
+        self.heure_arrivee = heure_arrivee
+        self.signature = None
+        self.months = OrderedDict()
+        # Intervalle unique d'un voyage marqué récurrent sans jour reconnu (traité comme ponctuel)
+        self.interval = None
+
+    @classmethod
+    def from_row(cls, row):
+        if not row.is_recurring or row.etat_trip == 'Annulé':
+            return None
+        weekdays = parse_recurring_days(row.recurring_days)
+        if not weekdays:
+            # Jours illisibles ou absents: le voyage a lieu une fois, comme un voyage ponctuel
+            from services.availability import trip_interval
+            rule = cls(row.id_trip, weekdays, row.date_depart, row.date_depart, row.heure_depart, row.heure_arrivee)
+            rule.interval = trip_interval(row.date_depart, row.heure_depart, row.date_arrivee,
+                                          row.heure_arrivee, row.nombre_jours)
+        else:
+            last_day = row.date_arrivee if row.date_arrivee and row.date_arrivee > row.date_depart else None
+            rule = cls(row.id_trip, weekdays, row.date_depart, last_day, row.heure_depart, row.heure_arrivee)
+        rule.signature = tuple(row)
+        return rule
+
+    def _occurrence(self, day):
+        start = datetime.combine(day, self.heure_depart)
+        if self.heure_arrivee is not None:
+            end = datetime.combine(day, self.heure_arrivee)
+            if end <= start:
+                end += timedelta(days=1)
+        else:
+            end = datetime.combine(day + timedelta(days=1), time.min)
+        return Occurrence(self.id_trip, day, start, end)
+
+    def _month(self, year, month):
+        """Occurrences d'un mois, calculées une fois puis gardées (LRU de CACHE_MONTHS_PER_TRIP mois)"""
+        key = (year, month)
+        cached = self.months.get(key)
+        if cached is not None:
+            self.months.move_to_end(key)
+            return cached
+
+        day = date(year, month, 1)
+        occurrences = []
+        while day.month == month:
+            if day >= self.first_day and (self.last_day is None or day <= self.last_day):
+                if day.weekday() in self.weekdays:
+                    occurrences.append(self._occurrence(day))
+            day += timedelta(days=1)
+
+        self.months[key] = tuple(occurrences)
+        if len(self.months) > CACHE_MONTHS_PER_TRIP:
+            self.months.popitem(last=False)
+        return self.months[key]
+
+    def occurrences(self, window_start, window_end):
+        """Génère les occurrences qui chevauchent [window_start, window_end[ mois par mois"""
+        if self.interval is not None:
+            debut, fin = self.interval
+            if fin > window_start and debut < window_end:
+                yield Occurrence(self.id_trip, self.first_day, debut, fin)
+            return
+        first = max(window_start.date() - timedelta(days=1), self.first_day)
+        last = window_end.date()
+        if self.last_day is not None:
+            last = min(last, self.last_day)
+        year, month = first.year, first.month
+        while (year, month) <= (last.year, last.month):
+            for occurrence in self._month(year, month):
+                if occurrence.fin > window_start and occurrence.debut < window_end:
+                    yield occurrence
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+_rules = OrderedDict()
+
+
+def _cache_rule(id_trip, rule):
+    _rules[id_trip] = rule
+    _rules.move_to_end(id_trip)
+    if len(_rules) > CACHE_TRIPS:
+        _rules.popitem(last=False)
+
+
+def invalidate(id_trip):
+    _rules.pop(id_trip, None)
+
+
+def recurring_trips_query(first_day, last_day):
+    """Voyages récurrents dont la période de récurrence peut toucher [first_day, last_day]"""
+    return db.session.query(*RULE_COLUMNS).filter(
+        Trip.is_recurring.is_(True),
+        Trip.etat_trip != 'Annulé',
+        Trip.date_depart <= last_day,
+        or_(Trip.date_arrivee.is_(None), Trip.date_arrivee >= first_day, Trip.date_arrivee <= Trip.date_depart)
+    )
+
+
+def get_rules(window_start, window_end, trip_ids=None):
+    """Règles des voyages récurrents actifs sur la fenêtre (cache par voyage, une requête au plus)"""
+    query = recurring_trips_query(window_start.date(), window_end.date())
+    if trip_ids is not None:
+        query = query.filter(Trip.id_trip.in_(list(trip_ids)))
+    rules = []
+    for row in query:
+        rule = _rules.get(row.id_trip)
+        # La signature protège aussi des modifications faites par un autre processus
+        if rule is None or rule.signature != tuple(row):
+            rule = RecurrenceRule.from_row(row)
+            if rule is None:
+                continue
+            _cache_rule(row.id_trip, rule)
+        rules.append(rule)
+    return rules
+
+
+def iter_occurrences(window_start, window_end, trip_ids=None):
+    """Génère (id_trip, date, debut, fin) de tous les voyages récurrents sur la fenêtre"""
+    for rule in get_rules(window_start, window_end, trip_ids):
+        yield from rule.occurrences(window_start, window_end)
+
+
+def _after_flush(session, flush_context):
+    """Toute modification ou suppression d'un voyage invalide sa règle en cache"""
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, Trip):
+            invalidate(obj.id_trip)
+
+
+def init_app(app):
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
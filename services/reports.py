@@ -0,0 +1,286 @@
+import json
+import time as clock
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, event, func, inspect, insert, or_, select, tuple_
+
+from models import db, Depense, Paiement, Trip, RapportSnapshot
+from services import ledger, money, periods, recurrence
+
+# Mois en cours (ou futurs): gardés en mémoire par processus, au plus MEMORY_SIZE mois pendant MEMORY_TTL secondes
+MEMORY_SIZE = 24
+MEMORY_TTL = 300
+
+_memory = OrderedDict()
+
+
+def compute(periode):
+    """
+    Données brutes du rapport d'une période: séries par jour, dépenses par catégorie,
+    voyages par type (occurrences des voyages récurrents comprises). Montants en centimes entiers.
+    """
+    revenus_par_jour = ledger.par_jour(ledger.PAIEMENT, periode.debut, periode.fin)
+    depenses_par_jour = ledger.par_jour(ledger.DEPENSE, periode.debut, periode.fin)
+    jours = list(_days(periode))
+
+    categories = {
+        cle: money.to_cents(montant)
+        for cle, montant, _ in ledger.par_cle(ledger.DEPENSE, periode.debut, periode.fin)
+        if montant
+    }
+
+    types = dict(db.session.query(Trip.type, func.count(Trip.id_trip)).filter(
+        periods.in_period(Trip.date_depart, periode),
+        or_(Trip.is_recurring.is_(False), Trip.is_recurring.is_(None))
+    ).group_by(Trip.type).all())
+
+    # Les voyages récurrents comptent une fois par occurrence de la période
+    debut = datetime.combine(periode.debut, datetime.min.time())
+    fin = datetime.combine(periode.fin, datetime.min.time())
+    occurrences = {}
+    for occurrence in recurrence.iter_occurrences(debut, fin):
+        if periode.debut <= occurrence.date < periode.fin:
+            occurrences[occurrence.id_trip] = occurrences.get(occurrence.id_trip, 0) + 1
+    if occurrences:
+        for id_trip, type in db.session.query(Trip.id_trip, Trip.type).filter(Trip.id_trip.in_(list(occurrences))):
+            types[type] = types.get(type, 0) + occurrences[id_trip]
+
+    return {
+        'jours': [jour.isoformat() for jour in jours],
+        'revenus': [money.to_cents(revenus_par_jour.get(jour)) for jour in jours],
+        'depenses': [money.to_cents(depenses_par_jour.get(jour)) for jour in jours],
+        'categories': categories,
+        'types': types,
+    }
+
+
+def _days(periode):
+    day = periode.debut
+    while day < periode.fin:
+        yield day
+        day += timedelta(days=1)
+
+
+def merge(snapshots):
+    """Assemble des rapports de périodes contiguës (ex. les 12 mois d'une année)"""
+    result = {'jours': [], 'revenus': [], 'depenses': [], 'categories': {}, 'types': {}}
+    for snapshot in snapshots:
+        for key in ('jours', 'revenus', 'depenses'):
+            result[key].extend(snapshot[key])
+        for key in ('categories', 'types'):
+            for name, value in snapshot[key].items():
+                result[key][name] = result[key].get(name, 0) + value
+    return result
+
+
+def _closed(annee, mois):
+    today = date.today()
+    return (annee, mois) < (today.year, today.month)
+
+
+def _persisted(months):
+    """Instantanés enregistrés des mois demandés, en une requête"""
+    if not months:
+        return {}
+    table = RapportSnapshot.__table__
+    rows = db.session.execute(
+        select(table.c.annee, table.c.mois, table.c.donnees).where(tuple_(table.c.annee, table.c.mois).in_(months))
+    )
+    return {(row.annee, row.mois): row.donnees for row in rows}
+
+
+def month_report(annee, mois, persisted=None):
+    """
+    Rapport d'un mois: les mois clos sont lus dans rapport_snapshots (calculés une fois),
+    le mois en cours vient du cache mémoire tant qu'il n'a ni expiré ni été invalidé.
+    """
+    key = (annee, mois)
+    if _closed(annee, mois):
+        if persisted is None:
+            persisted = _persisted([key])
+        if key in persisted:
+            return json.loads(persisted[key])
+        snapshot = compute(periods.month_period(annee, mois))
+        _store(annee, mois, snapshot)
+        return snapshot
+
+    cached = _memory.get(key)
+    if cached is not None and cached[0] > clock.monotonic():
+        _memory.move_to_end(key)
+        return cached[1]
+    snapshot = compute(periods.month_period(annee, mois))
+    _memory[key] = (clock.monotonic() + MEMORY_TTL, snapshot)
+    _memory.move_to_end(key)
+    if len(_memory) > MEMORY_SIZE:
+        _memory.popitem(last=False)
+    return snapshot
+
+
+def _store(annee, mois, snapshot):
+    """
+    Persiste l'instantané d'un mois clos hors de la transaction de la requête, qui n'est jamais
+    validée à sa place. SQLite n'ayant qu'un écrivain, une requête qui a déjà écrit y tient le verrou:
+    l'instantané rejoint alors sa transaction (perdu sans gravité si elle est annulée).
+    """
+    table = RapportSnapshot.__table__
+    statement = insert(table).values(
+        annee=annee, mois=mois, donnees=json.dumps(snapshot), calcule_le=datetime.utcnow()
+    )
+    if db.engine.dialect.name == 'mysql':
+        statement = statement.prefix_with('IGNORE')
+    elif db.engine.dialect.name == 'sqlite':
+        statement = statement.prefix_with('OR IGNORE')
+        if db.session.connection().connection.in_transaction:
+            db.session.execute(statement)
+            return
+    with db.engine.begin() as connection:
+        connection.execute(statement)
+
+
+def _months(periode):
+    month = date(periode.debut.year, periode.debut.month, 1)
+    while month < periode.fin:
+        yield month.year, month.month
+        month = date(month.year + 1, 1, 1) if month.month == 12 else date(month.year, month.month + 1, 1)
+
+
+def report(periode):
+    """Rapport d'une période: assemblé à partir des mois en cache si elle couvre des mois entiers"""
+    aligned = periode.debut.day == 1 and periode.fin.day == 1
+    if aligned:
+        months = list(_months(periode))
+        persisted = _persisted([month for month in months if _closed(*month)])
+        return merge(month_report(annee, mois, persisted) for annee, mois in months)
+    return compute(periode)
+
+
+# Invalidation --------------------------------------------------------------------------------
+
+def _month_of(value):
+    if value is None:
+        return None
+    return (value.year, value.month)
+
+
+def _history_values(obj, attr):
+    """Valeurs ancienne et nouvelle d'un attribut (l'ancienne est chargée grâce à active_history)"""
+    history = inspect(obj).attrs[attr].history
+    # Un attribut expiré (après commit) n'a pas d'historique: None partout
+    values = list(history.deleted or ()) + list(history.added or ()) + list(history.unchanged or ())
+    return values or [getattr(obj, attr)]
+
+
+def _touched(obj):
+    """(mois touchés, mois à partir duquel tout est touché) par l'écriture d'un objet"""
+    if isinstance(obj, Paiement):
+        return {_month_of(v) for v in _history_values(obj, 'date_paiement')}, None
+    if isinstance(obj, Depense):
+        return {_month_of(v) for v in _history_values(obj, 'date_depense')}, None
+    if isinstance(obj, Trip):
+        months = {_month_of(v) for v in _history_values(obj, 'date_depart')}
+        months.discard(None)
+        recurring = any(_history_values(obj, 'is_recurring'))
+        # Un voyage récurrent compte dans tous les mois de sa période de récurrence
+        return months, (min(months) if recurring and months else None)
+    return set(), None
+
+
+def _collect(objects, months, since):
+    for obj in objects:
+        touched, start = _touched(obj)
+        months.update(touched)
+        if start is not None and (since[0] is None or start < since[0]):
+            since[0] = start
+
+
+def _before_flush(session, flush_context, instances):
+    months, since = set(), [None]
+    _collect([obj for obj in session.dirty if session.is_modified(obj)], months, since)
+    _collect(session.deleted, months, since)
+    session.info['rapport_mois'] = (months, since[0])
+
+
+def _after_flush(session, flush_context):
+    months, since = session.info.pop('rapport_mois', (set(), None))
+    since = [since]
+    _collect(session.new, months, since)
+    months.discard(None)
+    if months or since[0] is not None:
+        invalidate(session.connection(), months, since[0])
+
+
+def _defer(months, since):
+    """Mois à invalider de nouveau une fois la transaction de la session validée"""
+    pending = db.session.info.setdefault('rapport_mois_commit', [set(), None])
+    pending[0].update(months)
+    if since is not None and (pending[1] is None or since < pending[1]):
+        pending[1] = since
+
+
+def _after_commit(session):
+    # Une autre requête a pu recalculer un mois entre le flush et le commit, en lisant l'état
+    # précédent: on purge à nouveau, mémoire et base, maintenant que les écritures sont visibles
+    pending = session.info.pop('rapport_mois_commit', None)
+    if pending:
+        _forget(*pending)
+        with db.engine.begin() as connection:
+            _delete(connection, *pending)
+
+
+def _after_rollback(session):
+    session.info.pop('rapport_mois_commit', None)
+
+
+def _forget(months, since=None):
+    for key in list(_memory):
+        if key in months or (since is not None and key >= since):
+            _memory.pop(key, None)
+
+
+def _delete(connection, months, since=None):
+    table = RapportSnapshot.__table__
+    if months:
+        connection.execute(delete(table).where(tuple_(table.c.annee, table.c.mois).in_(sorted(months))))
+    if since is not None:
+        connection.execute(delete(table).where(or_(
+            table.c.annee > since[0],
+            (table.c.annee == since[0]) & (table.c.mois >= since[1])
+        )))
+
+
+def invalidate(connection, months, since=None):
+    """
+    Supprime les instantanés des mois (annee, mois) donnés, et de tous les mois >= `since`,
+    dans la transaction de `connection` puis à nouveau après le commit de la session.
+    """
+    months = {month for month in months if month is not None}
+    _forget(months, since)
+    _delete(connection, months, since)
+    _defer(months, since)
+
+
+def invalidate_days(connection, days):
+    """Pour les écritures groupées qui contournent les événements de session (imports)"""
+    invalidate(connection, {_month_of(day) for day in days})
+
+
+def invalidate_all(connection):
+    _memory.clear()
+    connection.execute(delete(RapportSnapshot.__table__))
+    _defer(set(), (0, 0))
+
+
+def _active_history(target, value, oldvalue, initiator):
+    return value
+
+
+def init_app(app):
+    # Charger l'ancienne date lors d'une modification, pour invalider aussi le mois quitté
+    for attribute in (Trip.date_depart, Trip.is_recurring, Paiement.date_paiement, Depense.date_depense):
+        if not event.contains(attribute, 'set', _active_history):
+            event.listen(attribute, 'set', _active_history, active_history=True, retval=True)
+    for name, listener in (('before_flush', _before_flush), ('after_flush', _after_flush),
+                           ('after_commit', _after_commit), ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
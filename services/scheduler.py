@@ -0,0 +1,289 @@
+import logging
+import os
+import threading
+import time as clock
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+
+from models import db, TachePlanifiee
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+# (minimum, maximum) de chaque champ: minute, heure, jour du mois, mois, jour de la semaine (0 et 7 = dimanche)
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+# Recherche de la prochaine échéance bornée à cinq ans (expression impossible comme le 31 février)
+MAX_LOOKAHEAD = timedelta(days=5 * 366)
+
+
+def _parse_field(text, minimum, maximum):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError(f'Pas invalide : {text}')
+        if part == '*':
+            start, end = minimum, maximum
+        elif '-' in part:
+            start, end = (int(bound) for bound in part.split('-', 1))
+        else:
+            start = end = int(part)
+            if step > 1:
+                end = maximum
+        if not minimum <= start <= end <= maximum:
+            raise ValueError(f'Valeur hors limites : {text}')
+        values.update(range(start, end + 1, step))
+    if maximum == 7:
+        values = {value % 7 for value in values}
+    return frozenset(values)
+
+
+class CronSchedule:
+    """Expression cron à cinq champs (minute heure jour mois jour_semaine), ou @daily, @hourly..."""
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = ALIASES.get(expression, expression).split()
+        if len(fields) != 5:
+            raise ValueError(f'Expression cron invalide : {expression}')
+        parsed = [_parse_field(field, *bounds) for field, bounds in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        # Comme cron: si jour du mois et jour de la semaine sont restreints, l'un OU l'autre suffit
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment):
+        weekday = (moment.weekday() + 1) % 7
+        if self.any_day or self.any_weekday:
+            return moment.day in self.days and weekday in self.weekdays
+        return moment.day in self.days or weekday in self.weekdays
+
+    def next_after(self, moment):
+        """Première échéance strictement postérieure à `moment` (à la minute)"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + MAX_LOOKAHEAD
+        while candidate <= limit:
+            if candidate.month not in self.months:
+                year, month = (candidate.year + 1, 1) if candidate.month == 12 else (candidate.year, candidate.month + 1)
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Aucune échéance pour l'expression : {self.expression}")
+
+
+class Job:
+    def __init__(self, name, schedule, function, description=None):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.function = function
+        self.description = description or (function.__doc__ or '').strip().split('\n')[0]
+
+
+@contextmanager
+def file_lock(path):
+    """Verrou exclusif non bloquant sur un fichier: True si obtenu, False si un autre processus le tient"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle = open(path, 'a+')
+    try:
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        handle.close()
+
+
+class Scheduler:
+    """
+    Planificateur dans le processus web: un fil vérifie toutes les SCHEDULER_TICK secondes
+    les tâches échues (état en base, partagé par tous les workers) et exécute chacune sous
+    un verrou de fichier, pour qu'un seul worker Gunicorn la lance.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.app = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def job(self, name, schedule, description=None):
+        """Décorateur: enregistre une tâche périodique sous `name` (expression cron)"""
+        def register(function):
+            self.jobs[name] = Job(name, schedule, function, description)
+            return function
+        return register
+
+    def _lock_path(self, name):
+        return os.path.join(self.app.config['SCHEDULER_LOCK_DIR'], f'{name}.lock')
+
+    def _states(self, now):
+        """Lignes d'état de toutes les tâches, créées ou replanifiées si l'expression a changé"""
+        states = {state.nom: state for state in TachePlanifiee.query.filter(TachePlanifiee.nom.in_(list(self.jobs)))}
+        changed = False
+        for name, job in self.jobs.items():
+            state = states.get(name)
+            if state is None:
+                state = states[name] = TachePlanifiee(nom=name, actif=True)
+                db.session.add(state)
+            if state.planification != job.schedule.expression:
+                state.planification = job.schedule.expression
+                state.prochaine_execution = job.schedule.next_after(now)
+                changed = True
+        if changed or db.session.new:
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Un autre worker a créé les lignes au même moment: on relit les siennes
+                db.session.rollback()
+                return {state.nom: state for state in TachePlanifiee.query.filter(TachePlanifiee.nom.in_(list(self.jobs)))}
+        return states
+
+    def run_pending(self, now=None):
+        """Exécute les tâches échues; retourne les noms des tâches lancées par ce processus"""
+        now = now or datetime.now()
+        due = [
+            name for name, state in self._states(now).items()
+            if state.actif and state.prochaine_execution is not None and state.prochaine_execution <= now
+        ]
+        return [name for name in due if self.run(name, now)]
+
+    def run(self, name, now=None, force=False):
+        """Lance une tâche sous verrou; False si un autre processus l'exécute ou l'a déjà exécutée"""
+        job = self.jobs[name]
+        with file_lock(self._lock_path(name)) as acquired:
+            if not acquired:
+                return False
+            now = now or datetime.now()
+            # Relecture sous verrou: un autre worker a pu l'exécuter entre-temps
+            db.session.expire_all()
+            state = db.session.get(TachePlanifiee, name)
+            if state is None:
+                self._states(now)
+                state = db.session.get(TachePlanifiee, name)
+            if not force and (state.prochaine_execution is None or state.prochaine_execution > now):
+                return False
+
+            state.dernier_statut = 'en_cours'
+            state.derniere_execution = now
+            db.session.commit()
+            started = clock.perf_counter()
+            try:
+                message = job.function()
+                db.session.commit()
+                status = 'succes'
+            except Exception as e:
+                db.session.rollback()
+                logger.exception('Tâche planifiée %s en erreur', name)
+                message, status = f'{e.__class__.__name__}: {e}', 'erreur'
+
+            state = db.session.get(TachePlanifiee, name)
+            state.dernier_statut = status
+            state.dernier_message = str(message)[:2000] if message is not None else None
+            state.duree_ms = int((clock.perf_counter() - started) * 1000)
+            state.prochaine_execution = job.schedule.next_after(max(now, datetime.now()))
+            db.session.commit()
+            return True
+
+    def _loop(self):
+        tick = self.app.config.get('SCHEDULER_TICK', 30)
+        while not self.stopping.wait(tick):
+            try:
+                with self.app.app_context():
+                    self.run_pending()
+            except Exception:
+                logger.exception('Planificateur: vérification des tâches en erreur')
+
+    def start(self):
+        """Démarre le fil du planificateur (une fois par processus)"""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def init_app(self, app):
+        self.app = app
+        # Enregistrement des tâches de l'application
+        from services import jobs  # noqa: F401
+        app.cli.add_command(list_jobs_command)
+        app.cli.add_command(run_job_command)
+
+        if app.config.get('SCHEDULER_ENABLED') and not app.config.get('TESTING'):
+            # before_first_request est déprécié (retiré de Flask 2.3): le fil démarre avec l'application.
+            # Fil démon dont la première vérification attend SCHEDULER_TICK secondes: une commande CLI
+            # courte (migration, import) se termine avant, et le verrou par tâche évite les doublons
+            self.start()
+
+
+scheduler = Scheduler()
+
+
+@click.command('list-jobs')
+@with_appcontext
+def list_jobs_command():
+    """Liste les tâches planifiées et leur dernier état"""
+    states = scheduler._states(datetime.now())
+    for name, job in sorted(scheduler.jobs.items()):
+        state = states[name]
+        click.echo(
+            f"{name:<28} {job.schedule.expression:<16} prochaine: {state.prochaine_execution:%Y-%m-%d %H:%M}  "
+            f"dernière: {state.derniere_execution or '-'} ({state.dernier_statut or '-'})  {job.description}"
+        )
+
+
+@click.command('run-job')
+@click.argument('name')
+@with_appcontext
+def run_job_command(name):
+    """Exécute immédiatement une tâche planifiée (sous le même verrou que le planificateur)"""
+    if name not in scheduler.jobs:
+        raise click.BadParameter(f"Tâche inconnue : {name} ({', '.join(sorted(scheduler.jobs))})")
+    if scheduler.run(name, force=True):
+        state = db.session.get(TachePlanifiee, name)
+        click.echo(f'{name}: {state.dernier_statut} en {state.duree_ms} ms. {state.dernier_message or ""}')
+    else:
+        click.echo(f'{name}: déjà en cours dans un autre processus.')
+
+
+def init_app(app):
+    scheduler.init_app(app)
@@ -0,0 +1,216 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, distinct, event, func, insert, inspect, select
+
+from models import db, Trip, TripAffectation, TripSearchToken, Vehicule
+
+# Champs indexés et leur poids dans le score de pertinence
+TRIP_FIELDS = {
+    'code_voyage': 5,
+    'nom_voyage': 4,
+    'nom': 4,
+    'client_nom': 3,
+    'point_depart': 2,
+    'point_arrivee': 2,
+}
+VEHICULE_FIELDS = {
+    'matricule': 3,
+    'modele': 1,
+}
+
+REINDEX_CHUNK = 500
+
+_word_re = re.compile(r'[a-z0-9]+')
+
+
+def normalize(value):
+    """Minuscules sans accents: 'Événement' -> 'evenement'"""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def words(value):
+    return _word_re.findall(normalize(value))
+
+
+def trigrams(word):
+    """Trigrammes d'un mot complété par deux espaces de chaque côté (comme pg_trgm)"""
+    padded = f'  {word}  '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def document_tokens(trip_values, vehicule_values):
+    """Calcule {token: poids} pour un voyage et les véhicules qui lui sont affectés"""
+    tokens = defaultdict(int)
+    for field, weight in TRIP_FIELDS.items():
+        for word in words(trip_values.get(field)):
+            for gram in trigrams(word):
+                tokens[gram] += weight
+    for values in vehicule_values:
+        for field, weight in VEHICULE_FIELDS.items():
+            for word in words(values.get(field)):
+                for gram in trigrams(word):
+                    tokens[gram] += weight
+    return tokens
+
+
+def reindex_trips(connection, trip_ids):
+    """Reconstruit les entrées d'index des voyages donnés (suppression + insertion groupée)"""
+    trip_ids = sorted(set(trip_ids))
+    table = TripSearchToken.__table__
+    for start in range(0, len(trip_ids), REINDEX_CHUNK):
+        chunk = trip_ids[start:start + REINDEX_CHUNK]
+        connection.execute(delete(table).where(table.c.id_trip.in_(chunk)))
+
+        trip_columns = [getattr(Trip, field) for field in TRIP_FIELDS]
+        trips = connection.execute(
+            select(Trip.id_trip, *trip_columns).where(Trip.id_trip.in_(chunk))
+        ).mappings().all()
+
+        vehicules = defaultdict(list)
+        for row in connection.execute(
+            select(TripAffectation.id_trip, Vehicule.matricule, Vehicule.modele)
+            .join(Vehicule, TripAffectation.id_vehicule == Vehicule.id_vehicule)
+            .where(TripAffectation.id_trip.in_(chunk))
+        ).mappings():
+            vehicules[row['id_trip']].append(row)
+
+        rows = []
+        for trip in trips:
+            for token, weight in document_tokens(trip, vehicules[trip['id_trip']]).items():
+                rows.append({'token': token, 'id_trip': trip['id_trip'], 'poids': weight})
+        if rows:
+            connection.execute(insert(table), rows)
+
+
+def _changed(obj, fields):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+def _after_flush(session, flush_context):
+    """Maintient l'index à chaque écriture de Trip, TripAffectation ou Vehicule"""
+    to_reindex = set()
+    to_delete = set()
+    changed_vehicules = set()
+
+    for obj in session.new:
+        if isinstance(obj, (Trip, TripAffectation)):
+            to_reindex.add(obj.id_trip)
+
+    # Modifications: seulement si un champ indexé (ou le couple voyage / véhicule) a changé,
+    # un changement d'état ou de montant ne réécrit pas l'index
+    for obj in session.dirty:
+        if isinstance(obj, Trip) and _changed(obj, TRIP_FIELDS):
+            to_reindex.add(obj.id_trip)
+        elif isinstance(obj, TripAffectation) and _changed(obj, ('id_trip', 'id_vehicule')):
+            history = inspect(obj).attrs.id_trip.history
+            to_reindex.update(history.deleted)
+            to_reindex.add(obj.id_trip)
+        elif isinstance(obj, Vehicule) and _changed(obj, VEHICULE_FIELDS):
+            changed_vehicules.add(obj.id_vehicule)
+
+    for obj in session.deleted:
+        if isinstance(obj, Trip):
+            to_delete.add(obj.id_trip)
+        elif isinstance(obj, TripAffectation):
+            to_reindex.add(obj.id_trip)
+
+    if not (to_reindex or to_delete or changed_vehicules):
+        return
+
+    connection = session.connection()
+    if changed_vehicules:
+        to_reindex.update(connection.execute(
+            select(distinct(TripAffectation.id_trip)).where(TripAffectation.id_vehicule.in_(changed_vehicules))
+        ).scalars())
+
+    to_reindex -= to_delete
+    to_reindex.discard(None)
+    if to_delete:
+        table = TripSearchToken.__table__
+        connection.execute(delete(table).where(table.c.id_trip.in_(to_delete)))
+    if to_reindex:
+        reindex_trips(connection, to_reindex)
+
+
+def ranked_trip_ids(term):
+    """
+    Retourne une sous-requête (id_trip, score) des voyages correspondant à `term`.
+    Chaque mot doit apparaître (en sous-chaîne) dans un des champs indexés; le score
+    additionne les poids des trigrammes trouvés. Seul l'index (token, id_trip) est lu;
+    comme pour tout index de trigrammes, de rares faux positifs sont possibles.
+    """
+    query_words = words(term)
+    if not query_words:
+        return None
+
+    table = TripSearchToken.__table__
+    grams = set()
+    short_words = []
+    for word in query_words:
+        if len(word) >= 3:
+            # Sans les trigrammes de bord: le mot cherché peut être au milieu d'un mot indexé
+            grams.update(word[i:i + 3] for i in range(len(word) - 2))
+        else:
+            short_words.append(word)
+
+    if grams:
+        ranked = select(
+            table.c.id_trip,
+            func.sum(table.c.poids).label('score')
+        ).where(
+            table.c.token.in_(grams)
+        ).group_by(table.c.id_trip).having(
+            func.count(distinct(table.c.token)) == len(grams)
+        )
+    else:
+        ranked = select(
+            table.c.id_trip,
+            func.sum(table.c.poids).label('score')
+        ).where(
+            table.c.token.like(f'{short_words[0]}%')
+        ).group_by(table.c.id_trip)
+        short_words = short_words[1:]
+
+    # Mots de moins de 3 caractères: préfixe de trigramme, qui reste une recherche d'index
+    for word in short_words:
+        ranked = ranked.where(table.c.id_trip.in_(
+            select(table.c.id_trip).where(table.c.token.like(f'{word}%'))
+        ))
+
+    return ranked.subquery('recherche')
+
+
+def search_trip_ids(term, limit=50):
+    """Identifiants des voyages correspondant à `term`, du plus pertinent au moins pertinent"""
+    ranked = ranked_trip_ids(term)
+    if ranked is None:
+        return []
+    rows = db.session.execute(
+        select(ranked.c.id_trip, ranked.c.score)
+        .order_by(ranked.c.score.desc(), ranked.c.id_trip.desc())
+        .limit(limit)
+    ).all()
+    return [(row.id_trip, int(row.score)) for row in rows]
+
+
+@click.command('reindex-trips')
+@with_appcontext
+def reindex_trips_command():
+    """Reconstruit entièrement l'index de recherche des voyages"""
+    trip_ids = db.session.execute(select(Trip.id_trip)).scalars().all()
+    db.session.execute(delete(TripSearchToken.__table__))
+    reindex_trips(db.session.connection(), trip_ids)
+    db.session.commit()
+    click.echo(f'{len(trip_ids)} voyages indexés.')
+
+
+def init_app(app):
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+    app.cli.add_command(reindex_trips_command)
@@ -0,0 +1,91 @@
+from sqlalchemy import and_, func, insert, select, text, update
+
+from models import db, Trip, TripCodeSequence
+
+# Le code tient dans Trip.code_voyage (String(10)): 'V' + AAMMJJ + 2 à 3 chiffres
+MAX_CODES_PER_DAY = 999
+
+
+def _base_code(day):
+    return f"V{day.strftime('%y%m%d')}"
+
+
+def format_code(day, number):
+    return f"{_base_code(day)}{number:02d}"
+
+
+def _legacy_last_number(connection, day):
+    """Plus grand numéro déjà utilisé ce jour-là (codes créés avant la table de séquences)"""
+    base = _base_code(day)
+    codes = connection.execute(
+        select(Trip.code_voyage).where(Trip.code_voyage.like(f"{base}%"))
+    ).scalars()
+    numbers = [int(code[len(base):]) for code in codes if code[len(base):].isdigit()]
+    return max(numbers, default=0)
+
+
+def _ensure_day(connection, day):
+    """Crée le compteur du jour s'il n'existe pas (un seul parcours des anciens codes par jour)"""
+    table = TripCodeSequence.__table__
+    exists = connection.execute(select(table.c.jour).where(table.c.jour == day)).first()
+    if exists:
+        return
+    statement = insert(table).values(jour=day, dernier=_legacy_last_number(connection, day))
+    if connection.dialect.name == 'mysql':
+        statement = statement.prefix_with('IGNORE')
+    elif connection.dialect.name == 'sqlite':
+        statement = statement.prefix_with('OR IGNORE')
+    connection.execute(statement)
+
+
+def _increment(connection, day, count):
+    """
+    Incrémente atomiquement le compteur et retourne la nouvelle valeur, ou None sans rien
+    modifier si le plafond du jour serait dépassé (la condition fait partie de l'UPDATE)
+    """
+    table = TripCodeSequence.__table__
+    within = and_(table.c.jour == day, table.c.dernier + count <= MAX_CODES_PER_DAY)
+    if connection.dialect.name == 'mysql':
+        # LAST_INSERT_ID(expr) mémorise la valeur pour cette connexion: pas de SELECT ... FOR UPDATE
+        result = connection.execute(
+            update(table).where(within).values(dernier=func.last_insert_id(table.c.dernier + count))
+        )
+        if not result.rowcount:
+            return None
+        return connection.execute(text('SELECT LAST_INSERT_ID()')).scalar()
+
+    # SQLite / autres: l'UPDATE pose le verrou d'écriture, la lecture qui suit est donc cohérente
+    result = connection.execute(update(table).where(within).values(dernier=table.c.dernier + count))
+    if not result.rowcount:
+        return None
+    return connection.execute(select(table.c.dernier).where(table.c.jour == day)).scalar()
+
+
+def reserve_codes(day, count=1):
+    """
+    Réserve `count` codes voyage consécutifs pour le jour `day` et les retourne.
+
+    Sous MySQL l'allocation se fait sur une connexion dédiée validée immédiatement, comme une
+    séquence: le verrou sur le compteur ne dure que le temps de l'incrément et un formulaire
+    annulé laisse simplement un trou dans la numérotation. SQLite n'ayant qu'un écrivain à la
+    fois, l'allocation y utilise la transaction de la session.
+    """
+    if count < 1:
+        return []
+
+    if db.engine.dialect.name == 'sqlite':
+        connection = db.session.connection()
+        _ensure_day(connection, day)
+        last = _increment(connection, day, count)
+    else:
+        with db.engine.begin() as connection:
+            _ensure_day(connection, day)
+            last = _increment(connection, day, count)
+
+    if last is None:
+        raise ValueError(f"Plus de {MAX_CODES_PER_DAY} voyages le {day.strftime('%d/%m/%Y')}: codes épuisés")
+    return [format_code(day, number) for number in range(last - count + 1, last + 1)]
+
+
+def next_voyage_code(day):
+    return reserve_codes(day, 1)[0]
@@ -0,0 +1,106 @@
+from datetime import datetime
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import selectinload
+
+from models import db, Trip, TripAffectation, TripDepense, Paiement
+from services import money
+
+
+def _money_sum(column, fk):
+    return select(func.coalesce(func.sum(column), 0)).where(fk == Trip.id_trip).scalar_subquery()
+
+
+def trip_figures_columns():
+    """Colonnes SQL calculées pour un voyage: dépenses annexes, dû, payé, reste, marge"""
+    total_depenses = _money_sum(TripDepense.total, TripDepense.id_trip)
+    total_paye = _money_sum(Paiement.montant_paye, Paiement.id_trip)
+    montant_du = case(
+        (Trip.is_commission.is_(True), func.coalesce(Trip.commission, 0)),
+        else_=func.coalesce(Trip.prix_vente, 0)
+    )
+    marge = case(
+        (Trip.is_commission.is_(True), func.coalesce(Trip.commission, 0)),
+        else_=func.coalesce(Trip.prix_vente, 0) - func.coalesce(Trip.prix_achat, 0) - total_depenses
+    )
+    return [
+        total_depenses.label('total_depenses'),
+        montant_du.label('montant_du'),
+        total_paye.label('total_paye'),
+        (montant_du - total_paye).label('reste_a_payer'),
+        marge.label('marge'),
+    ]
+
+
+class TripAggregate:
+    """Un voyage avec affectations, véhicules, chauffeurs, dépenses, paiements et totaux"""
+
+    FIGURES = ('total_depenses', 'montant_du', 'total_paye', 'reste_a_payer', 'marge')
+
+    def __init__(self, trip, figures):
+        self.trip = trip
+        self.affectations = trip.affectations
+        self.depenses = trip.depenses_supplementaires
+        self.paiements = sorted(trip.paiements, key=lambda p: p.date_paiement or datetime.min, reverse=True)
+        for name in self.FIGURES:
+            setattr(self, name, figures[name])
+
+    def to_dict(self):
+        trip = self.trip
+        return {
+            'id': trip.id_trip,
+            'code_voyage': trip.code_voyage,
+            'nom_voyage': trip.nom_voyage,
+            'nom': trip.nom,
+            'type': trip.type,
+            'etat_trip': trip.etat_trip,
+            'etat_paiement': trip.etat_paiement,
+            'point_depart': trip.point_depart,
+            'point_arrivee': trip.point_arrivee,
+            'date_depart': trip.date_depart.isoformat() if trip.date_depart else None,
+            'heure_depart': trip.heure_depart.strftime('%H:%M') if trip.heure_depart else None,
+            'date_arrivee': trip.date_arrivee.isoformat() if trip.date_arrivee else None,
+            'heure_arrivee': trip.heure_arrivee.strftime('%H:%M') if trip.heure_arrivee else None,
+            'client': {
+                'nom': trip.client_nom,
+                'telephone': trip.client_telephone,
+                'email': trip.client_email,
+            },
+            'affectations': [{
+                'id': a.id_affectation,
+                'vehicule': {'id': a.vehicule.id_vehicule, 'matricule': a.vehicule.matricule, 'modele': a.vehicule.modele},
+                'chauffeur': {'id': a.chauffeur.id_chauffeur, 'nom': a.chauffeur.nom, 'prenom': a.chauffeur.prenom},
+            } for a in self.affectations],
+            'depenses': [{
+                'id': d.id_depense,
+                'nom': d.nom,
+                'prix_unitaire': money.number(d.prix_unitaire),
+                'nombre_personnes': d.nombre_personnes,
+                'total': money.number(d.total),
+            } for d in self.depenses],
+            'paiements': [{
+                'id': p.id_paiement,
+                'mode_paiement': p.mode_paiement,
+                'montant_paye': money.number(p.montant_paye),
+                'date_paiement': p.date_paiement.isoformat() if p.date_paiement else None,
+            } for p in self.paiements],
+            'totaux': {name: money.number(getattr(self, name)) for name in self.FIGURES},
+        }
+
+
+def load_trip_aggregate(trip_id):
+    """
+    Charge un voyage complet en 4 requêtes: voyage + totaux SQL, puis affectations
+    (avec véhicules et chauffeurs), dépenses annexes et paiements en selectin.
+    Retourne None si le voyage n'existe pas.
+    """
+    statement = select(Trip, *trip_figures_columns()).where(Trip.id_trip == trip_id).options(
+        selectinload(Trip.affectations).joinedload(TripAffectation.vehicule),
+        selectinload(Trip.affectations).joinedload(TripAffectation.chauffeur),
+        selectinload(Trip.depenses_supplementaires),
+        selectinload(Trip.paiements)
+    )
+    row = db.session.execute(statement).first()
+    if row is None:
+        return None
+    return TripAggregate(row.Trip, row._mapping)